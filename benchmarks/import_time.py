@@ -0,0 +1,113 @@
+"""Import-time benchmark for the analysis modules and the CLI
+
+Each target is imported in a fresh interpreter, several times, and the best
+wall time is kept. Modules that a target must not pull in at import time
+(the plotting / mapping stack) are checked as well, so an eager import
+slipping back in fails even on a fast machine.
+
+    python benchmarks/import_time.py                   # compare with the baseline
+    python benchmarks/import_time.py --save-baseline   # record a new baseline
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(ROOT, 'src')
+BASELINE_FILE = os.path.join(ROOT, 'benchmarks', 'import_time_baseline.json')
+
+HEAVY_MODULES = ['pandas', 'geopandas', 'matplotlib', 'seaborn', 'folium', 'googlemaps', 'sklearn']
+
+# Target module -> heavy modules it is allowed to import eagerly
+TARGETS = {
+    'cli': [],
+    'pipeline': [],
+    'artifacts': [],
+    'instrumentation': [],
+    'timeline_store': [],
+    'segments': [],
+    'data_extraction': [],
+    'explore_data_structure': [],
+    'parallel_extraction': [],
+    'temporal_analysis': [],
+    'movement_metrics': [],
+    'place_clustering': [],
+    'route_index': [],
+    'rollups': [],
+    'segment_index': [],
+    'place_enrichment': [],
+    'spatial_index': [],
+    'geoanalysis': ['pandas'],
+    'webapp.app': [],
+}
+
+PROBE = """
+import sys, time, json
+sys.path.insert(0, {src!r})
+sys.path.insert(0, {webapp!r})
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'modules': sorted(sys.modules)}}))
+"""
+
+def measure(module, repeat):
+    """Best import time of module over repeat fresh interpreters, and its imports"""
+    target = 'app' if module == 'webapp.app' else module
+    code = PROBE.format(src=SRC_DIR, webapp=os.path.join(SRC_DIR, 'webapp'), module=target)
+    best = None
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True,
+                                capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        if best is None or result['seconds'] < best['seconds']:
+            best = result
+    return best
+
+def heavy_imports(modules, allowed):
+    loaded = {name.split('.')[0] for name in modules}
+    return sorted(name for name in HEAVY_MODULES if name in loaded and name not in allowed)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='fail when a target is this many times slower than the baseline')
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, 'r') as f:
+            baseline = json.load(f)
+
+    results = {}
+    failures = []
+    print(f"{'module':<22}{'ms':>9}{'baseline':>10}  heavy imports")
+    for module, allowed in TARGETS.items():
+        result = measure(module, args.repeat)
+        seconds = result['seconds']
+        results[module] = round(seconds, 4)
+        heavy = heavy_imports(result['modules'], allowed)
+        reference = baseline.get(module)
+        print(f"{module:<22}{seconds * 1000:>9.1f}"
+              f"{reference * 1000 if reference else float('nan'):>10.1f}  {', '.join(heavy) or '-'}")
+        if heavy:
+            failures.append(f"{module} imports {', '.join(heavy)} at import time")
+        # Sub-50ms imports are dominated by noise
+        if reference and seconds > max(reference * args.tolerance, reference + 0.05):
+            failures.append(f"{module} imports in {seconds * 1000:.0f} ms, baseline {reference * 1000:.0f} ms")
+
+    if args.save_baseline:
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to '{BASELINE_FILE}'")
+
+    for failure in failures:
+        print(f"REGRESSION: {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
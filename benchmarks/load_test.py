@@ -0,0 +1,212 @@
+"""Throughput and latency of the web app under concurrent clients
+
+Starts the app on a synthetic workspace (see run_benchmarks.py) in each
+requested serving mode, warms every URL once, then lets --clients threads
+request the URL mix over keep-alive connections for --duration seconds.
+Reports requests per second and p50 / p90 / p99 latency, overall and per
+URL. Results are saved under benchmarks/results/.
+
+    python benchmarks/load_test.py                            # dev vs production, 10k segments
+    python benchmarks/load_test.py --mode production --clients 32 --duration 30
+    python benchmarks/load_test.py --conditional              # clients revalidate with If-None-Match
+
+The clients run in this process, so on a machine with few cores they
+compete with the server for CPU; compare modes on the same machine.
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+from run_benchmarks import RESULTS_DIR, SRC_DIR, prepare_workspace  # noqa: E402
+
+# Pipeline outputs, rollups and the cached API routes, requested in turn
+URLS = [
+    '/static/analysis/location_analysis.html',
+    '/static/analysis/temporal_statistics.json',
+    '/static/analysis/location_statistics.json',
+    '/api/rollups/visits?by=weekday,hour',
+    '/api/rollups/activities?by=month,type&start=2016-01-01&end=2016-12-31',
+    '/api/markers?start=2016-03-01&end=2016-06-01',
+    '/api/tiles/6/31/21.json',
+    '/api/places',
+    '/api/routes/top?k=50'
+]
+
+# Command line of each serving mode, after 'cli.py serve --port N'
+MODES = {
+    'dev': [],
+    'production': ['--production']
+}
+
+STARTUP_TIMEOUT_S = 300
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(workspace, mode, port, threads):
+    command = [sys.executable, os.path.join(SRC_DIR, 'cli.py'), 'serve', '--port', str(port), *MODES[mode]]
+    if mode == 'production':
+        command += ['--threads', str(threads)]
+    server = subprocess.Popen(command, cwd=workspace, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + STARTUP_TIMEOUT_S
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'{mode} server exited with {server.returncode}')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/metrics')
+            connection.getresponse().read()
+            connection.close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f'{mode} server did not start within {STARTUP_TIMEOUT_S} s')
+
+def fetch(connection, url, headers):
+    """(status, body bytes, ETag) of one GET; raises on connection errors"""
+    connection.request('GET', url, headers=headers)
+    response = connection.getresponse()
+    body = response.read()
+    return response.status, len(body), response.getheader('ETag')
+
+def client(port, urls, offset, deadline, encoding, conditional, samples):
+    """Request urls in turn until the deadline, appending (url, status, seconds, bytes)"""
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    etags = {}
+    i = offset
+    while time.perf_counter() < deadline:
+        url = urls[i % len(urls)]
+        i += 1
+        headers = {'Accept-Encoding': encoding} if encoding else {}
+        if conditional and url in etags:
+            headers['If-None-Match'] = etags[url]
+        started = time.perf_counter()
+        try:
+            status, size, etag = fetch(connection, url, headers)
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            samples.append((url, None, time.perf_counter() - started, 0))
+            continue
+        samples.append((url, status, time.perf_counter() - started, size))
+        if etag:
+            etags[url] = etag
+    connection.close()
+
+def percentiles(seconds):
+    if len(seconds) < 2:
+        value = round(seconds[0] * 1000, 2) if seconds else None
+        return {'p50_ms': value, 'p90_ms': value, 'p99_ms': value, 'max_ms': value}
+    cuts = statistics.quantiles(seconds, n=100, method='inclusive')
+    return {
+        'p50_ms': round(cuts[49] * 1000, 2),
+        'p90_ms': round(cuts[89] * 1000, 2),
+        'p99_ms': round(cuts[98] * 1000, 2),
+        'max_ms': round(max(seconds) * 1000, 2)
+    }
+
+def summarize(samples, duration):
+    ok = [sample for sample in samples if sample[1] is not None and sample[1] < 500]
+    summary = {
+        'requests': len(samples),
+        'errors': len(samples) - len(ok),
+        'not_modified': sum(sample[1] == 304 for sample in ok),
+        'requests_per_s': round(len(ok) / duration, 1),
+        'mb_per_s': round(sum(sample[3] for sample in ok) / duration / (1 << 20), 2),
+        **percentiles([sample[2] for sample in ok])
+    }
+    by_url = {}
+    for url in dict.fromkeys(sample[0] for sample in samples):
+        seconds = [sample[2] for sample in ok if sample[0] == url]
+        by_url[url] = {'requests': len(seconds),
+                       'bytes': max((sample[3] for sample in ok if sample[0] == url), default=0),
+                       **percentiles(seconds)}
+    summary['by_url'] = by_url
+    return summary
+
+def run_load(port, urls, clients, duration, encoding, conditional):
+    # Cold indexes are built by the warm-up requests, not under load
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=STARTUP_TIMEOUT_S)
+    for url in urls:
+        fetch(connection, url, {'Accept-Encoding': encoding} if encoding else {})
+    connection.close()
+
+    samples = []
+    deadline = time.perf_counter() + duration
+    threads = [threading.Thread(target=client, args=(port, urls, i, deadline, encoding, conditional, samples))
+               for i in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(samples, time.perf_counter() - started)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--segments', type=int, default=10000, help='synthetic Timeline size')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--mode', action='append', choices=list(MODES),
+                        help='serving mode to test (repeatable, default all)')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent client connections')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of load per mode')
+    parser.add_argument('--threads', type=int, default=8, help='worker threads of the production server')
+    parser.add_argument('--encoding', default='gzip, br', help="Accept-Encoding sent ('' for none)")
+    parser.add_argument('--conditional', action='store_true',
+                        help='send If-None-Match with the last ETag seen for each URL')
+    parser.add_argument('--url', action='append', dest='urls', help='URL to request (repeatable)')
+    args = parser.parse_args()
+
+    workspace = prepare_workspace(args.segments, args.seed)
+    urls = args.urls or URLS
+    results = {}
+    for mode in args.mode or list(MODES):
+        port = free_port()
+        server = start_server(workspace, mode, port, args.threads)
+        try:
+            results[mode] = run_load(port, urls, args.clients, args.duration, args.encoding, args.conditional)
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"{'mode':<12}{'req/s':>9}{'MB/s':>8}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}{'errors':>8}")
+    for mode, summary in results.items():
+        print(f"{mode:<12}{summary['requests_per_s']:>9.1f}{summary['mb_per_s']:>8.2f}{summary['p50_ms']:>9.1f}"
+              f"{summary['p90_ms']:>9.1f}{summary['p99_ms']:>9.1f}{summary['max_ms']:>9.1f}{summary['errors']:>8}")
+    for mode, summary in results.items():
+        print(f"\n{mode}: {'url':<70}{'bytes':>10}{'p50 ms':>9}{'p99 ms':>9}")
+        for url, entry in summary['by_url'].items():
+            print(f"  {url:<76}{entry['bytes']:>10}{entry['p50_ms'] or 0:>9.1f}{entry['p99_ms'] or 0:>9.1f}")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    report = {
+        'segments': args.segments,
+        'seed': args.seed,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'clients': args.clients,
+        'duration_s': args.duration,
+        'threads': args.threads,
+        'encoding': args.encoding,
+        'conditional': args.conditional,
+        'cpus': os.cpu_count(),
+        'results': results
+    }
+    results_file = os.path.join(RESULTS_DIR, f"load-{args.segments}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(results_file, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved results to '{results_file}'")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Wall time and peak memory of the pipeline steps and web app routes
+
+A synthetic Timeline.json (see synthetic_timeline.py) is generated once per
+size and seed into a work directory. Every benchmark then runs in a fresh
+interpreter inside it: the setup is left out of the timing, the timed call
+is repeated --rounds times, and the process's peak RSS is recorded. Results
+are saved under benchmarks/results/ and compared with the baseline stored
+for the same size.
+
+    python benchmarks/run_benchmarks.py                       # 10k segments, compare
+    python benchmarks/run_benchmarks.py --segments 1000000 -k extract -k temporal
+    python benchmarks/run_benchmarks.py --save-baseline       # record a new baseline
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(ROOT), 'src')
+WORK_DIR = os.path.join(ROOT, '.work')
+RESULTS_DIR = os.path.join(ROOT, 'results')
+BASELINE_FILE = os.path.join(ROOT, 'benchmark_baseline.json')
+
+sys.path.insert(0, ROOT)
+from synthetic_timeline import VERSION as GENERATOR_VERSION, write_timeline  # noqa: E402
+
+# Requests timed by the webapp benchmarks; the first round of each is cold
+# (indexes built on first use), later rounds hit the in-memory caches
+ROUTES = {
+    'markers': '/api/markers',
+    'markers_filtered': '/api/markers?start=2016-03-01&end=2016-06-01&daily=08:00-09:00&weekdays=0,1,2,3,4',
+    'tile': '/api/tiles/6/31/21.json',
+    'places': '/api/places',
+    'routes_top': '/api/routes/top?k=50',
+    'segments': '/api/segments/activities?type=WALKING&limit=1000',
+    'temporal_stats': '/api/temporal-stats?start=2016-01-01&end=2017-01-01',
+    'rollups': '/api/rollups/activities?by=weekday,hour&start=2016-01-01&end=2016-12-31&type=WALKING',
+}
+
+WEBAPP_SETUP = """
+sys.path.insert(0, os.path.join({src!r}, 'webapp'))
+import pipeline
+pipeline.ensure_fresh()
+from app import app
+client = app.test_client()
+"""
+
+# name -> (setup, timed statement); both run with the work directory as cwd
+BENCHMARKS = {
+    'extract': ("from data_extraction import extract_timeline_data",
+                "extract_timeline_data()"),
+    'extract_streaming': ("from data_extraction import extract_timeline_data",
+                          "extract_timeline_data(streaming=True)"),
+    'temporal': ("from temporal_analysis import analyze_temporal_patterns",
+                 "analyze_temporal_patterns(render=False)"),
+    'temporal_plot': ("from temporal_analysis import analyze_temporal_patterns",
+                      "analyze_temporal_patterns()"),
+    # The uncapped map grows with the history; this times the bounded one
+    'geo': ("from geoanalysis import analyze_locations",
+            "analyze_locations(max_features=5000)"),
+    **{f'webapp:{name}': (WEBAPP_SETUP, f"assert client.get({url!r}).status_code == 200")
+       for name, url in ROUTES.items()}
+}
+
+PROBE = """
+import json, os, resource, sys, time
+sys.path.insert(0, {src!r})
+{setup}
+setup_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+times = []
+for _ in range({rounds}):
+    start = time.perf_counter()
+    {statement}
+    times.append(time.perf_counter() - start)
+print(json.dumps({{'times': times, 'setup_rss_kb': setup_rss_kb,
+                  'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}}))
+"""
+
+def prepare_workspace(segments, seed):
+    """Work directory holding a synthetic Timeline.json and an extracted store"""
+    # Workspaces of an older generator hold a different file for the same seed
+    workspace = os.path.join(WORK_DIR, f'{segments}-{seed}-v{GENERATOR_VERSION}')
+    timeline = os.path.join(workspace, 'data', 'Timeline.json')
+    os.makedirs(os.path.dirname(timeline), exist_ok=True)
+    os.makedirs(os.path.join(workspace, 'output'), exist_ok=True)
+    if not os.path.exists(timeline):
+        print(f"Generating {segments} segments into '{timeline}'")
+        write_timeline(timeline + '.tmp', segments, seed)
+        os.replace(timeline + '.tmp', timeline)
+    # Analysis benchmarks read the store and the web app serves the pipeline
+    # outputs; build them here so no benchmark's setup (and peak memory)
+    # includes a rebuild after the code changed
+    run_probe(workspace, "import pipeline", "pipeline.ensure_fresh()", 1)
+    return workspace
+
+def run_probe(workspace, setup, statement, rounds):
+    code = PROBE.format(src=SRC_DIR, setup=setup.format(src=SRC_DIR), statement=statement, rounds=rounds)
+    output = subprocess.run([sys.executable, '-c', code], cwd=workspace, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def summarize(result):
+    times = result['times']
+    return {
+        'min_s': round(min(times), 4),
+        'median_s': round(statistics.median(times), 4),
+        'first_s': round(times[0], 4),
+        'rounds': len(times),
+        'peak_mb': round(result['peak_rss_kb'] / 1024, 1),
+        'setup_mb': round(result['setup_rss_kb'] / 1024, 1)
+    }
+
+def compare(name, stats, reference, time_tolerance, memory_tolerance):
+    """Regression messages of one benchmark against its baseline entry"""
+    failures = []
+    # Sub-50ms timings are dominated by noise
+    if stats['min_s'] > max(reference['min_s'] * time_tolerance, reference['min_s'] + 0.05):
+        failures.append(f"{name} takes {stats['min_s'] * 1000:.0f} ms, baseline {reference['min_s'] * 1000:.0f} ms")
+    if stats['peak_mb'] > max(reference['peak_mb'] * memory_tolerance, reference['peak_mb'] + 20):
+        failures.append(f"{name} peaks at {stats['peak_mb']:.0f} MB, baseline {reference['peak_mb']:.0f} MB")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--segments', type=int, default=10000, help='synthetic Timeline size')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('-k', dest='select', action='append',
+                        help='only run benchmarks whose name contains this (repeatable)')
+    parser.add_argument('--time-tolerance', type=float, default=1.5,
+                        help='fail when a benchmark is this many times slower than the baseline')
+    parser.add_argument('--memory-tolerance', type=float, default=1.5,
+                        help='fail when a benchmark peaks this many times higher than the baseline')
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    baselines = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, 'r') as f:
+            baselines = json.load(f)
+    baseline = baselines.get(str(args.segments), {})
+
+    workspace = prepare_workspace(args.segments, args.seed)
+    selected = [name for name in BENCHMARKS
+                if not args.select or any(pattern in name for pattern in args.select)]
+
+    results = {}
+    failures = []
+    print(f"{'benchmark':<26}{'min ms':>10}{'median ms':>11}{'first ms':>10}{'peak MB':>9}{'baseline ms':>13}")
+    for name in selected:
+        setup, statement = BENCHMARKS[name]
+        stats = summarize(run_probe(workspace, setup, statement, args.rounds))
+        results[name] = stats
+        reference = baseline.get(name)
+        print(f"{name:<26}{stats['min_s'] * 1000:>10.1f}{stats['median_s'] * 1000:>11.1f}"
+              f"{stats['first_s'] * 1000:>10.1f}{stats['peak_mb']:>9.1f}"
+              f"{reference['min_s'] * 1000 if reference else float('nan'):>13.1f}")
+        if reference:
+            failures += compare(name, stats, reference, args.time_tolerance, args.memory_tolerance)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    report = {
+        'segments': args.segments,
+        'seed': args.seed,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'results': results
+    }
+    results_file = os.path.join(RESULTS_DIR, f"{args.segments}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(results_file, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved results to '{results_file}'")
+
+    if args.save_baseline:
+        baselines[str(args.segments)] = {**baseline, **results}
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(baselines, f, indent=2)
+        print(f"Saved baseline to '{BASELINE_FILE}'")
+
+    for failure in failures:
+        print(f"REGRESSION: {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""Synthetic Timeline.json generator for benchmarks
+
+Writes a semanticSegments export shaped like a real one: a home and a work
+place, a pool of other places that grows with the history, weekday commutes
+and errands, weekend trips, and some timelinePath segments mixed in. Times
+carry a daylight-saving timezone offset (and the odd trip abroad). The same
+size and seed always give the same file.
+
+One person produces a few thousand segments a year, so large files merge
+the histories of several simulated people (as if their exports had been
+combined) to keep every timestamp within HISTORY_YEARS.
+
+    python benchmarks/synthetic_timeline.py 100000 data/Timeline.json [--seed 1]
+
+Segments are written as they are generated, so 10M-segment files need no
+more memory than small ones.
+"""
+import argparse
+import json
+import heapq
+import math
+import random
+from datetime import datetime, timedelta, timezone
+
+EARTH_RADIUS_M = 6_371_008.8
+
+HOME = (51.5074, -0.1278)
+
+START = datetime(2015, 1, 1, tzinfo=timezone.utc)
+
+# Every day starts at home at WAKE_HOUR local time, give or take
+# WAKE_JITTER_MINUTES; the jitter never carries over to the next day
+WAKE_HOUR = 7
+WAKE_JITTER_MINUTES = 45
+
+# Bumped whenever the same size and seed start giving a different file
+VERSION = 2
+
+# Each simulated person covers at most this many years from START
+HISTORY_YEARS = 10
+SEGMENTS_PER_DAY = 5
+
+# Places other than home and work; the pool grows with the history length
+MIN_PLACES = 50
+PLACES_PER_SEGMENT = 0.01
+MAX_PLACES = 20000
+
+# Share of segments written as timelinePath (raw location runs)
+PATH_SHARE = 0.1
+
+SEMANTIC_TYPES = ['UNKNOWN', 'SEARCHED_ADDRESS', 'ALIASED_LOCATION', 'INFERRED_WORK', 'INFERRED_HOME']
+
+# Activity type -> (typical speed in km/h, detour factor over the great circle)
+ACTIVITY_TYPES = {
+    'WALKING': (5, 1.3),
+    'CYCLING': (15, 1.25),
+    'IN_BUS': (20, 1.4),
+    'IN_SUBWAY': (30, 1.3),
+    'IN_PASSENGER_VEHICLE': (40, 1.35),
+    'IN_TRAIN': (80, 1.2),
+    'FLYING': (700, 1.05)
+}
+
+def _distance_m(a, b):
+    lat1, lng1, lat2, lng2 = map(math.radians, (*a, *b))
+    h = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(h))
+
+def _latlng(point):
+    return f'{point[0]:.7f}°, {point[1]:.7f}°'
+
+def _offset_minutes(moment, abroad):
+    """UTC offset of a UK-like zone with summer time, or of a trip abroad"""
+    if abroad:
+        return abroad
+    return 60 if 4 <= moment.month <= 9 else 0
+
+def _timestamp(moment, offset):
+    local = moment + timedelta(minutes=offset)
+    sign = '+' if offset >= 0 else '-'
+    return (local.strftime('%Y-%m-%dT%H:%M:%S.') + f'{local.microsecond // 1000:03d}'
+            f'{sign}{abs(offset) // 60:02d}:{abs(offset) % 60:02d}')
+
+class TimelineGenerator:
+    """Yields semanticSegments dicts for a simulated person, in time order"""
+
+    def __init__(self, segments, seed=1, start=START, home=HOME, prefix=''):
+        self.random = random.Random(seed)
+        self.segments = segments
+        self.day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        self.now = self.day + timedelta(hours=WAKE_HOUR)
+        self.abroad = 0
+        self.center = home
+        self.prefix = prefix
+        places = min(MAX_PLACES, max(MIN_PLACES, int(segments * PLACES_PER_SEGMENT)))
+        self.home = (f'{prefix}home', home, 'INFERRED_HOME')
+        self.work = (f'{prefix}work', (home[0] + 0.05, home[1] - 0.08), 'INFERRED_WORK')
+        self.places = [self._random_place(i) for i in range(places)]
+        # A few favourites get most of the visits
+        self.weights = [1 / (rank + 1) for rank in range(places)]
+        self.here = self.home
+
+    def _random_place(self, number):
+        # Most places are in town, some in the wider region
+        spread = 0.08 if self.random.random() < 0.8 else 1.5
+        point = (self.center[0] + self.random.gauss(0, spread), self.center[1] + self.random.gauss(0, spread * 1.5))
+        return (f'ChIJsynthetic{self.prefix}{number:07d}', point, self.random.choice(SEMANTIC_TYPES))
+
+    def _offset(self):
+        return _offset_minutes(self.now, self.abroad)
+
+    def _visit(self, place, minutes):
+        end = self.now + timedelta(minutes=minutes)
+        offset = self._offset()
+        segment = {
+            'startTime': _timestamp(self.now, offset),
+            'endTime': _timestamp(end, offset),
+            'startTimeTimezoneUtcOffsetMinutes': offset,
+            'endTimeTimezoneUtcOffsetMinutes': offset,
+            'visit': {
+                'hierarchyLevel': 0,
+                'probability': round(self.random.uniform(0.5, 1), 3),
+                'topCandidate': {
+                    'placeId': place[0],
+                    'semanticType': place[2],
+                    'probability': round(self.random.uniform(0.3, 1), 3),
+                    'placeLocation': {'latLng': _latlng(place[1])}
+                }
+            }
+        }
+        self.now = end
+        self.here = place
+        return segment
+
+    def _activity(self, destination):
+        distance = _distance_m(self.here[1], destination[1])
+        if distance < 1500:
+            kind = 'WALKING'
+        elif distance > 300_000:
+            kind = 'FLYING'
+        else:
+            kind = self.random.choice(['CYCLING', 'IN_BUS', 'IN_SUBWAY', 'IN_PASSENGER_VEHICLE', 'IN_TRAIN'])
+        speed, detour = ACTIVITY_TYPES[kind]
+        travelled = max(distance * detour, 50)
+        minutes = max(2, travelled / 1000 / speed * 60 * self.random.uniform(0.8, 1.4))
+        end = self.now + timedelta(minutes=minutes)
+        offset = self._offset()
+        segment = {
+            'startTime': _timestamp(self.now, offset),
+            'endTime': _timestamp(end, offset),
+            'startTimeTimezoneUtcOffsetMinutes': offset,
+            'endTimeTimezoneUtcOffsetMinutes': offset,
+            'activity': {
+                'start': {'latLng': _latlng(self.here[1])},
+                'end': {'latLng': _latlng(destination[1])},
+                'distanceMeters': round(travelled, 1),
+                'topCandidate': {'type': kind, 'probability': round(self.random.uniform(0.4, 1), 3)}
+            }
+        }
+        self.now = end
+        return segment
+
+    def _path(self, minutes):
+        """A timelinePath segment: a few raw points around the current place"""
+        end = self.now + timedelta(minutes=minutes)
+        offset = self._offset()
+        points = []
+        for i in range(self.random.randint(2, 6)):
+            lat, lng = self.here[1]
+            moment = self.now + timedelta(minutes=minutes * i / 6)
+            points.append({'point': _latlng((lat + self.random.gauss(0, 0.0005), lng + self.random.gauss(0, 0.0005))),
+                           'time': _timestamp(moment, offset)})
+        segment = {'startTime': _timestamp(self.now, offset), 'endTime': _timestamp(end, offset),
+                   'timelinePath': points}
+        return segment
+
+    def _wake_up(self, day, jitter):
+        """UTC time of the morning of a calendar day (a UTC midnight)"""
+        return day + timedelta(hours=WAKE_HOUR, minutes=jitter - _offset_minutes(day, 0))
+
+    def _other_place(self):
+        return self.random.choices(self.places, self.weights)[0]
+
+    def _day_plan(self):
+        """(place, minutes) stops of one day, starting and ending at home"""
+        weekday = (self.now + timedelta(minutes=self._offset())).weekday()
+        stops = []
+        if weekday < 5 and self.random.random() < 0.9:
+            stops.append((self.work, self.random.randint(420, 560)))
+            if self.random.random() < 0.4:
+                stops.append((self._other_place(), self.random.randint(15, 120)))
+        else:
+            for _ in range(self.random.randint(0, 4)):
+                stops.append((self._other_place(), self.random.randint(20, 240)))
+        return stops
+
+    def __iter__(self):
+        written = 0
+        while written < self.segments:
+            # Now and then the whole day is spent abroad, in another timezone
+            self.abroad = self.random.choice([-300, 120, 540]) if self.random.random() < 0.01 else 0
+            for place, minutes in self._day_plan():
+                if written < self.segments:
+                    yield self._activity(place)
+                    written += 1
+                if written < self.segments:
+                    yield self._visit(place, minutes)
+                    written += 1
+                if written < self.segments and self.random.random() < PATH_SHARE * 2:
+                    yield self._path(self.random.randint(5, 30))
+                    written += 1
+            if self.here is not self.home and written < self.segments:
+                yield self._activity(self.home)
+                written += 1
+            # Home until the next morning, skipping any day the plan ran into
+            jitter = self.random.uniform(-WAKE_JITTER_MINUTES, WAKE_JITTER_MINUTES)
+            self.day += timedelta(days=1)
+            while self._wake_up(self.day, jitter) < self.now + timedelta(minutes=30):
+                self.day += timedelta(days=1)
+            minutes = (self._wake_up(self.day, jitter) - self.now).total_seconds() / 60
+            if written < self.segments:
+                yield self._visit(self.home, minutes)
+                written += 1
+
+def _start_time(segment):
+    return datetime.fromisoformat(segment['startTime'])
+
+def generate_segments(segments, seed=1):
+    """Synthetic segments in start-time order, from as many people as needed"""
+    per_person = HISTORY_YEARS * 365 * SEGMENTS_PER_DAY
+    people = max(1, math.ceil(segments / per_person))
+    if people == 1:
+        return iter(TimelineGenerator(segments, seed))
+    places = random.Random(seed)
+    generators = []
+    for person in range(people):
+        count = segments // people + (person < segments % people)
+        # Everyone lives somewhere in Great Britain
+        home = (places.uniform(50.5, 55.5), places.uniform(-4.5, 0.5))
+        generators.append(TimelineGenerator(count, seed * 100_003 + person, home=home, prefix=f'p{person}-'))
+    return heapq.merge(*generators, key=_start_time)
+
+def write_timeline(path, segments, seed=1, chunk_size=10000):
+    """Write a synthetic Timeline.json with the given number of segments"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{"semanticSegments": [')
+        separator = '\n'
+        chunk = []
+        for segment in generate_segments(segments, seed):
+            chunk.append(json.dumps(segment, ensure_ascii=False))
+            if len(chunk) == chunk_size:
+                f.write(separator + ',\n'.join(chunk))
+                separator = ',\n'
+                chunk = []
+        if chunk:
+            f.write(separator + ',\n'.join(chunk))
+        f.write('\n], "rawSignals": [], "userLocationProfile": {}}\n')
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic Timeline.json')
+    parser.add_argument('segments', type=int, help='number of semanticSegments (1k to 10M)')
+    parser.add_argument('output', nargs='?', default='data/Timeline.json')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    write_timeline(args.output, args.segments, args.seed)
+    print(f"Wrote {args.segments} segments to '{args.output}'")
+
+if __name__ == "__main__":
+    main()
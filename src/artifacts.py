@@ -0,0 +1,124 @@
+"""Pre-compressed copies of the generated analysis outputs
+
+Every text output (the location map, the statistics JSON, ...) gets a .gz
+and, when the optional brotli package is installed, a .br copy next to it,
+written once after the pipeline rebuilds it rather than on every request.
+A copy carries its source's mtime, so a copy whose mtime differs belongs
+to an older version of the file and is never served.
+
+    precompress('output/location_analysis.html')
+    path, encoding = compressed_variant('output/location_analysis.html', 'gzip, br')
+"""
+import gzip
+import os
+
+# Only text formats compress usefully; PNGs are compressed already
+COMPRESSIBLE = {'.html', '.json', '.js', '.css', '.svg', '.txt'}
+
+# Smaller files are not worth a second request header and file
+MIN_BYTES = 1024
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+# Suffix of each encoding's copy, in order of preference
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+def available_encodings():
+    """Encodings copies are written in: gzip, plus br with the brotli package"""
+    return ['br', 'gzip'] if _brotli() is not None else ['gzip']
+
+def compressible(path):
+    return os.path.splitext(path)[1].lower() in COMPRESSIBLE
+
+def _encode(data, encoding):
+    if encoding == 'br':
+        return _brotli().compress(data, quality=BROTLI_QUALITY)
+    # mtime=0 keeps the copy identical for identical content
+    return gzip.compress(data, GZIP_LEVEL, mtime=0)
+
+def _fresh(copy, stat):
+    try:
+        return os.stat(copy).st_mtime_ns == stat.st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+def precompress(path):
+    """Write the missing or outdated compressed copies of a file
+
+    Returns the encodings written. Copies that would not be smaller than
+    the file are removed instead.
+    """
+    if not compressible(path) or not os.path.exists(path):
+        return []
+    stat = os.stat(path)
+    written = []
+    data = None
+    for encoding in available_encodings():
+        copy = path + SUFFIXES[encoding]
+        if _fresh(copy, stat):
+            continue
+        if data is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+        encoded = _encode(data, encoding) if len(data) >= MIN_BYTES else None
+        if encoded is None or len(encoded) >= len(data):
+            if os.path.exists(copy):
+                os.remove(copy)
+            continue
+        with open(copy + '.tmp', 'wb') as f:
+            f.write(encoded)
+        os.utime(copy + '.tmp', ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(copy + '.tmp', copy)
+        written.append(encoding)
+    return written
+
+def precompress_outputs(paths=None, directory='output'):
+    """precompress every given file (default: the files of directory)
+
+    Returns {path: encodings written}, leaving out files already up to date.
+    """
+    if paths is None:
+        paths = [os.path.join(directory, name) for name in sorted(os.listdir(directory))] \
+            if os.path.isdir(directory) else []
+    written = {}
+    for path in paths:
+        encodings = precompress(path)
+        if encodings:
+            written[path] = encodings
+    return written
+
+def accepted_encodings(accept_encoding):
+    """Content codings a client accepts, from its Accept-Encoding header"""
+    accepted = set()
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding or params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(coding)
+    return accepted
+
+def compressed_variant(path, accept_encoding):
+    """(path of the copy to send, its encoding), or (path, None) for the file itself
+
+    Picks the best up-to-date copy the client accepts.
+    """
+    accepted = accepted_encodings(accept_encoding)
+    if not accepted or not compressible(path):
+        return path, None
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return path, None
+    for encoding, suffix in SUFFIXES.items():
+        if (encoding in accepted or '*' in accepted) and _fresh(path + suffix, stat):
+            return path + suffix, encoding
+    return path, None
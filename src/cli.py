@@ -0,0 +1,145 @@
+"""Command line entry point for the Timeline analysis scripts
+
+    python src/cli.py extract [--incremental | --streaming] [--validate] [--output FILE] [file]
+    python src/cli.py extract [--workers N] [--output FILE] files ...
+    python src/cli.py profile [file] [--output report.json] [--full | --sample]
+    python src/cli.py temporal [--no-plot]
+    python src/cli.py geo [--max-features N] [--max-html-bytes BYTES]
+    python src/cli.py tiles
+    python src/cli.py rollups
+    python src/cli.py enrich [--base-url URL]
+    python src/cli.py serve [--host HOST] [--port PORT] [--production [--threads N]]
+
+Only argparse is imported up front; each subcommand imports the modules it
+needs when it runs, so `--help` and cheap commands start instantly.
+"""
+import argparse
+import os
+import sys
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+EXTRACT_OUTPUT = 'data/extracted_timeline.json'
+
+def _batch_extract(args):
+    return len(args.inputs) > 1 or bool(args.workers)
+
+def check_extract(parser, args):
+    """Reject the single-file options a parallel batch extraction would ignore"""
+    if not _batch_extract(args):
+        return
+    given = [option for option, value in (('--streaming', args.streaming), ('--incremental', args.incremental),
+                                          ('--validate', args.validate))
+             if value]
+    if given:
+        parser.error(f"extract: several inputs or --workers cannot be combined with {', '.join(given)}")
+
+def run_extract(args):
+    if _batch_extract(args):
+        from parallel_extraction import extract_timeline_batch
+        extract_timeline_batch(args.inputs, args.output or EXTRACT_OUTPUT, workers=args.workers)
+    else:
+        from data_extraction import extract_timeline_data
+        extract_timeline_data(args.inputs[0], args.output or EXTRACT_OUTPUT, streaming=args.streaming,
+                              incremental=args.incremental, validate=args.validate)
+
+def run_profile(args):
+    from explore_data_structure import profile_and_print
+    profile_and_print(args.input, args.output, full=args.full)
+
+def run_temporal(args):
+    from temporal_analysis import analyze_temporal_patterns
+    analyze_temporal_patterns(render=not args.no_plot)
+
+def run_geo(args):
+    from geoanalysis import analyze_locations
+    analyze_locations(max_features=args.max_features or None, max_html_bytes=args.max_html_bytes)
+
+def run_tiles(args):
+    from spatial_index import build_spatial_index
+    build_spatial_index()
+
+def run_rollups(args):
+    from rollups import build_rollups
+    build_rollups()
+
+def run_enrich(args):
+    from place_enrichment import GoogleMapsBackend, enrich_places
+    enrich_places(GoogleMapsBackend(args.api_key, args.base_url), ttl_days=args.ttl_days, concurrency=args.concurrency, rate=args.rate)
+
+def run_serve(args):
+    sys.path.insert(0, os.path.join(SRC_DIR, 'webapp'))
+    if args.production:
+        from app import run_production
+        run_production(args.host, args.port, args.threads)
+    else:
+        from app import app
+        app.run(host=args.host, port=args.port, debug=args.debug)
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='cli.py', description='Google Timeline analysis')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    extract = commands.add_parser('extract', help='extract visits and activities from Timeline exports')
+    extract.add_argument('inputs', nargs='*', default=['data/Timeline.json'],
+                         help='Timeline.json exports; several are extracted in parallel')
+    extract.add_argument('--output', help=f'extracted JSON file (default {EXTRACT_OUTPUT})')
+    mode = extract.add_mutually_exclusive_group()
+    mode.add_argument('--streaming', action='store_true', help='stream the input with bounded memory')
+    mode.add_argument('--incremental', action='store_true', help='only re-extract changed days')
+    mode.add_argument('--workers', type=int, help='extract with a process pool of this size')
+    extract.add_argument('--validate', action='store_true',
+                         help='profile the input first and stop if it cannot be extracted')
+    extract.set_defaults(handler=run_extract)
+
+    profile = commands.add_parser('profile', help='schema profile of a Timeline export')
+    profile.add_argument('input', nargs='?', default='data/Timeline.json')
+    profile.add_argument('--output', default='output/schema_report.json', help='JSON report')
+    scan = profile.add_mutually_exclusive_group()
+    scan.add_argument('--full', action='store_const', const=True, dest='full', help='parse the whole file')
+    scan.add_argument('--sample', action='store_const', const=False, dest='full', help='sample the file')
+    profile.set_defaults(handler=run_profile)
+
+    temporal = commands.add_parser('temporal', help='temporal statistics and plots')
+    temporal.add_argument('--no-plot', action='store_true', help='skip rendering temporal_patterns.png')
+    temporal.set_defaults(handler=run_temporal)
+
+    geo = commands.add_parser('geo', help='location map and statistics')
+    geo.add_argument('--max-features', type=int,
+                     help='cap the markers and lines drawn on the map, merging nearby ones (default: no limit)')
+    geo.add_argument('--max-html-bytes', type=int, help='re-render with fewer features above this map size')
+    geo.set_defaults(handler=run_geo)
+
+    tiles = commands.add_parser('tiles', help='precompute the map tile index')
+    tiles.set_defaults(handler=run_tiles)
+
+    rollups = commands.add_parser('rollups', help='precompute the statistics rollup cubes')
+    rollups.set_defaults(handler=run_rollups)
+
+    enrich = commands.add_parser('enrich', help='fetch Google place details for visited places')
+    enrich.add_argument('--api-key', help='defaults to GOOGLE_API_KEY')
+    enrich.add_argument('--base-url', help='Places API server, e.g. a local fake_places_server')
+    enrich.add_argument('--concurrency', type=int, default=8)
+    enrich.add_argument('--rate', type=float, default=10, help='requests per second')
+    enrich.add_argument('--ttl-days', type=float, default=30, help='cache lifetime of fetched details')
+    enrich.set_defaults(handler=run_enrich)
+
+    serve = commands.add_parser('serve', help='run the web app')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=5000)
+    serve.add_argument('--debug', action='store_true')
+    serve.add_argument('--production', action='store_true',
+                       help='threaded server (waitress if installed), pre-compressed outputs, background rebuilds')
+    serve.add_argument('--threads', type=int, default=8, help='worker threads of the production server')
+    serve.set_defaults(handler=run_serve)
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'extract':
+        check_extract(parser, args)
+    args.handler(args)
+
+if __name__ == "__main__":
+    main()
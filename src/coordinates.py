@@ -0,0 +1,28 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Timeline latLng strings look like "51.5007292°, -0.1246254°". Numbers
+# must be ones the float cast accepts, or one bad row would fail the column.
+NUMBER_PATTERN = r'[-+]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?'
+LATLNG_PATTERN = rf'^\s*{NUMBER_PATTERN}°?\s*,\s*{NUMBER_PATTERN}°?\s*$'
+
+def parse_latlng_array(values):
+    """Parse a column of "lat°, lng°" strings in one vectorized pass
+
+    Accepts any sequence, pandas Series or Arrow array of strings (missing
+    values allowed). Returns a C-contiguous float64 array of shape (N, 2)
+    holding [lat, lng] rows, and a boolean mask of the rows that parsed;
+    invalid rows are NaN.
+    """
+    strings = values if isinstance(values, pa.Array) else pa.array(values, pa.string(), from_pandas=True)
+    valid = pc.fill_null(pc.match_substring_regex(strings, LATLNG_PATTERN), False)
+
+    # Only well-formed strings reach the split/cast kernels
+    cleaned = pc.replace_substring(strings.filter(valid), '°', '')
+    parts = pc.utf8_trim_whitespace(pc.list_flatten(pc.split_pattern(cleaned, ',', max_splits=1)))
+
+    mask = valid.to_numpy(zero_copy_only=False)
+    coords = np.full((len(strings), 2), np.nan)
+    coords[mask] = pc.cast(parts, pa.float64()).to_numpy().reshape(-1, 2)
+    return coords, mask
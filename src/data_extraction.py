@@ -1,68 +1,418 @@
-import pandas as pd
-import geopandas as gpd
-import matplotlib.pyplot as plt
-import seaborn as sns
-import folium
 from icecream import ic
 import json
-from googlemaps import Client
+import hashlib
+import itertools
+import ijson
+import shutil
+import tempfile
+import io
 import collections
-import time
-from datetime import datetime
 import os
-from dotenv import load_dotenv
+from datetime import datetime, timezone
+from timeline_store import (STORE_DIR, UNDATED, StoreWriter, write_store, replace_days, read_table,
+                            load_manifest, save_manifest)
+from instrumentation import stage
 
-# Load environment variables
-load_dotenv()
+# Number of records buffered before each write in streaming mode
+STREAM_CHUNK_SIZE = 1000
 
-# Get API key from environment variable
-GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
+def parse_segment(segment):
+    """Turn one semantic segment into a ('visit' | 'activity', record) pair"""
+    # Common time data
+    time_data = {
+        'start_time': segment.get('startTime'),
+        'end_time': segment.get('endTime'),
+        'timezone_offset': segment.get('startTimeTimezoneUtcOffsetMinutes')
+    }
+
+    if 'visit' in segment:
+        visit = segment['visit']
+        top_candidate = visit.get('topCandidate', {})
+
+        visit_data = {
+            **time_data,
+            'place_id': top_candidate.get('placeId'),
+            'semantic_type': top_candidate.get('semanticType'),
+            'probability': visit.get('probability'),
+            'hierarchy_level': visit.get('hierarchyLevel'),
+            'location': top_candidate.get('placeLocation', {}).get('latLng')
+        }
+        return 'visit', visit_data
+
+    elif 'activity' in segment:
+        activity = segment['activity']
+        top_candidate = activity.get('topCandidate', {})
+
+        activity_data = {
+            **time_data,
+            'type': top_candidate.get('type'),
+            'probability': top_candidate.get('probability'),
+            'distance_meters': activity.get('distanceMeters'),
+            'start_location': activity.get('start', {}).get('latLng'),
+            'end_location': activity.get('end', {}).get('latLng')
+        }
+        return 'activity', activity_data
+
+    # timelinePath and any other segment kinds carry no visit/activity record
+    return None, None
+
+def iter_timeline_segments(input_file='data/Timeline.json', progress=None, every=STREAM_CHUNK_SIZE):
+    """Stream the raw semantic segments of Timeline.json one at a time
+
+    progress, if given, is called as progress(bytes_read, segments) every
+    `every` segments and once at the end.
+    """
+    segments = 0
+    with open(input_file, 'rb') as f:
+        for segment in ijson.items(f, 'semanticSegments.item', use_float=True):
+            yield segment
+            segments += 1
+            if progress is not None and segments % every == 0:
+                progress(f.tell(), segments)
+        if progress is not None:
+            progress(f.tell(), segments)
+
+def iter_timeline_records(input_file='data/Timeline.json', progress=None, every=STREAM_CHUNK_SIZE):
+    """Stream (kind, record) pairs from Timeline.json one segment at a time
+
+    Segments that are neither visits nor activities are yielded as
+    (None, None) so callers can still count them. progress is reported as
+    in iter_timeline_segments.
+    """
+    for segment in iter_timeline_segments(input_file, progress, every):
+        yield parse_segment(segment)
+
+def write_records(f, chunk, first):
+    """Append a chunk of records to an open JSON array"""
+    if not chunk:
+        return first
+    separator = ',\n    '
+    f.write(('\n    ' if first else separator) + separator.join(chunk))
+    return False
+
+def _extract_streaming(input_file, output_file, chunk_size, store, progress=None):
+    """Write extracted records in chunks while the input is being parsed
+
+    Visits go straight into the output file; activities are spooled to a
+    temporary file and appended once the input is exhausted, so only one
+    chunk of each is ever held in memory. Records are also fed to the
+    columnar store writer when one is given, which then gets the manifest
+    of the extracted days. Without an output_file only the store is written.
+    """
+    counts = collections.Counter()
+    visit_chunk = []
+    activity_chunk = []
+    first_visit = True
+    first_activity = True
+    days = collections.defaultdict(DaySummary)
+
+    write_json = output_file is not None
+    with (open(output_file, 'w') if write_json else io.StringIO()) as out, tempfile.TemporaryFile('w+') as spool:
+        out.write('{\n  "visits": [')
+
+        for segment in iter_timeline_segments(input_file, progress, chunk_size):
+            kind, record = parse_segment(segment)
+            counts['segments'] += 1
+            if store is not None:
+                days[segment_day(segment)].add(segment)
+            if kind == 'visit':
+                counts['visits'] += 1
+                if store is not None:
+                    store.add('visits', record)
+                if write_json:
+                    visit_chunk.append(json.dumps(record))
+                if len(visit_chunk) >= chunk_size:
+                    first_visit = write_records(out, visit_chunk, first_visit)
+                    visit_chunk = []
+            elif kind == 'activity':
+                counts['activities'] += 1
+                if store is not None:
+                    store.add('activities', record)
+                if write_json:
+                    activity_chunk.append(json.dumps(record))
+                if len(activity_chunk) >= chunk_size:
+                    first_activity = write_records(spool, activity_chunk, first_activity)
+                    activity_chunk = []
+
+        write_records(out, visit_chunk, first_visit)
+        write_records(spool, activity_chunk, first_activity)
+
+        out.write('\n  ],\n  "activities": [')
+        spool.seek(0)
+        shutil.copyfileobj(spool, out)
+
+        metadata = {
+            'total_segments': counts['segments'],
+            'total_visits': counts['visits'],
+            'total_activities': counts['activities'],
+            'extraction_date': datetime.now().isoformat()
+        }
+        out.write('\n  ],\n  "metadata": ' + json.dumps(metadata) + '\n}\n')
+
+    if store is not None:
+        store.manifest = day_manifest(days)
+    return metadata
+
+def segment_day(segment):
+    """UTC day ('YYYY-MM-DD') a segment starts on, which is its partition"""
+    start_time = segment.get('startTime')
+    if not start_time:
+        return UNDATED
+    return datetime.fromisoformat(start_time).astimezone(timezone.utc).date().isoformat()
+
+def _iter_day_runs(input_file):
+    """Stream runs of consecutive segments that start on the same UTC day"""
+    with open(input_file, 'rb') as f:
+        segments = ijson.items(f, 'semanticSegments.item', use_float=True)
+        for day, run in itertools.groupby(segments, key=segment_day):
+            yield day, list(run)
+
+class DaySummary:
+    """Content hash, counts and last end time of one day partition
+
+    Segments are added in input order; a day split over several runs of
+    the input gets the same summary as if its segments were contiguous.
+    The hash is taken over per-segment hashes, so the summaries of
+    consecutive parts of the input combine with extend (see
+    parallel_extraction).
+    """
+
+    def __init__(self):
+        self.segment_hashes = bytearray()
+        self.segments = 0
+        self.visits = 0
+        self.activities = 0
+        self.end_time = None
+
+    def add(self, segment):
+        self.segment_hashes += hashlib.sha1(json.dumps(segment, sort_keys=True).encode()).digest()
+        self.segments += 1
+        self.visits += 'visit' in segment
+        self.activities += 'activity' in segment
+        if segment.get('endTime'):
+            end_time = datetime.fromisoformat(segment['endTime'])
+            if self.end_time is None or end_time > self.end_time:
+                self.end_time = end_time
+
+    def extend(self, other):
+        """Append the segments of a summary of a later part of the input"""
+        self.segment_hashes += other.segment_hashes
+        self.segments += other.segments
+        self.visits += other.visits
+        self.activities += other.activities
+        if other.end_time is not None and (self.end_time is None or other.end_time > self.end_time):
+            self.end_time = other.end_time
+
+    def describe(self):
+        return {
+            'hash': hashlib.sha1(self.segment_hashes).hexdigest(),
+            'segments': self.segments,
+            'visits': self.visits,
+            'activities': self.activities,
+            'end_time': self.end_time.isoformat() if self.end_time else None
+        }
+
+def _describe_day(segments):
+    """Manifest entry of one day partition"""
+    summary = DaySummary()
+    for segment in segments:
+        summary.add(segment)
+    return summary.describe()
+
+def day_manifest(partitions):
+    """Store manifest of the given day partitions (DaySummary or manifest entries)
+
+    The watermark is the latest segment endTime of any day.
+    """
+    partitions = {day: entry.describe() if isinstance(entry, DaySummary) else entry
+                  for day, entry in partitions.items()}
+    end_times = [entry['end_time'] for entry in partitions.values() if entry['end_time']]
+    return {
+        'watermark': max(end_times, key=datetime.fromisoformat) if end_times else None,
+        'partitions': partitions
+    }
+
+def extract_incremental(input_file='data/Timeline.json', store_dir=STORE_DIR):
+    """Re-extract only the day partitions that changed since the last run
+
+    The store manifest keeps a watermark (the last segment endTime seen) and
+    a content hash per UTC day. Days whose hash still matches are skipped
+    without building records; new, changed and vanished days are merged
+    into the store, rewriting only the monthly files they fall in. Full
+    extractions save the same manifest, so a first run without one
+    extracts everything and later runs only the changes.
+
+    Only the columnar store is updated; extracted_timeline.json is not.
+    A store holding a batch extraction of other exports (see
+    parallel_extraction) is left as it is.
+    """
+    manifest = load_manifest(store_dir)
+    known = manifest['partitions']
+    if manifest.get('inputs') and manifest['inputs'] != [os.path.abspath(input_file)]:
+        # Re-extracting this one export would drop the days of the others
+        ic(f"Store holds a batch extraction of {len(manifest['inputs'])} files; not re-extracting {input_file}")
+        return {'metadata': {
+            'total_segments': sum(entry['segments'] for entry in known.values()),
+            'total_visits': sum(entry['visits'] for entry in known.values()),
+            'total_activities': sum(entry['activities'] for entry in known.values()),
+            'extraction_date': datetime.now().isoformat(),
+            'new_days': 0,
+            'changed_days': 0,
+            'removed_days': 0
+        }}
+    watermark = manifest['watermark']
+    watermark_day = segment_day({'startTime': watermark}) if watermark else None
+
+    partitions = {}
+    changed = {}
+    fragmented = set()
+
+    for day, segments in _iter_day_runs(input_file):
+        if day in partitions:
+            # Out-of-order input; this day is rebuilt from all its runs below
+            fragmented.add(day)
+            continue
+        partitions[day] = _describe_day(segments)
+        if known.get(day, {}).get('hash') != partitions[day]['hash']:
+            changed[day] = [parse_segment(segment) for segment in segments]
+
+    if fragmented:
+        runs = collections.defaultdict(list)
+        for day, segments in _iter_day_runs(input_file):
+            if day in fragmented:
+                runs[day].extend(segments)
+        for day, segments in runs.items():
+            partitions[day] = _describe_day(segments)
+            changed.pop(day, None)
+            if known.get(day, {}).get('hash') != partitions[day]['hash']:
+                changed[day] = [parse_segment(segment) for segment in segments]
+
+    # Days merged from uploads (see merge_store) are kept until the input has them
+    merged = {day: entry for day, entry in known.items() if day not in partitions and entry.get('merged')}
+    removed = [day for day in known if day not in partitions and day not in merged]
+    days = list(changed) + removed
+    if days:
+        for kind, name in (('visit', 'visits'), ('activity', 'activities')):
+            records = [record for parsed in changed.values()
+                       for record_kind, record in parsed if record_kind == kind]
+            replace_days(name, records, days, store_dir)
+
+    save_manifest(day_manifest({**partitions, **merged}), store_dir)
+
+    appended = sum(1 for day in changed
+                   if watermark_day is None or day == UNDATED or day > watermark_day)
+    metadata = {
+        'total_segments': sum(entry['segments'] for entry in partitions.values()),
+        'total_visits': sum(entry['visits'] for entry in partitions.values()),
+        'total_activities': sum(entry['activities'] for entry in partitions.values()),
+        'extraction_date': datetime.now().isoformat(),
+        'new_days': appended,
+        'changed_days': len(changed) - appended,
+        'removed_days': len(removed)
+    }
+    ic(f"Re-extracted {len(changed)} of {len(partitions)} days ({appended} past the watermark), "
+       f"dropped {len(removed)}")
+    return {'metadata': metadata}
+
+def merge_store(source_dir, store_dir=STORE_DIR):
+    """Merge the days of another store, such as an extracted upload, into the store
+
+    Each day of the source replaces the same day of the store and every
+    other day is kept, unlike extract_incremental, which drops the days its
+    input no longer holds. Merged days are marked in the manifest, so a
+    later incremental extraction keeps them unless its input has the day.
+    Returns the merged days.
+    """
+    source = load_manifest(source_dir)
+    days = list(source['partitions'])
+    if not days:
+        return days
+    for name in ('visits', 'activities'):
+        replace_days(name, read_table(name, store_dir=source_dir), days, store_dir)
+    manifest = load_manifest(store_dir)
+    partitions = {**manifest['partitions'],
+                  **{day: {**entry, 'merged': True} for day, entry in source['partitions'].items()}}
+    # Keeps the inputs of a batch extraction, which the merge adds to
+    manifest.update(day_manifest(partitions))
+    save_manifest(manifest, store_dir)
+    ic(f"Merged {len(days)} days into the store")
+    return days
+
+def extract_timeline_data(input_file='data/Timeline.json',
+                          output_file='data/extracted_timeline.json',
+                          streaming=False, chunk_size=STREAM_CHUNK_SIZE,
+                          store_dir=STORE_DIR, incremental=False, progress=None, validate=False):
+    """Extract both visits and activities from Timeline.json
+
+    With streaming=True the input is parsed incrementally and the output is
+    written in chunks of chunk_size records, keeping memory bounded. Only
+    the metadata is returned in that case, progress (see
+    iter_timeline_records) is reported while parsing and output_file may be
+    None to only fill the store.
+
+    Unless store_dir is None, the records are also written to the columnar
+    store read by the analysis modules. incremental=True only refreshes the
+    store for the days that changed since the last run (see
+    extract_incremental).
+
+    validate=True profiles the input first (see explore_data_structure),
+    writes the schema report and raises ValueError instead of extracting
+    input that would fail or come out empty.
+    """
+    if validate:
+        from explore_data_structure import REPORT_FILE, check_input
+        with stage('extract.validate') as metrics:
+            report = check_input(input_file, REPORT_FILE)
+            metrics.count('segments', report['segments'])
+        for problem in report['problems']:
+            ic(f"{problem['level']}: {problem['message']}")
+
+    if incremental:
+        with stage('extract.incremental') as metrics:
+            metrics.read_file(input_file)
+            result = extract_incremental(input_file, store_dir)
+            metadata = result['metadata']
+            for key in ('total_segments', 'new_days', 'changed_days', 'removed_days'):
+                metrics.count(key.replace('total_', ''), metadata[key])
+        return result
+
+    if streaming:
+        with stage('extract.stream') as metrics:
+            metrics.read_file(input_file)
+            if store_dir is None:
+                metadata = _extract_streaming(input_file, output_file, chunk_size, None, progress)
+            else:
+                with StoreWriter(store_dir, chunk_size) as store:
+                    metadata = _extract_streaming(input_file, output_file, chunk_size, store, progress)
+            if output_file is not None:
+                metrics.wrote_file(output_file)
+            for key in ('total_segments', 'total_visits', 'total_activities'):
+                metrics.count(key.replace('total_', ''), metadata[key])
+        ic(f"Extracted {metadata['total_visits']} visits and {metadata['total_activities']} activities")
+        return {'metadata': metadata}
+
+    with stage('extract.load_json') as metrics:
+        metrics.read_file(input_file)
+        with open(input_file, 'r') as f:
+            data = json.load(f)
+        metrics.count('segments', len(data.get('semanticSegments', [])))
 
-def extract_timeline_data(input_file='data/Timeline.json'):
-    """Extract both visits and activities from Timeline.json"""
-    
-    with open(input_file, 'r') as f:
-        data = json.load(f)
-    
     visits = []
     activities = []
-    
-    for segment in data.get('semanticSegments', []):
-        # Common time data
-        time_data = {
-            'start_time': segment.get('startTime'),
-            'end_time': segment.get('endTime'),
-            'timezone_offset': segment.get('startTimeTimezoneUtcOffsetMinutes')
-        }
-        
-        if 'visit' in segment:
-            visit = segment['visit']
-            top_candidate = visit.get('topCandidate', {})
-            
-            visit_data = {
-                **time_data,
-                'place_id': top_candidate.get('placeId'),
-                'semantic_type': top_candidate.get('semanticType'),
-                'probability': visit.get('probability'),
-                'hierarchy_level': visit.get('hierarchyLevel'),
-                'location': top_candidate.get('placeLocation', {}).get('latLng')
-            }
-            visits.append(visit_data)
-            
-        elif 'activity' in segment:
-            activity = segment['activity']
-            top_candidate = activity.get('topCandidate', {})
-            
-            activity_data = {
-                **time_data,
-                'type': top_candidate.get('type'),
-                'probability': top_candidate.get('probability'),
-                'distance_meters': activity.get('distanceMeters'),
-                'start_location': activity.get('start', {}).get('latLng'),
-                'end_location': activity.get('end', {}).get('latLng')
-            }
-            activities.append(activity_data)
-    
+    days = collections.defaultdict(DaySummary)
+
+    with stage('extract.parse') as metrics:
+        for segment in data.get('semanticSegments', []):
+            kind, record = parse_segment(segment)
+            if store_dir is not None:
+                days[segment_day(segment)].add(segment)
+            if kind == 'visit':
+                visits.append(record)
+            elif kind == 'activity':
+                activities.append(record)
+        metrics.count('visits', len(visits))
+        metrics.count('activities', len(activities))
+
     # Save extracted data
     extracted_data = {
         'metadata': {
@@ -74,12 +424,20 @@ def extract_timeline_data(input_file='data/Timeline.json'):
         'visits': visits,
         'activities': activities
     }
-    
-    with open('data/extracted_timeline.json', 'w') as f:
-        json.dump(extracted_data, f, indent=2)
-    
+
+    with stage('extract.write_json') as metrics:
+        with open(output_file, 'w') as f:
+            json.dump(extracted_data, f, indent=2)
+        metrics.wrote_file(output_file)
+
+    if store_dir is not None:
+        with stage('extract.write_store') as metrics:
+            write_store(visits, activities, store_dir, day_manifest(days))
+            metrics.count('visits', len(visits))
+            metrics.count('activities', len(activities))
+
     ic(f"Extracted {len(visits)} visits and {len(activities)} activities")
     return extracted_data
 
 if __name__ == "__main__":
-    extract_timeline_data()
\ No newline at end of file
+    extract_timeline_data()
@@ -1,110 +1,143 @@
 import json
 import os
+import ijson
 from icecream import ic
 
-# Load the original data
-with open('data/detailed_places_full.json', 'r') as f:
-    data = json.load(f)
+INPUT_FILE = 'data/detailed_places_full.json'
 
-# Debug: Print structure of first place
-first_place = data['places'][0]
-ic("Original data structure:", {
-    'keys': first_place.keys(),
-    'original_data_keys': first_place['original_data'].keys(),
-    'google_details_keys': first_place['google_details'].keys()
-})
-
-def filter_place_details_minimal(place):
-    """Create minimal dataset for geographic analysis"""
-    google_details = place['google_details']
-    
-    filtered_details = {
-        'name': google_details.get('name'),
-        'geometry': {
-            'location': google_details.get('geometry', {}).get('location', {})
-        },
-        'types': google_details.get('types'),
-        'rating': google_details.get('rating'),
-        'price_level': google_details.get('price_level')
+# Each projection lists the fields it keeps from a place's original_data and
+# google_details. A field is a dotted path ('geometry.location' keeps just
+# that nested value) or a (path, default) pair for values that may be missing.
+PROJECTIONS = {
+    # Minimal dataset for geographic analysis
+    'minimal': {
+        'output': 'data/github_places.json',
+        'original_data': ['placeId', 'location'],
+        'google_details': ['name', ('geometry.location', {}), 'types', 'rating', 'price_level']
+    },
+    # Dataset keeping all possible time-related fields
+    'temporal': {
+        'output': 'data/github_places_temporal.json',
+        'original_data': ['placeId', 'location', 'timestamp', 'duration', 'visitTime', 'lastVisitTime',
+                          'timeSpent', 'visitStartTime', 'visitEndTime'],
+        'google_details': ['name', ('geometry.location', {}), 'types', 'rating']
     }
-    
+}
+
+def _compile(fields):
+    """Field specs as (keys, default) pairs, split once up front"""
+    compiled = []
+    for field in fields:
+        path, default = field if isinstance(field, tuple) else (field, None)
+        compiled.append((tuple(path.split('.')), default))
+    return compiled
+
+def _project(source, fields):
+    """Copy the given compiled (possibly nested) fields of a dict"""
+    result = {}
+    for keys, default in fields:
+        value = source
+        for key in keys:
+            value = value.get(key) if isinstance(value, dict) else None
+        if value is None:
+            value = default
+        target = result
+        for key in keys[:-1]:
+            target = target.setdefault(key, {})
+        target[keys[-1]] = value
+    return result
+
+def compile_projection(projection):
+    """A projection with its field specs compiled, for project_place"""
+    return {part: _compile(projection[part]) for part in ('original_data', 'google_details')}
+
+def project_place(place, compiled):
+    """Apply one compiled projection to a place"""
     return {
-        'original_data': {
-            'placeId': place['original_data'].get('placeId'),
-            'location': place['original_data'].get('location')
-        },
-        'google_details': filtered_details
+        'original_data': _project(place.get('original_data') or {}, compiled['original_data']),
+        'google_details': _project(place.get('google_details') or {}, compiled['google_details'])
     }
 
+def filter_place_details_minimal(place):
+    """Create minimal dataset for geographic analysis"""
+    return project_place(place, compile_projection(PROJECTIONS['minimal']))
+
 def filter_place_details_temporal(place):
     """Create dataset with temporal information"""
-    google_details = place['google_details']
-    original_data = place['original_data']
-    
-    # Keep all possible time-related fields
-    temporal_data = {
-        'placeId': original_data.get('placeId'),
-        'location': original_data.get('location'),
-        'timestamp': original_data.get('timestamp'),
-        'duration': original_data.get('duration'),
-        'visitTime': original_data.get('visitTime'),
-        'lastVisitTime': original_data.get('lastVisitTime'),
-        'timeSpent': original_data.get('timeSpent'),
-        'visitStartTime': original_data.get('visitStartTime'),
-        'visitEndTime': original_data.get('visitEndTime')
-    }
-    
-    filtered_details = {
-        'name': google_details.get('name'),
-        'geometry': {
-            'location': google_details.get('geometry', {}).get('location', {})
-        },
-        'types': google_details.get('types'),
-        'rating': google_details.get('rating')
-    }
-    
-    return {
-        'original_data': temporal_data,
-        'google_details': filtered_details
-    }
+    return project_place(place, compile_projection(PROJECTIONS['temporal']))
 
-# Create filtered datasets
-minimal_data = {
-    'metadata': {
-        'total_places': len(data['places']),
-        'filtered_date': data['metadata'].get('filtered_date')
-    },
-    'places': [filter_place_details_minimal(place) for place in data['places']]
-}
+def iter_places(f, chunk_size=1 << 20):
+    """Stream ('place', place) for every places item and ('metadata', metadata)
 
-temporal_data = {
-    'metadata': {
-        'total_places': len(data['places']),
-        'filtered_date': data['metadata'].get('filtered_date')
-    },
-    'places': [filter_place_details_temporal(place) for place in data['places']]
-}
+    The file is read once, in chunks pushed to two C-level ijson parsers:
+    one yielding places items, one picking up metadata wherever it appears
+    (and dropped as soon as it has). Only the places of one chunk are ever
+    materialized at a time.
+    """
+    places = ijson.sendable_list()
+    metadata = ijson.sendable_list()
+    places_parser = ijson.items_coro(places, 'places.item', use_float=True)
+    metadata_parser = ijson.items_coro(metadata, 'metadata', use_float=True)
+    for chunk in iter(lambda: f.read(chunk_size), b''):
+        places_parser.send(chunk)
+        if metadata_parser is not None:
+            metadata_parser.send(chunk)
+            if metadata:
+                yield 'metadata', metadata[0]
+                metadata_parser = None
+        for place in places:
+            yield 'place', place
+        del places[:]
+    places_parser.close()
+    for place in places:
+        yield 'place', place
+    if metadata_parser is not None:
+        metadata_parser.close()
+        if metadata:
+            yield 'metadata', metadata[0]
+
+def filter_places(input_file=INPUT_FILE, projections=PROJECTIONS):
+    """Write every projection of the places in input_file in a single pass
+
+    Places are streamed from the input and each one is projected and
+    appended to all outputs before the next is read, so memory stays flat
+    whatever the input size. Each output's metadata is written after its
+    places, once the totals are known. Returns the metadata.
+    """
+    outputs = {name: open(projection['output'], 'w') for name, projection in projections.items()}
+    try:
+        for out in outputs.values():
+            out.write('{"places": [')
+
+        compiled = {name: compile_projection(projection) for name, projection in projections.items()}
+        count = 0
+        input_metadata = {}
+        with open(input_file, 'rb') as f:
+            for kind, value in iter_places(f):
+                if kind == 'metadata':
+                    input_metadata = value
+                    continue
+                separator = ', ' if count else ''
+                for name, out in outputs.items():
+                    out.write(separator + json.dumps(project_place(value, compiled[name])))
+                count += 1
+
+        metadata = {
+            'total_places': count,
+            'filtered_date': input_metadata.get('filtered_date')
+        }
+        for out in outputs.values():
+            out.write('], "metadata": ' + json.dumps(metadata) + '}')
+    finally:
+        for out in outputs.values():
+            out.close()
+    return metadata
+
+if __name__ == "__main__":
+    metadata = filter_places()
 
-# Save both datasets
-with open('data/github_places.json', 'w') as f:
-    json.dump(minimal_data, f)
-
-with open('data/github_places_temporal.json', 'w') as f:
-    json.dump(temporal_data, f)
-
-# Print file sizes and example data
-original_size = os.path.getsize('data/detailed_places_full.json') / (1024 * 1024)
-minimal_size = os.path.getsize('data/github_places.json') / (1024 * 1024)
-temporal_size = os.path.getsize('data/github_places_temporal.json') / (1024 * 1024)
-
-ic(f"Original file size: {original_size:.2f} MB")
-ic(f"Minimal file size: {minimal_size:.2f} MB")
-ic(f"Temporal file size: {temporal_size:.2f} MB")
-
-# Print example of temporal data structure
-if temporal_data['places']:
-    example_place = temporal_data['places'][0]
-    ic("Temporal data structure:", {
-        'original_data_keys': example_place['original_data'].keys(),
-        'google_details_keys': example_place['google_details'].keys()
-    }) 
\ No newline at end of file
+    # Print file sizes
+    ic(f"Original file size: {os.path.getsize(INPUT_FILE) / (1024 * 1024):.2f} MB")
+    for name, projection in PROJECTIONS.items():
+        ic(f"{name.capitalize()} file size: {os.path.getsize(projection['output']) / (1024 * 1024):.2f} MB")
+    ic(f"Filtered {metadata['total_places']} places")
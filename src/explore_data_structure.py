@@ -1,80 +1,437 @@
+"""Streaming schema profiler for Timeline.json exports
+
+    python src/explore_data_structure.py [data/Timeline.json] [--output output/schema_report.json] [--full]
+
+One pass over the semantic segments, with bounded memory, reports for each
+segment kind (visit, activity, and anything else such as timelinePath,
+which the extractor ignores):
+
+- how many segments there are and which key sets they come with,
+- for every field path (e.g. 'visit.topCandidate.placeLocation.latLng'),
+  how often it is present or null, its JSON types and its value range
+  (numbers, timestamps, latitude/longitude ranges of "lat°, lng°"
+  strings, string lengths and the first few distinct values),
+- a few example segments, kept by reservoir sampling.
+
+Files up to FULL_SCAN_BYTES are parsed completely. Larger files are sampled:
+SAMPLE_WINDOWS windows of WINDOW_BYTES spread evenly over the file are
+decoded from the first segment starting in each, and counts are scaled up
+to the whole file, so even multi-GB exports take seconds. Sampled reports
+say so ('sampled': true) and only see segments that carry a startTime.
+
+validate_report() turns a report into the problems the extractor cares
+about; check_input() runs both and raises ValueError on errors.
+"""
+import argparse
 import json
-from icecream import ic
-from collections import defaultdict
-
-def explore_structure(data, max_samples=5):
-    """Explore the structure of Timeline.json data"""
-    
-    segments = data.get('semanticSegments', [])
-    ic("Total segments:", len(segments))
-    
-    # Separate activities and visits
-    activity_segments = [s for s in segments if 'activity' in s]
-    visit_segments = [s for s in segments if 'visit' in s]
-    
-    ic("Number of activity segments:", len(activity_segments))
-    ic("Number of visit segments:", len(visit_segments))
-    
-    # Analyze activity segments
-    ic("\nEXAMINING ACTIVITY SEGMENTS:")
-    for i, segment in enumerate(activity_segments[:max_samples]):
-        ic(f"\nActivity {i}:")
-        ic("Time range:", {
-            'start': segment.get('startTime'),
-            'end': segment.get('endTime'),
-            'timezone_offset': segment.get('startTimeTimezoneUtcOffsetMinutes')
-        })
-        
-        activity = segment['activity']
-        ic("Activity data:", {
-            'type': activity.get('topCandidate', {}).get('type'),
-            'probability': activity.get('topCandidate', {}).get('probability'),
-            'distance_meters': activity.get('distanceMeters'),
-            'start_location': activity.get('start', {}).get('latLng'),
-            'end_location': activity.get('end', {}).get('latLng')
-        })
-    
-    # Analyze visit segments
-    ic("\nEXAMINING VISIT SEGMENTS:")
-    for i, segment in enumerate(visit_segments[:max_samples]):
-        ic(f"\nVisit {i}:")
-        ic("Time range:", {
-            'start': segment.get('startTime'),
-            'end': segment.get('endTime'),
-            'timezone_offset': segment.get('startTimeTimezoneUtcOffsetMinutes')
-        })
-        
-        visit = segment['visit']
-        top_candidate = visit.get('topCandidate', {})
-        ic("Visit data:", {
-            'hierarchy_level': visit.get('hierarchyLevel'),
-            'probability': visit.get('probability'),
-            'place_id': top_candidate.get('placeId'),
-            'semantic_type': top_candidate.get('semanticType'),
-            'location': top_candidate.get('placeLocation', {}).get('latLng')
-        })
-    
-    # Verify structure consistency
-    ic("\nVERIFYING STRUCTURE CONSISTENCY:")
-    activity_structures = defaultdict(int)
-    visit_structures = defaultdict(int)
-    
-    for segment in activity_segments:
-        key = tuple(sorted(segment['activity'].keys()))
-        activity_structures[key] += 1
-    
-    for segment in visit_segments:
-        key = tuple(sorted(segment['visit'].keys()))
-        visit_structures[key] += 1
-    
-    ic("Unique activity structures found:", len(activity_structures))
-    ic("Activity structure frequencies:", dict(activity_structures))
-    
-    ic("Unique visit structures found:", len(visit_structures))
-    ic("Visit structure frequencies:", dict(visit_structures))
+import os
+import random
+import time
+from collections import Counter
+from datetime import datetime
+
+REPORT_FILE = 'output/schema_report.json'
+
+# Above this size the file is sampled rather than parsed completely
+FULL_SCAN_BYTES = 32 << 20
+SAMPLE_WINDOWS = 64
+WINDOW_BYTES = 256 << 10
+
+# Example segments kept per kind
+SAMPLES_PER_KIND = 3
+
+# Bounds on what is remembered per kind and per field
+MAX_KEY_SETS = 32
+MAX_VALUES = 16
+MAX_LIST_ITEMS = 4
+
+# Segment keys shared by every kind; the remaining keys name the kind
+COMMON_KEYS = frozenset(['startTime', 'endTime', 'startTimeTimezoneUtcOffsetMinutes',
+                         'endTimeTimezoneUtcOffsetMinutes'])
+
+# Kinds data_extraction.parse_segment turns into records, and the fields it reads
+EXTRACTED_FIELDS = {
+    'visit': {
+        'startTime': 'time',
+        'endTime': 'time',
+        'startTimeTimezoneUtcOffsetMinutes': 'number',
+        'visit.probability': 'number',
+        'visit.hierarchyLevel': 'number',
+        'visit.topCandidate.placeId': 'string',
+        'visit.topCandidate.semanticType': 'string',
+        'visit.topCandidate.placeLocation.latLng': 'latlng'
+    },
+    'activity': {
+        'startTime': 'time',
+        'endTime': 'time',
+        'startTimeTimezoneUtcOffsetMinutes': 'number',
+        'activity.distanceMeters': 'number',
+        'activity.topCandidate.type': 'string',
+        'activity.topCandidate.probability': 'number',
+        'activity.start.latLng': 'latlng',
+        'activity.end.latLng': 'latlng'
+    }
+}
+
+def _parse_time(value):
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    # Timeline times always carry an offset; naive ones cannot be placed
+    return moment if moment.tzinfo is not None else None
+
+def _parse_latlng(value):
+    parts = value.replace('°', '').split(',')
+    if len(parts) != 2:
+        return None
+    try:
+        lat, lng = float(parts[0]), float(parts[1])
+    except ValueError:
+        return None
+    return (lat, lng) if -90 <= lat <= 90 and -180 <= lng <= 180 else None
+
+def _value_type(value):
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, (int, float)):
+        return 'number'
+    return {str: 'string', dict: 'object', list: 'array'}[type(value)]
+
+class _Range:
+    __slots__ = ('low', 'high')
+
+    def __init__(self):
+        self.low = self.high = None
+
+    def add(self, value):
+        if self.low is None or value < self.low:
+            self.low = value
+        if self.high is None or value > self.high:
+            self.high = value
+
+class FieldStats:
+    """Presence, types and value range of one field path, in bounded memory"""
+
+    __slots__ = ('present', 'types', 'numbers', 'times', 'lats', 'lngs', 'lengths', 'invalid',
+                 'values', 'more_values')
+
+    def __init__(self):
+        self.present = 0
+        self.types = Counter()
+        self.numbers = _Range()
+        self.times = _Range()
+        self.lats = _Range()
+        self.lngs = _Range()
+        self.lengths = _Range()
+        self.invalid = 0
+        self.values = Counter()
+        self.more_values = False
+
+    def add(self, key, value):
+        self.present += 1
+        kind = _value_type(value)
+        self.types[kind] += 1
+        if kind == 'number':
+            self.numbers.add(value)
+        elif kind == 'array':
+            self.lengths.add(len(value))
+        elif kind == 'string':
+            if key.endswith('Time') or key == 'time':
+                moment = _parse_time(value)
+                if moment is None:
+                    self.invalid += 1
+                else:
+                    self.times.add(moment)
+            elif key in ('latLng', 'point') or '°' in value:
+                point = _parse_latlng(value)
+                if point is None:
+                    self.invalid += 1
+                else:
+                    self.lats.add(point[0])
+                    self.lngs.add(point[1])
+            else:
+                self.lengths.add(len(value))
+                self._count_value(value)
+        elif kind == 'boolean':
+            self._count_value(value)
+
+    def _count_value(self, value):
+        if value in self.values or len(self.values) < MAX_VALUES:
+            self.values[value] += 1
+        else:
+            self.more_values = True
+
+    def report(self, total, scale=1.0):
+        """JSON-ready summary; total is the number of segments of the kind
+
+        Rates are left out (None) for fields inside arrays, which can occur
+        several times per segment.
+        """
+        nulls = self.types.get('null', 0)
+        result = {
+            'present': round(self.present * scale),
+            'missing_rate': round(1 - self.present / total, 6) if total else None,
+            'null_rate': round(nulls / total, 6) if total else None,
+            'types': {name: round(count * scale) for name, count in self.types.most_common()}
+        }
+        if self.numbers.low is not None:
+            result['min'], result['max'] = self.numbers.low, self.numbers.high
+        if self.times.low is not None:
+            result['min'], result['max'] = self.times.low.isoformat(), self.times.high.isoformat()
+        if self.lats.low is not None:
+            result['lat_range'] = [self.lats.low, self.lats.high]
+            result['lng_range'] = [self.lngs.low, self.lngs.high]
+        if self.lengths.low is not None:
+            result['length_range'] = [self.lengths.low, self.lengths.high]
+        if self.invalid:
+            result['invalid'] = round(self.invalid * scale)
+        if self.values:
+            result['values'] = {str(value): round(count * scale) for value, count in self.values.most_common()}
+            result['more_values'] = self.more_values
+        return result
+
+class _KindStats:
+    __slots__ = ('count', 'key_sets', 'other_key_sets', 'fields', 'samples')
+
+    def __init__(self):
+        self.count = 0
+        self.key_sets = Counter()
+        self.other_key_sets = 0
+        self.fields = {}
+        self.samples = []
+
+class SchemaProfiler:
+    """Accumulates the profile of segments passed to add()"""
+
+    def __init__(self, samples=SAMPLES_PER_KIND, seed=0):
+        self.samples = samples
+        self.random = random.Random(seed)
+        self.kinds = {}
+        self.segments = 0
+
+    def add(self, segment):
+        self.segments += 1
+        if not isinstance(segment, dict):
+            kind = _value_type(segment)
+            stats = self.kinds.setdefault(kind, _KindStats())
+            stats.count += 1
+            return
+        payload = sorted(key for key in segment if key not in COMMON_KEYS)
+        kind = '+'.join(payload) or 'empty'
+        stats = self.kinds.get(kind)
+        if stats is None:
+            stats = self.kinds[kind] = _KindStats()
+        stats.count += 1
+
+        # Key sets of the segment and of its payload objects
+        key_set = tuple(sorted(segment)) + tuple(
+            f'{name}.{key}' for name in payload if isinstance(segment[name], dict)
+            for key in sorted(segment[name]))
+        if key_set in stats.key_sets or len(stats.key_sets) < MAX_KEY_SETS:
+            stats.key_sets[key_set] += 1
+        else:
+            stats.other_key_sets += 1
+
+        self._add_fields(stats.fields, '', segment)
+
+        # Reservoir sampling (algorithm R) of example segments
+        if len(stats.samples) < self.samples:
+            stats.samples.append(segment)
+        else:
+            slot = self.random.randrange(stats.count)
+            if slot < self.samples:
+                stats.samples[slot] = segment
+
+    def _add_fields(self, fields, prefix, value):
+        for key, item in value.items():
+            path = prefix + key
+            field = fields.get(path)
+            if field is None:
+                field = fields[path] = FieldStats()
+            field.add(key, item)
+            if isinstance(item, dict):
+                self._add_fields(fields, path + '.', item)
+            elif isinstance(item, list):
+                item_path = path + '[]'
+                for element in item[:MAX_LIST_ITEMS]:
+                    if isinstance(element, dict):
+                        self._add_fields(fields, item_path + '.', element)
+                    else:
+                        if item_path not in fields:
+                            fields[item_path] = FieldStats()
+                        fields[item_path].add(key, element)
+
+    def report(self, scale=1.0):
+        """Profile as a JSON-ready dict; counts are multiplied by scale"""
+        kinds = {}
+        for kind, stats in sorted(self.kinds.items(), key=lambda item: -item[1].count):
+            kinds[kind] = {
+                'count': round(stats.count * scale),
+                'key_sets': [{'keys': list(keys), 'count': round(count * scale)}
+                             for keys, count in stats.key_sets.most_common()],
+                'other_key_sets': round(stats.other_key_sets * scale),
+                'fields': {path: field.report(None if '[]' in path else stats.count, scale)
+                           for path, field in sorted(stats.fields.items())},
+                'samples': stats.samples
+            }
+        return {
+            'segments': round(self.segments * scale),
+            'kinds': kinds,
+            'unexpected_kinds': {kind: entry['count'] for kind, entry in kinds.items()
+                                 if kind not in EXTRACTED_FIELDS}
+        }
+
+def iter_segments(input_file):
+    """Every semantic segment of the file, streamed with ijson"""
+    import ijson
+
+    with open(input_file, 'rb') as f:
+        yield from ijson.items(f, 'semanticSegments.item', use_float=True)
+
+def _window_segments(text, decoder=json.JSONDecoder()):
+    """Whole segments found in a window of text, which may start mid-segment"""
+    position = text.find('"startTime"')
+    while position != -1:
+        brace = text.rfind('{', 0, position)
+        segment = None
+        if brace != -1:
+            try:
+                segment, end = decoder.raw_decode(text, brace)
+            except ValueError:
+                # Cut off by the window, or the brace belonged to a nested object
+                segment = None
+        if isinstance(segment, dict) and 'startTime' in segment:
+            yield segment
+            position = text.find('"startTime"', end)
+        else:
+            position = text.find('"startTime"', position + 1)
+
+def iter_sampled_segments(input_file, windows=SAMPLE_WINDOWS, window_bytes=WINDOW_BYTES, scanned=None):
+    """Segments of evenly spread windows of the file
+
+    scanned, if given, is a list the number of bytes read is appended to.
+    """
+    size = os.path.getsize(input_file)
+    step = size / windows
+    with open(input_file, 'rb') as f:
+        for window in range(windows):
+            f.seek(int(window * step))
+            chunk = f.read(window_bytes)
+            if scanned is not None:
+                scanned.append(len(chunk))
+            yield from _window_segments(chunk.decode('utf-8', 'ignore'))
+
+def profile_timeline(input_file='data/Timeline.json', full=None, windows=SAMPLE_WINDOWS,
+                     window_bytes=WINDOW_BYTES, samples=SAMPLES_PER_KIND, seed=0):
+    """Schema profile of a Timeline export (see the module docstring)
+
+    full=None parses the whole file when it is at most FULL_SCAN_BYTES and
+    samples it otherwise; True or False force either.
+    """
+    started = time.perf_counter()
+    size = os.path.getsize(input_file)
+    if full is None:
+        full = size <= FULL_SCAN_BYTES or windows * window_bytes >= size
+    profiler = SchemaProfiler(samples, seed)
+    scanned = []
+    segments = iter_segments(input_file) if full else iter_sampled_segments(input_file, windows, window_bytes,
+                                                                            scanned)
+    for segment in segments:
+        profiler.add(segment)
+    scanned_bytes = size if full else sum(scanned)
+    scale = 1.0 if full or not scanned_bytes else size / scanned_bytes
+    return {
+        'file': input_file,
+        'bytes': size,
+        'sampled': not full,
+        'scanned_bytes': scanned_bytes,
+        'scanned_segments': profiler.segments,
+        'seconds': round(time.perf_counter() - started, 3),
+        **profiler.report(scale)
+    }
+
+def validate_report(report):
+    """Problems of the profiled input for the extractor, as (level, message) pairs
+
+    'error' problems would make extraction fail or produce nothing (no
+    segments, timestamps that cannot be parsed, values of the wrong type);
+    'warning' problems lose data (unparseable coordinates, missing fields,
+    segment kinds the extractor skips).
+    """
+    problems = []
+    if not report['segments']:
+        problems.append(('error', 'no semanticSegments found'))
+    for kind, count in report['unexpected_kinds'].items():
+        problems.append(('warning', f'{count} {kind} segments are not extracted'))
+    for kind, expected in EXTRACTED_FIELDS.items():
+        entry = report['kinds'].get(kind)
+        if entry is None:
+            continue
+        for path, value_kind in expected.items():
+            field = entry['fields'].get(path)
+            if field is None:
+                problems.append(('warning', f'{kind}: {path} is never present'))
+                continue
+            wrong = {name: count for name, count in field['types'].items()
+                     if name not in ('null', 'number' if value_kind == 'number' else 'string')}
+            if wrong:
+                problems.append(('error', f'{kind}: {path} has values of type {wrong}'))
+            if field.get('invalid'):
+                level = 'error' if value_kind == 'time' else 'warning'
+                problems.append((level, f"{kind}: {path} has {field['invalid']} unparseable values"))
+            if field['missing_rate'] or field['null_rate']:
+                problems.append(('warning', f"{kind}: {path} is missing in {field['missing_rate']:.2%} "
+                                            f"and null in {field['null_rate']:.2%} of segments"))
+    return problems
+
+def check_input(input_file, report_file=None, **options):
+    """Profile and validate an input file before extracting it
+
+    Writes the report to report_file if given and raises ValueError listing
+    the errors, if any. Returns the report with its problems attached.
+    """
+    report = profile_timeline(input_file, **options)
+    report['problems'] = [{'level': level, 'message': message} for level, message in validate_report(report)]
+    if report_file is not None:
+        write_report(report, report_file)
+    errors = [problem['message'] for problem in report['problems'] if problem['level'] == 'error']
+    if errors:
+        raise ValueError(f"{input_file} failed validation: {'; '.join(errors)}")
+    return report
+
+def write_report(report, path=REPORT_FILE):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    os.replace(path + '.tmp', path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Profile the schema of a Timeline.json export')
+    parser.add_argument('input', nargs='?', default='data/Timeline.json')
+    parser.add_argument('--output', default=REPORT_FILE, help='JSON report')
+    scan = parser.add_mutually_exclusive_group()
+    scan.add_argument('--full', action='store_const', const=True, dest='full', help='parse the whole file')
+    scan.add_argument('--sample', action='store_const', const=False, dest='full', help='sample the file')
+    args = parser.parse_args()
+    profile_and_print(args.input, args.output, full=args.full)
+
+def profile_and_print(input_file, report_file=REPORT_FILE, **options):
+    """Profile and validate a file, write the report and print a summary"""
+    report = profile_timeline(input_file, **options)
+    report['problems'] = [{'level': level, 'message': message} for level, message in validate_report(report)]
+    write_report(report, report_file)
+
+    print(f"{report['segments']} segments{' (estimated)' if report['sampled'] else ''} "
+          f"profiled in {report['seconds']} s:")
+    for kind, entry in report['kinds'].items():
+        print(f"  {kind}: {entry['count']} segments, {len(entry['key_sets'])} key sets")
+    for problem in report['problems']:
+        print(f"  {problem['level']}: {problem['message']}")
+    print(f"Report saved to '{report_file}'")
+    return report
 
 if __name__ == "__main__":
-    with open('data/Timeline.json', 'r') as f:
-        data = json.load(f)
-    
-    explore_structure(data) 
\ No newline at end of file
+    main()
@@ -0,0 +1,97 @@
+"""Local stand-in for the Google Place Details endpoint
+
+Answers /maps/api/place/details/json with deterministic details derived
+from the place id, so enrichment can run offline and its request count can
+be checked:
+
+    python src/fake_places_server.py --port 8765
+    python src/cli.py enrich --base-url http://127.0.0.1:8765 --api-key AIza-fake
+
+Place ids starting with 'missing' answer NOT_FOUND. GET /stats returns the
+number of detail requests served so far.
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+DETAILS_PATH = '/maps/api/place/details/json'
+
+PLACE_TYPES = ['restaurant', 'cafe', 'store', 'park', 'gym', 'office', 'school', 'transit_station']
+
+def fake_details(place_id):
+    """Stable made-up details for a place id"""
+    digest = hashlib.sha1(place_id.encode()).digest()
+    return {
+        'place_id': place_id,
+        'name': f'Place {place_id[-6:]}',
+        'geometry': {'location': {'lat': 51.0 + digest[0] / 255, 'lng': -1.0 + digest[1] / 255}},
+        'types': [PLACE_TYPES[digest[2] % len(PLACE_TYPES)], 'point_of_interest', 'establishment'],
+        'rating': round(1 + digest[3] / 255 * 4, 1),
+        'price_level': digest[4] % 5,
+        'formatted_address': f'{digest[5]} Example Street',
+        'business_status': 'OPERATIONAL',
+        'user_ratings_total': digest[6] * 10
+    }
+
+class FakePlacesHandler(BaseHTTPRequestHandler):
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/stats':
+            self._send(200, {'requests': self.server.requests})
+            return
+        if url.path != DETAILS_PATH:
+            self._send(404, {'status': 'NOT_FOUND'})
+            return
+
+        with self.server.lock:
+            self.server.requests += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        place_id = parse_qs(url.query).get('placeid', [''])[0]
+        if not place_id:
+            self._send(200, {'status': 'INVALID_REQUEST', 'html_attributions': []})
+        elif place_id.startswith('missing'):
+            self._send(200, {'status': 'NOT_FOUND', 'html_attributions': []})
+        else:
+            self._send(200, {'status': 'OK', 'result': fake_details(place_id), 'html_attributions': []})
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+def make_server(host='127.0.0.1', port=0, latency=0.0, verbose=False):
+    """A fake Places server (not yet serving); port 0 picks a free port"""
+    server = ThreadingHTTPServer((host, port), FakePlacesHandler)
+    server.requests = 0
+    server.lock = threading.Lock()
+    server.latency = latency
+    server.verbose = verbose
+    return server
+
+def serve_in_thread(latency=0.0):
+    """Start a fake server on a free port; returns (server, base_url)"""
+    server = make_server(latency=latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f'http://{host}:{port}'
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fake Google Place Details server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    args = parser.parse_args()
+    make_server(args.host, args.port, args.latency, verbose=True).serve_forever()
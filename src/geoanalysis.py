@@ -1,108 +1,375 @@
 import json
 import numpy as np
-import folium
-from folium import plugins
-import matplotlib.pyplot as plt
-from collections import Counter
+from datetime import datetime, timedelta, timezone
 from icecream import ic
+from timeline_store import load_segments
+from movement_metrics import movement_metrics, summarize_movements
+from place_clustering import frequent_places, snap_to_cells
+from instrumentation import stage
+
+# The map's columns plus those of the frequent places (place_clustering.PLACE_COLUMNS)
+# and the movement summary (movement_metrics.MOVEMENT_COLUMNS), so the store is read once
+VISIT_COLUMNS = ['start_time', 'end_time', 'timezone_offset', 'semantic_type', 'probability', 'lat', 'lng',
+                 'place_id']
+ACTIVITY_COLUMNS = ['start_time', 'end_time', 'type', 'distance_meters', 'start_lat', 'start_lng', 'end_lat',
+                    'end_lng']
+
+# Default rendering budget of the location map: none, every visit and
+# activity is drawn. Capping the features (geo --max-features N) keeps map
+# generation time and HTML size flat as the history grows, merging nearby
+# features and leaving out the smallest ones; full detail stays available
+# from the tile API.
+MAX_FEATURES = None
+MAX_HTML_BYTES = None
+
+# Near-duplicate visits and path endpoints are merged on a grid starting at
+# this cell size (a few pixels at city zoom), doubled until the budget fits
+MIN_CELL_M = 10
+MAX_MERGE_CELL_M = 640
+HEAT_CELL_M = 25
+
+# Heat map cells allowed per feature of the budget; they cost far less HTML
+HEAT_CELLS_PER_FEATURE = 4
+
+# Estimated HTML bytes per feature, used to turn max_html_bytes into a
+# feature budget before the first render
+BYTES_PER_FEATURE = 1200
+HTML_ATTEMPTS = 3
 
 def load_data():
-    """Load the extracted timeline data"""
-    with open('data/extracted_timeline.json', 'r') as f:
-        return json.load(f)
-
-def parse_latlng(latlng_str):
-    """Parse latitude and longitude from string format"""
-    if not latlng_str:
-        return None
-    # Remove degree symbols and split
-    clean_str = latlng_str.replace('°', '')
-    lat, lng = map(float, clean_str.split(', '))
-    return [lat, lng]
-
-def analyze_locations():
-    """Analyze and visualize location patterns"""
-    data = load_data()
-    visits = data['visits']
-    activities = data['activities']
-    
-    # Process visit locations
-    visit_locations = []
-    visit_info = []
-    
-    for visit in visits:
-        location = parse_latlng(visit.get('location'))
-        if location:
-            visit_locations.append(location)
-            visit_info.append({
-                'type': visit.get('semantic_type'),
-                'start_time': visit.get('start_time'),
-                'duration_str': f"{visit.get('end_time')} - {visit.get('start_time')}",
-                'probability': visit.get('probability')
-            })
-    
-    # Convert to numpy array for clustering
-    X = np.array(visit_locations)
-    
-    # Create a map centered on the mean coordinates
-    center_lat = np.mean(X[:, 0])
-    center_lng = np.mean(X[:, 1])
-    m = folium.Map(location=[center_lat, center_lng], zoom_start=11)
-    
+    """Load the visit and activity columns needed from the timeline store"""
+    with stage('geo.load') as metrics:
+        visits, activities = load_segments('visits', VISIT_COLUMNS), load_segments('activities', ACTIVITY_COLUMNS)
+        metrics.count('visits', len(visits))
+        metrics.count('activities', len(activities))
+    return visits, activities
+
+def format_local_time(epoch_ms, offset_minutes):
+    """Format a UTC millisecond timestamp in the segment's local time"""
+    offset = timedelta(minutes=0 if np.isnan(offset_minutes) else int(offset_minutes))
+    return datetime.fromtimestamp(epoch_ms / 1000, timezone(offset)).isoformat(timespec='milliseconds')
+
+def _local_time(epoch_ms, offset_minutes):
+    return None if np.isnan(epoch_ms) else format_local_time(epoch_ms, offset_minutes)
+
+def _coarsest_needed(budget, cell_m, group, max_cell_m=None):
+    """Run group(cell_m) with cell_m doubled until it yields at most budget groups
+
+    Stops at max_cell_m even if there are still too many groups; the caller
+    then keeps the largest ones.
+    """
+    budget = max(int(budget), 1)
+    while True:
+        result = group(cell_m)
+        if result[0] <= budget or (max_cell_m is not None and cell_m * 2 > max_cell_m):
+            return cell_m, result
+        cell_m *= 2
+
+def _largest(counts, budget):
+    """Indexes of the (at most) budget largest counts, largest first"""
+    order = np.argsort(-counts, kind='stable')
+    return order[:max(int(budget), 1)]
+
+def _cells(lat, lng):
+    """Grouping for _coarsest_needed: points snapped to cells of the given size"""
+    def group(cell_m):
+        cells = snap_to_cells(lat, lng, cell_m)
+        return len(cells[3]), cells
+    return group
+
+def _dominant(group_index, codes, size):
+    """Most common category code within each group (-1 when all missing)"""
+    present = codes >= 0
+    if not present.any():
+        return np.full(size, -1)
+    width = int(codes.max()) + 1
+    counts = np.bincount(group_index[present] * width + codes[present], minlength=size * width)
+    counts = counts.reshape(size, width)
+    return np.where(counts.max(axis=1) > 0, counts.argmax(axis=1), -1)
+
+def merge_visits(located, budget, cell_m=MIN_CELL_M):
+    """Merge visits on a grid into at most budget markers
+
+    The grid starts at cell_m and is doubled until few enough cells remain,
+    so repeated visits to one place (and places closer than a few pixels at
+    city zoom) become a single marker. Past MAX_MERGE_CELL_M the grid would
+    blur the city view, so the most visited cells are kept instead (the heat
+    map still shows the rest). Returns (markers, cell size, visits left out).
+    """
+    lat, lng = located.lat, located.lng
+    cell_m, (size, (inverse, cell_lat, cell_lng, counts)) = _coarsest_needed(
+        budget, cell_m, _cells(lat, lng), MAX_MERGE_CELL_M)
+    codes, names = located.semantic_type.astype(np.int64), located.names('semantic_type')
+    dominant = _dominant(inverse, codes, size)
+    probability = np.bincount(inverse, weights=np.nan_to_num(located.probability), minlength=size)
+    start = located.floats('start_time')
+    end = located.floats('end_time')
+    offset = located.floats('timezone_offset')
+    # First and last visit of every cell
+    order = np.lexsort((start, inverse))
+    first = order[np.searchsorted(inverse[order], np.arange(size), 'left')]
+    last = order[np.searchsorted(inverse[order], np.arange(size), 'right') - 1]
+
+    kept = _largest(counts, budget)
+    markers = []
+    for cell in kept:
+        markers.append({
+            'lat': cell_lat[cell],
+            'lng': cell_lng[cell],
+            'count': int(counts[cell]),
+            'type': names[dominant[cell]] if dominant[cell] >= 0 else None,
+            'probability': probability[cell] / counts[cell],
+            'first': _local_time(start[first[cell]], offset[first[cell]]),
+            'last': _local_time(end[last[cell]], offset[last[cell]])
+        })
+    return markers, cell_m, int(counts.sum() - counts[kept].sum())
+
+def merge_paths(routed, budget, cell_m=MIN_CELL_M):
+    """Merge activities into at most budget straight lines between grid cells
+
+    Endpoints are snapped to a grid (doubled from cell_m until it fits, or
+    up to MAX_MERGE_CELL_M) and trips between the same two cells, in either
+    direction, become one line weighted by their count; if that is still too
+    many lines the most travelled are kept. Trips starting and ending in the
+    same cell are below the map's resolution at that grid and are left out
+    too. Returns (lines, cell size, trips left out).
+    """
+    count = len(routed)
+    lat = np.concatenate([routed.start_lat, routed.end_lat])
+    lng = np.concatenate([routed.start_lng, routed.end_lng])
+
+    def group(cell):
+        inverse, cell_lat, cell_lng, _ = snap_to_cells(lat, lng, cell)
+        start, end = inverse[:count], inverse[count:]
+        moving = start != end
+        keys = np.minimum(start, end)[moving] * len(cell_lat) + np.maximum(start, end)[moving]
+        pairs, pair_index = np.unique(keys, return_inverse=True)
+        return len(pairs), (pairs, pair_index.ravel(), moving, cell_lat, cell_lng)
+
+    cell_m, (size, (pairs, pair_index, moving, cell_lat, cell_lng)) = _coarsest_needed(
+        budget, cell_m, group, MAX_MERGE_CELL_M)
+    trips = np.bincount(pair_index, minlength=size)
+    distance = np.bincount(pair_index, weights=np.nan_to_num(routed.distance_meters[moving]),
+                           minlength=size)
+    codes, names = routed.type.astype(np.int64), routed.names('type')
+    dominant = _dominant(pair_index, codes[moving], size)
+    ends = (pairs // len(cell_lat), pairs % len(cell_lat))
+
+    kept = _largest(trips, budget)
+    lines = []
+    for pair in kept:
+        lines.append({
+            'locations': [[cell_lat[ends[0][pair]], cell_lng[ends[0][pair]]],
+                          [cell_lat[ends[1][pair]], cell_lng[ends[1][pair]]]],
+            'count': int(trips[pair]),
+            'type': names[dominant[pair]] if dominant[pair] >= 0 else None,
+            'distance_m': distance[pair]
+        })
+    return lines, cell_m, int(count - trips[kept].sum())
+
+def heat_cells(lat, lng, budget, cell_m=HEAT_CELL_M):
+    """[lat, lng, visits] per grid cell for a weighted HeatMap, at most budget cells
+
+    Leaflet.heat sums the weights of points falling in one of its screen
+    cells, so a cell weighted by its visit count draws like the visits
+    themselves wherever the grid is finer than the screen cells.
+    """
+    cell_m, (_, (_, cell_lat, cell_lng, counts)) = _coarsest_needed(budget, cell_m, _cells(lat, lng))
+    return np.column_stack([cell_lat, cell_lng, counts]).tolist(), cell_m
+
+def _add_full_layers(m, folium, plugins, located, routed, X):
+    """One marker per visit, one line per activity and one heat point per visit"""
     # Add visit markers
-    for location, info in zip(visit_locations, visit_info):
-        color = 'red' if info['type'] == 'INFERRED_HOME' else 'blue'
-        
+    for (lat, lng), visit_type, start, end, offset, probability in zip(
+            X, located.decode('semantic_type'), located.floats('start_time'), located.floats('end_time'),
+            located.floats('timezone_offset'), located.probability):
+        color = 'red' if visit_type == 'INFERRED_HOME' else 'blue'
+        duration_str = f"{_local_time(end, offset)} - {_local_time(start, offset)}"
+
         popup_content = f"""
-        Type: {info['type']}<br>
-        Time: {info['duration_str']}<br>
-        Probability: {info['probability']:.2f}
+        Type: {visit_type}<br>
+        Time: {duration_str}<br>
+        Probability: {probability:.2f}
         """
-        
+
         folium.CircleMarker(
-            location=location,
+            location=[lat, lng],
             radius=8,
             popup=popup_content,
             color=color,
             fill=True,
             fill_color=color
         ).add_to(m)
-    
+
     # Add activity paths
-    activity_coordinates = []
-    
-    for activity in activities:
-        start = parse_latlng(activity.get('start_location'))
-        end = parse_latlng(activity.get('end_location'))
-        
-        if start and end:
-            activity_coordinates.append([start, end])
-            
-            # Draw path line
-            folium.PolyLine(
-                locations=[start, end],
-                weight=2,
-                color='green',
-                opacity=0.8,
-                popup=f"Type: {activity.get('type')}<br>Distance: {activity.get('distance_meters')}m"
-            ).add_to(m)
-    
+    for start_lat, start_lng, end_lat, end_lng, activity_type, distance in zip(
+            routed.start_lat, routed.start_lng, routed.end_lat, routed.end_lng,
+            routed.decode('type'), routed.distance_meters):
+        # Draw path line
+        folium.PolyLine(
+            locations=[[start_lat, start_lng], [end_lat, end_lng]],
+            weight=2,
+            color='green',
+            opacity=0.8,
+            popup=f"Type: {activity_type}<br>Distance: {distance}m"
+        ).add_to(m)
+
     # Add heatmap layer
-    heat_data = [[lat, lng] for lat, lng in visit_locations]
-    plugins.HeatMap(heat_data).add_to(m)
-    
+    plugins.HeatMap(X.tolist()).add_to(m)
+    return {'markers': len(X), 'paths': len(routed), 'heat_points': len(X)}
+
+def _add_bounded_layers(m, folium, plugins, located, routed, X, features):
+    """Merged markers and lines sharing a budget of features, plus a gridded heat map"""
+    # Whatever one layer does not need is left to the other
+    marker_budget = max(features // 2, 1)
+    lines, path_cell_m, paths_left_out = merge_paths(routed, max(features - min(marker_budget, len(X)), 1))
+    markers, marker_cell_m, visits_left_out = merge_visits(located, max(features - len(lines), 1))
+
+    for marker in markers:
+        color = 'red' if marker['type'] == 'INFERRED_HOME' else 'blue'
+        if marker['count'] == 1:
+            popup = (f"Type: {marker['type']}<br>Time: {marker['first']} - {marker['last']}<br>"
+                     f"Probability: {marker['probability']:.2f}")
+        else:
+            popup = (f"Visits: {marker['count']}<br>Type: {marker['type']}<br>"
+                     f"First: {marker['first']}<br>Last: {marker['last']}<br>"
+                     f"Mean probability: {marker['probability']:.2f}")
+        folium.CircleMarker(
+            location=[marker['lat'], marker['lng']],
+            radius=min(8 + 2 * np.log2(marker['count']), 20),
+            popup=popup,
+            color=color,
+            fill=True,
+            fill_color=color
+        ).add_to(m)
+
+    for line in lines:
+        folium.PolyLine(
+            locations=line['locations'],
+            weight=min(2 + np.log2(line['count']), 8),
+            color='green',
+            opacity=0.8,
+            popup=f"Type: {line['type']}<br>Trips: {line['count']}<br>"
+                  f"Total distance: {line['distance_m'] / 1000:.1f} km"
+        ).add_to(m)
+
+    cells, heat_cell_m = heat_cells(X[:, 0], X[:, 1], features * HEAT_CELLS_PER_FEATURE)
+    plugins.HeatMap(cells).add_to(m)
+    return {
+        'markers': len(markers), 'marker_cell_m': marker_cell_m, 'visits_left_out': visits_left_out,
+        'paths': len(lines), 'path_cell_m': path_cell_m, 'activities_left_out': paths_left_out,
+        'heat_points': len(cells), 'heat_cell_m': heat_cell_m
+    }
+
+def _build_map(located, routed, X, places, features):
+    """The location map; features=None renders every visit and activity"""
+    import folium
+    from folium import plugins
+
+    with stage('geo.layers') as metrics:
+        # Create a map centered on the mean coordinates
+        center_lat = np.mean(X[:, 0])
+        center_lng = np.mean(X[:, 1])
+        m = folium.Map(location=[center_lat, center_lng], zoom_start=11)
+        if features is None:
+            rendering = _add_full_layers(m, folium, plugins, located, routed, X)
+        else:
+            # Frequent places (largest first) take at most a tenth of the budget
+            places = places[:max(features // 10, 1)]
+            rendering = _add_bounded_layers(m, folium, plugins, located, routed, X,
+                                            max(features - len(places), 2))
+        metrics.count('markers', rendering['markers'])
+        metrics.count('paths', rendering['paths'])
+        metrics.count('heat_points', rendering['heat_points'])
+
+    with stage('geo.places') as metrics:
+        # Add frequently visited places, sized by time spent there
+        place_layer = folium.FeatureGroup(name='Frequent places')
+        for place in places:
+            folium.Circle(
+                location=[place['lat'], place['lng']],
+                radius=max(place['radius_m'], 25),
+                popup=f"Type: {place['semantic_type']}<br>Visits: {place['visits']}<br>"
+                      f"Time spent: {place['dwell_hours']:.1f} h",
+                color='purple',
+                fill=True,
+                fill_opacity=min(0.8, 0.1 + place['dwell_hours'] / 1000)
+            ).add_to(place_layer)
+        place_layer.add_to(m)
+        folium.LayerControl().add_to(m)
+        metrics.count('places', len(places))
+
+    rendering['places'] = len(places)
+    return m, rendering
+
+def render_map(located, routed, X, places, max_features=MAX_FEATURES, max_html_bytes=MAX_HTML_BYTES):
+    """Render the location map HTML within the given budget
+
+    With neither limit every visit and activity is drawn. Otherwise the
+    number of features is capped, and a map larger than max_html_bytes is
+    rendered again with proportionally fewer features (at most
+    HTML_ATTEMPTS renders). Returns (html, rendering summary).
+    """
+    if max_features is None and max_html_bytes is None:
+        features = None
+    else:
+        features = max_features or max(max_html_bytes // BYTES_PER_FEATURE, 1)
+        if max_html_bytes is not None:
+            features = min(features, max(max_html_bytes // BYTES_PER_FEATURE, 1))
+
+    for attempt in range(HTML_ATTEMPTS):
+        m, rendering = _build_map(located, routed, X, places, features)
+        # folium renders the HTML here
+        with stage('geo.render') as metrics:
+            html = m.get_root().render()
+            metrics.count('html_bytes', len(html.encode()))
+        size = len(html.encode())
+        if max_html_bytes is None or size <= max_html_bytes or features <= 2:
+            break
+        if attempt + 1 < HTML_ATTEMPTS:
+            # Shrink in proportion to the overshoot, with some margin
+            features = max(int(features * max_html_bytes / size * 0.9), 2)
+
+    rendering.update(max_features=max_features, max_html_bytes=max_html_bytes, html_bytes=size)
+    return html, rendering
+
+def analyze_locations(max_features=MAX_FEATURES, max_html_bytes=MAX_HTML_BYTES):
+    """Analyze and visualize location patterns
+
+    The map is rendered within a budget of max_features features and/or
+    max_html_bytes of HTML (see render_map): nearby visits merge into one
+    marker, trips between the same cells into one line, and the heat map is
+    drawn from weighted grid cells. With None for both (the default)
+    everything is drawn.
+    """
+    visits, activities = load_data()
+
+    # Keep visits with a known location
+    located = visits[~np.isnan(visits.lat) & ~np.isnan(visits.lng)]
+    X = np.column_stack([located.lat, located.lng])
+    routed = activities[~(np.isnan(activities.start_lat) | np.isnan(activities.start_lng) |
+                          np.isnan(activities.end_lat) | np.isnan(activities.end_lng))]
+    places = frequent_places(visits=visits)
+
+    html, rendering = render_map(located, routed, X, places['places'], max_features, max_html_bytes)
+    if rendering.get('visits_left_out') or rendering.get('activities_left_out'):
+        ic(f"Map budget left out {rendering['visits_left_out']} visits and "
+           f"{rendering['activities_left_out']} activities; the tile API still serves them")
+
     # Save the map
-    m.save('output/location_analysis.html')
+    with stage('geo.save') as metrics:
+        with open('output/location_analysis.html', 'w', encoding='utf-8') as f:
+            f.write(html)
+        metrics.wrote_file('output/location_analysis.html')
     ic("Map saved as 'output/location_analysis.html'")
-    
+
     # Generate statistics
-    visit_types = Counter(visit['semantic_type'] for visit in visits)
-    activity_types = Counter(activity['type'] for activity in activities)
-    
     stats = {
         'visits': {
-            'total_locations': len(visit_locations),
-            'unique_types': dict(visit_types),
+            'total_locations': len(X),
+            'unique_types': visits.value_counts('semantic_type'),
+            'frequent_places': len(places['places']),
+            'clustered_visits': places['clustered_visits'],
             'bounds': {
                 'north': float(np.max(X[:, 0])),
                 'south': float(np.min(X[:, 0])),
@@ -111,15 +378,20 @@ def analyze_locations():
             }
         },
         'activities': {
-            'total_movements': len(activity_coordinates),
-            'activity_types': dict(activity_types),
-            'total_distance_km': sum(float(a.get('distance_meters', 0)) for a in activities) / 1000
-        }
+            'total_movements': len(routed),
+            'activity_types': activities.value_counts('type'),
+            'total_distance_km': float(np.nansum(activities.distance_meters)) / 1000,
+            'movement': summarize_movements(movement_metrics(activities))
+        },
+        'map': rendering
     }
-    
-    with open('output/location_statistics.json', 'w') as f:
-        json.dump(stats, f, indent=2)
+
+    with stage('geo.write_stats') as metrics:
+        with open('output/location_statistics.json', 'w') as f:
+            json.dump(stats, f, indent=2)
+        metrics.wrote_file('output/location_statistics.json')
     ic("Location statistics saved to 'output/location_statistics.json'")
+    return stats
 
 if __name__ == "__main__":
     analyze_locations()
\ No newline at end of file
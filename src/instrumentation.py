@@ -0,0 +1,231 @@
+"""Lightweight per-stage timing, counters and memory for the pipeline and web app
+
+    with stage('geo.render') as metrics:
+        ...
+        metrics.count('markers', len(visits))
+        metrics.wrote_file('output/location_analysis.html')
+
+Each finished stage records its wall and CPU time, record counts, bytes
+read and written and the process's peak RSS. Under `python -X tracemalloc`
+the peak of Python allocations inside the stage is recorded as well.
+Stages nest; names are dotted by convention ('extract.parse').
+
+Totals per stage name are kept for the life of the process (served at
+/metrics by the web app), and the most recent runs are listed individually
+so a pipeline run can write them to REPORT_FILE.
+
+Setting TIMELINE_PROFILE to a comma-separated list of stage names (or
+'all') runs those stages under cProfile and dumps the stats to PROFILE_DIR.
+"""
+import collections
+import cProfile
+import itertools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+REPORT_FILE = 'output/run_report.json'
+PROFILE_DIR = 'output/profiles'
+PROFILE_ENV = 'TIMELINE_PROFILE'
+
+# Individual stage runs kept for run reports; totals are kept for every name
+RECENT_RUNS = 500
+
+STARTED = time.time()
+
+_lock = threading.Lock()
+_totals = {}
+_recent = collections.deque(maxlen=RECENT_RUNS)
+_sequence = itertools.count(1)
+_local = threading.local()
+
+def peak_rss_mb():
+    """High-water resident set size of this process, in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+def _profiled(name):
+    wanted = os.environ.get(PROFILE_ENV, '')
+    names = {part.strip() for part in wanted.split(',') if part.strip()}
+    return 'all' in names or name in names
+
+class StageMetrics:
+    """Counters of one stage run, filled in by the instrumented code"""
+
+    def __init__(self, name):
+        self.name = name
+        self.counts = collections.Counter()
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.traced_peak = 0
+
+    def count(self, key, value=1):
+        self.counts[key] += value
+
+    def read(self, size):
+        self.bytes_read += size
+
+    def wrote(self, size):
+        self.bytes_written += size
+
+    def read_file(self, path):
+        if os.path.exists(path):
+            self.bytes_read += os.path.getsize(path)
+
+    def wrote_file(self, path):
+        if os.path.exists(path):
+            self.bytes_written += os.path.getsize(path)
+
+def record(name, seconds, cpu_seconds=None, counts=None, bytes_read=0, bytes_written=0,
+           keep=True, **fields):
+    """Add one finished run of a stage to the totals (and, if keep, the recent runs)"""
+    counts = dict(counts or {})
+    with _lock:
+        total = _totals.setdefault(name, {
+            'runs': 0, 'errors': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'cpu_seconds': 0.0,
+            'bytes_read': 0, 'bytes_written': 0, 'counts': collections.Counter(),
+            'last_seconds': None, 'last_finished': None
+        })
+        total['runs'] += 1
+        total['errors'] += fields.get('error') is not None
+        total['seconds'] += seconds
+        total['max_seconds'] = max(total['max_seconds'], seconds)
+        total['cpu_seconds'] += cpu_seconds or 0.0
+        total['bytes_read'] += bytes_read
+        total['bytes_written'] += bytes_written
+        total['counts'].update(counts)
+        total['last_seconds'] = seconds
+        total['last_finished'] = time.time()
+        if keep:
+            _recent.append({
+                'sequence': next(_sequence),
+                'stage': name,
+                'seconds': round(seconds, 6),
+                'cpu_seconds': None if cpu_seconds is None else round(cpu_seconds, 6),
+                'counts': counts,
+                'bytes_read': bytes_read,
+                'bytes_written': bytes_written,
+                **fields
+            })
+
+@contextmanager
+def stage(name):
+    """Time a block of work as one run of the named stage; yields its StageMetrics"""
+    metrics = StageMetrics(name)
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        # Resetting the peak for this stage must not lose the enclosing ones'
+        current_peak = tracemalloc.get_traced_memory()[1]
+        for outer in stack:
+            outer.traced_peak = max(outer.traced_peak, current_peak)
+        tracemalloc.reset_peak()
+    stack.append(metrics)
+
+    profiler = cProfile.Profile() if _profiled(name) else None
+    error = None
+    started = time.time()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield metrics
+    except BaseException as exc:
+        error = type(exc).__name__
+        raise
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        seconds = time.perf_counter() - wall
+        cpu_seconds = time.process_time() - cpu
+        stack.pop()
+        fields = {'started': started, 'peak_rss_mb': round(peak_rss_mb(), 1), 'error': error}
+        if tracing:
+            metrics.traced_peak = max(metrics.traced_peak, tracemalloc.get_traced_memory()[1])
+            for outer in stack:
+                outer.traced_peak = max(outer.traced_peak, metrics.traced_peak)
+            fields['python_peak_mb'] = round(metrics.traced_peak / (1 << 20), 1)
+        if profiler is not None:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+            profiler.dump_stats(path)
+            fields['profile'] = path
+        record(name, seconds, cpu_seconds, metrics.counts, metrics.bytes_read, metrics.bytes_written,
+               **fields)
+
+def mark():
+    """Position in the recent runs; pass to recent_runs to get what ran after it"""
+    with _lock:
+        return _recent[-1]['sequence'] if _recent else 0
+
+def recent_runs(since=0):
+    with _lock:
+        return [run for run in _recent if run['sequence'] > since]
+
+def snapshot():
+    """Totals per stage name since the process started, plus process figures"""
+    with _lock:
+        stages = {name: {**total, 'counts': dict(total['counts'])} for name, total in _totals.items()}
+    return {
+        'process': {
+            'pid': os.getpid(),
+            'started': STARTED,
+            'uptime_seconds': round(time.time() - STARTED, 3),
+            'cpu_seconds': round(time.process_time(), 3),
+            'peak_rss_mb': round(peak_rss_mb(), 1)
+        },
+        'stages': stages
+    }
+
+def prometheus_text(metrics=None):
+    """The snapshot in the Prometheus text exposition format"""
+    metrics = snapshot() if metrics is None else metrics
+    lines = [
+        '# TYPE timeline_process_peak_rss_megabytes gauge',
+        f"timeline_process_peak_rss_megabytes {metrics['process']['peak_rss_mb']}",
+        '# TYPE timeline_process_uptime_seconds gauge',
+        f"timeline_process_uptime_seconds {metrics['process']['uptime_seconds']}"
+    ]
+    series = {
+        'timeline_stage_runs_total': 'runs',
+        'timeline_stage_errors_total': 'errors',
+        'timeline_stage_seconds_total': 'seconds',
+        'timeline_stage_max_seconds': 'max_seconds',
+        'timeline_stage_cpu_seconds_total': 'cpu_seconds',
+        'timeline_stage_read_bytes_total': 'bytes_read',
+        'timeline_stage_written_bytes_total': 'bytes_written'
+    }
+    for metric, key in series.items():
+        lines.append(f"# TYPE {metric} {'gauge' if key == 'max_seconds' else 'counter'}")
+        for name, total in metrics['stages'].items():
+            lines.append(f'{metric}{{stage="{name}"}} {total[key]}')
+    lines.append('# TYPE timeline_stage_records_total counter')
+    for name, total in metrics['stages'].items():
+        for key, value in total['counts'].items():
+            lines.append(f'timeline_stage_records_total{{stage="{name}",kind="{key}"}} {value}')
+    return '\n'.join(lines) + '\n'
+
+def write_run_report(since=0, path=REPORT_FILE, **extra):
+    """Write the stage runs recorded after `since` (see mark) as a JSON report"""
+    runs = recent_runs(since)
+    report = {
+        'finished': time.time(),
+        'seconds': round(sum(run['seconds'] for run in runs if '.' not in run['stage']), 6),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        **extra,
+        'stages': runs
+    }
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(path + '.tmp', path)
+    return report
@@ -0,0 +1,152 @@
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+import pipeline
+from timeline_store import STORE_DIR
+
+# Every upload gets its own directory holding the uploaded export, the
+# store it is extracted into and a progress file
+UPLOAD_DIR = 'data/uploads'
+UPLOAD_FILE = 'Timeline.json'
+JOB_STORE_DIR = 'store'
+PROGRESS_FILE = 'progress.json'
+
+# Number of uploads processed at the same time
+JOB_WORKERS = int(os.getenv('TIMELINE_JOB_WORKERS', min(4, os.cpu_count() or 1)))
+
+_lock = threading.Lock()
+_pool = None
+_jobs = {}
+
+def job_dir(job_id):
+    return os.path.join(UPLOAD_DIR, job_id)
+
+def _write_progress(directory, progress):
+    path = os.path.join(directory, PROGRESS_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(progress, f)
+    os.replace(path + '.tmp', path)
+
+def _read_progress(directory):
+    try:
+        with open(os.path.join(directory, PROGRESS_FILE), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def run_job(directory):
+    """Extract one uploaded export into the job's own store; runs in a worker process
+
+    Progress is published through a small JSON file in the job directory,
+    which the web app reads back when the job is polled. The upload is
+    removed once extracted; see merge_job for the rest.
+    """
+    # Imported here so the web app process never loads the extraction stack
+    from data_extraction import extract_timeline_data
+
+    started = time.time()
+    _write_progress(directory, {'state': 'running', 'started': started, 'bytes_read': 0, 'segments': 0})
+
+    def report(bytes_read, segments):
+        _write_progress(directory, {'state': 'running', 'started': started,
+                                    'bytes_read': bytes_read, 'segments': segments})
+
+    result = extract_timeline_data(os.path.join(directory, UPLOAD_FILE), None,
+                                   streaming=True,
+                                   store_dir=os.path.join(directory, JOB_STORE_DIR),
+                                   progress=report)
+    os.remove(os.path.join(directory, UPLOAD_FILE))
+    return result['metadata']
+
+def merge_job(directory, store_dir=STORE_DIR):
+    """Merge an extracted upload into the store and rebuild the outputs
+
+    Uploads are merged one at a time (see pipeline.update_store), each
+    replacing the days it holds and keeping all others, so concurrent
+    uploads all end up in the store. Exports that failed to extract are
+    never merged.
+    """
+    from data_extraction import merge_store
+    pipeline.update_store(lambda: merge_store(os.path.join(directory, JOB_STORE_DIR), store_dir))
+    shutil.rmtree(os.path.join(directory, JOB_STORE_DIR))
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # spawn rather than fork: the web app process runs request threads
+        _pool = ProcessPoolExecutor(max_workers=JOB_WORKERS,
+                                    mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+def _finish_job(job_id, error=None, **fields):
+    with _lock:
+        job = _jobs[job_id]
+        job['finished'] = time.time()
+        if error is None:
+            job.update(state='done', **fields)
+        else:
+            job.update(state='failed', error=''.join(traceback.format_exception_only(error)).strip())
+
+def _merge(job_id, result):
+    try:
+        merge_job(job_dir(job_id))
+    except Exception as e:
+        _finish_job(job_id, e)
+    else:
+        _finish_job(job_id, result=result)
+
+def _extracted(job_id, future):
+    error = future.exception()
+    if error is not None:
+        _finish_job(job_id, error)
+        return
+    with _lock:
+        _jobs[job_id]['state'] = 'merging'
+    # Not on the pool's callback thread: merges wait for each other and the pipeline
+    threading.Thread(target=_merge, args=(job_id, future.result()), name='job-merge', daemon=True).start()
+
+def create_job():
+    """Reserve a job id and directory; returns (job_id, path to write the upload to)"""
+    job_id = uuid.uuid4().hex
+    os.makedirs(job_dir(job_id))
+    return job_id, os.path.join(job_dir(job_id), UPLOAD_FILE)
+
+def submit_job(job_id):
+    """Queue an uploaded export for extraction on the worker pool"""
+    directory = job_dir(job_id)
+    with _lock:
+        _jobs[job_id] = {
+            'state': 'queued',
+            'created': time.time(),
+            'bytes_total': os.path.getsize(os.path.join(directory, UPLOAD_FILE))
+        }
+        future = _get_pool().submit(run_job, directory)
+    future.add_done_callback(lambda future: _extracted(job_id, future))
+    return job_id
+
+def discard_job(job_id):
+    shutil.rmtree(job_dir(job_id), ignore_errors=True)
+
+def job_status(job_id):
+    """Current state and progress of a job, or None for an unknown id"""
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return None
+        status = {'id': job_id, **job}
+    # Workers only ever report 'running'; merging and finished states are tracked here
+    state = status['state']
+    status.update(_read_progress(job_dir(job_id)))
+    if state != 'queued':
+        status['state'] = state
+    if status['state'] in ('merging', 'done'):
+        status['bytes_read'] = status['bytes_total']
+    total = status['bytes_total']
+    status['fraction'] = round(status.get('bytes_read', 0) / total, 4) if total else 1.0
+    return status
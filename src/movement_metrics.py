@@ -0,0 +1,99 @@
+import numpy as np
+from timeline_store import load_segments
+
+MOVEMENT_COLUMNS = ['start_time', 'end_time', 'type', 'distance_meters',
+                    'start_lat', 'start_lng', 'end_lat', 'end_lng']
+
+# Mean Earth radius (IUGG)
+EARTH_RADIUS_M = 6_371_008.8
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """Great-circle distance in meters between arrays of coordinates in degrees"""
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(values, np.float64)) for values in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+def movement_metrics(activities=None):
+    """Per-activity movement metrics as NumPy arrays
+
+    Takes Activities with MOVEMENT_COLUMNS (loaded from the store when
+    omitted). Returns great_circle_m (start to end), distance_m (as
+    reported), straightness (great-circle over reported distance),
+    duration_s and speed_kmh (reported distance over duration), plus the
+    activity type codes and names. Undefined values are NaN: missing
+    coordinates, a zero reported distance or a non-positive duration.
+    """
+    if activities is None:
+        activities = load_segments('activities', MOVEMENT_COLUMNS)
+
+    great_circle_m = haversine_m(activities.start_lat, activities.start_lng, activities.end_lat, activities.end_lng)
+    distance_m = activities.distance_meters
+    duration_s = (activities.floats('end_time') - activities.floats('start_time')) / 1000
+    codes, names = activities.type, activities.names('type')
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        straightness = np.where(distance_m > 0, great_circle_m / distance_m, np.nan)
+        speed_kmh = np.where(duration_s > 0, distance_m / duration_s * 3.6, np.nan)
+
+    return {
+        'great_circle_m': great_circle_m,
+        'distance_m': distance_m,
+        'straightness': straightness,
+        'duration_s': duration_s,
+        'speed_kmh': speed_kmh,
+        'codes': codes,
+        'names': names
+    }
+
+def _summary(count, great_circle_m, distance_m, timed_distance_m, duration_s, straightness_sum, straightness_count):
+    """Summary of one group from its sums; all arguments may be arrays"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'count': count,
+            'distance_km': distance_m / 1000,
+            'great_circle_km': great_circle_m / 1000,
+            # Total distance over total time, so long trips weigh more than short ones
+            'avg_speed_kmh': np.where(duration_s > 0, timed_distance_m / duration_s * 3.6, np.nan),
+            'mean_straightness': np.where(straightness_count > 0, straightness_sum / straightness_count, np.nan)
+        }
+
+def _group_sums(index, size, metrics):
+    """Per-group sums needed by _summary, computed with bincount"""
+    def total(values, mask=None):
+        valid = ~np.isnan(values) if mask is None else mask
+        return np.bincount(index[valid], weights=values[valid], minlength=size)
+
+    timed = (metrics['duration_s'] > 0) & ~np.isnan(metrics['distance_m'])
+    straight = ~np.isnan(metrics['straightness'])
+    return _summary(
+        np.bincount(index, minlength=size),
+        total(metrics['great_circle_m']),
+        total(metrics['distance_m']),
+        total(metrics['distance_m'], timed),
+        total(metrics['duration_s'], timed),
+        total(metrics['straightness']),
+        np.bincount(index[straight], minlength=size)
+    )
+
+def _as_json(summary, i):
+    """JSON-ready values of group i, with NaN turned into None"""
+    result = {}
+    for name, values in summary.items():
+        value = float(values[i])
+        result[name] = int(value) if name == 'count' else (None if np.isnan(value) else round(value, 3))
+    return result
+
+def summarize_movements(metrics=None):
+    """Overall and per-type totals, average speeds and straightness"""
+    metrics = movement_metrics() if metrics is None else metrics
+    codes = metrics['codes']
+    overall = _group_sums(np.zeros(len(codes), np.int64), 1, metrics)
+
+    present = codes >= 0
+    typed = {name: values[present] for name, values in metrics.items() if name not in ('codes', 'names')}
+    by_type = _group_sums(codes[present].astype(np.int64), len(metrics['names']), typed)
+    return {
+        **_as_json(overall, 0),
+        'by_type': {name: _as_json(by_type, code)
+                    for code, name in enumerate(metrics['names']) if by_type['count'][code]}
+    }
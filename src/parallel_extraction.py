@@ -0,0 +1,226 @@
+import collections
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+import pyarrow as pa
+from icecream import ic
+from data_extraction import DaySummary, day_manifest, parse_segment, segment_day, write_records
+from timeline_store import STORE_DIR, SCHEMAS, BATCH_BUILDERS, write_tables
+
+# Target size of the byte range handed to one worker
+SHARD_BYTES = 32 << 20
+
+# Block size of the structural scan that locates segment boundaries
+SCAN_BLOCK_BYTES = 64 << 20
+
+SEGMENTS_KEY = b'"semanticSegments"'
+
+QUOTE, BACKSLASH = ord('"'), ord('\\')
+
+# Byte lookup tables: brackets, and their effect on the nesting depth
+STRUCTURAL = np.zeros(256, bool)
+STRUCTURAL[[ord('{'), ord('}'), ord('['), ord(']')]] = True
+DEPTH_STEP = np.zeros(256, np.int64)
+DEPTH_STEP[[ord('{'), ord('[')]] = 1
+DEPTH_STEP[[ord('}'), ord(']')]] = -1
+
+def _escaped(data, tail, quotes):
+    """Mask of quotes preceded by an odd number of backslashes"""
+    escaped = np.zeros(len(quotes), bool)
+    previous = np.concatenate([tail[-1:] if len(tail) else np.zeros(1, np.uint8), data])
+    candidates = np.flatnonzero(previous[quotes] == BACKSLASH)
+    buffer = bytes(tail) + data.tobytes()
+    for i in candidates:
+        position = quotes[i] + len(tail) - 1
+        run = 0
+        while position >= 0 and buffer[position] == BACKSLASH:
+            run += 1
+            position -= 1
+        escaped[i] = run % 2 == 1
+    return escaped
+
+def _scan_structure(input_file, block_size=SCAN_BLOCK_BYTES):
+    """Yield (offsets, chars, depths) of brackets outside JSON strings, per block
+
+    depths is the nesting depth just before each bracket. The file is
+    scanned with NumPy in fixed-size blocks, carrying the string and depth
+    state across them, so memory stays bounded by the block size.
+    """
+    in_string = 0
+    depth = 0
+    position = 0
+    tail = np.zeros(0, np.uint8)
+    with open(input_file, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            data = np.frombuffer(block, np.uint8)
+            quotes = np.flatnonzero(data == QUOTE)
+            quotes = quotes[~_escaped(data, tail, quotes)]
+
+            brackets = np.flatnonzero(STRUCTURAL[data])
+            quoted = (np.searchsorted(quotes, brackets) + in_string) % 2 == 1
+            brackets = brackets[~quoted]
+
+            chars = data[brackets]
+            steps = DEPTH_STEP[chars]
+            after = depth + np.cumsum(steps)
+            yield position + brackets, chars, after - steps
+
+            in_string = (in_string + len(quotes)) % 2
+            if len(after):
+                depth = int(after[-1])
+            position += len(block)
+            tail = data[-64:]
+
+def _find_key(input_file, key, block_size=SCAN_BLOCK_BYTES):
+    """Byte offsets of every occurrence of key in the file"""
+    offsets = []
+    position = 0
+    carry = b''
+    with open(input_file, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            buffer = carry + block
+            start = buffer.find(key)
+            while start != -1:
+                offsets.append(position - len(carry) + start)
+                start = buffer.find(key, start + 1)
+            carry = buffer[-(len(key) - 1):]
+            position += len(block)
+    return offsets
+
+def segment_offsets(input_file):
+    """Start offsets of every semanticSegments item, plus the array's end offset"""
+    item_starts = []
+    array_opens = []
+    array_closes = []
+    for offsets, chars, depths in _scan_structure(input_file):
+        item_starts.append(offsets[(chars == ord('{')) & (depths == 2)])
+        array_opens.append(offsets[(chars == ord('[')) & (depths == 1)])
+        array_closes.append(offsets[(chars == ord(']')) & (depths == 2)])
+    item_starts = np.concatenate(item_starts)
+    array_opens = np.concatenate(array_opens)
+    array_closes = np.concatenate(array_closes)
+
+    # semanticSegments is the first top-level array after its key
+    keys = _find_key(input_file, SEGMENTS_KEY)
+    if not keys:
+        return item_starts[:0], None
+    array_open = array_opens[np.searchsorted(array_opens, keys[0])]
+    array_close = array_closes[np.searchsorted(array_closes, array_open)]
+    inside = (item_starts > array_open) & (item_starts < array_close)
+    return item_starts[inside], int(array_close)
+
+def segment_byte_ranges(input_file, shards):
+    """Split the semanticSegments array into byte ranges of whole segments
+
+    Returns a list of (start, end) offsets; each range holds a contiguous
+    run of segments separated by commas.
+    """
+    starts, array_close = segment_offsets(input_file)
+    if not len(starts):
+        return []
+    bounds = np.linspace(0, len(starts), min(shards, len(starts)) + 1).astype(int)
+    boundaries = np.append(starts, array_close)
+    return [(int(boundaries[lo]), int(boundaries[hi])) for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+def _extract_shard(input_file, start, end):
+    """Parse one byte range of segments into record batches, JSON records and day summaries"""
+    with open(input_file, 'rb') as f:
+        f.seek(start)
+        chunk = f.read(end - start).rstrip().rstrip(b',')
+    segments = json.loads(b'[' + chunk + b']')
+
+    records = {'visit': [], 'activity': []}
+    days = collections.defaultdict(DaySummary)
+    for segment in segments:
+        kind, record = parse_segment(segment)
+        days[segment_day(segment)].add(segment)
+        if kind is not None:
+            records[kind].append(record)
+    return {
+        'segments': len(segments),
+        'visits': BATCH_BUILDERS['visits'](records['visit']),
+        'activities': BATCH_BUILDERS['activities'](records['activity']),
+        'visit_json': [json.dumps(record) for record in records['visit']],
+        'activity_json': [json.dumps(record) for record in records['activity']],
+        'days': dict(days)
+    }
+
+def _write_extracted(output_file, results, metadata):
+    """Write the shards' records as extracted JSON, in input order like a streaming run"""
+    with open(output_file, 'w') as out:
+        out.write('{\n  "visits": [')
+        first = True
+        for result in results:
+            first = write_records(out, result['visit_json'], first)
+        out.write('\n  ],\n  "activities": [')
+        first = True
+        for result in results:
+            first = write_records(out, result['activity_json'], first)
+        out.write('\n  ],\n  "metadata": ' + json.dumps(metadata) + '\n}\n')
+
+def extract_timeline_batch(input_files, output_file='data/extracted_timeline.json', store_dir=STORE_DIR,
+                           workers=None, shard_bytes=SHARD_BYTES):
+    """Extract several Timeline.json exports in parallel into one store
+
+    Every file is split into byte ranges of whole segments (at least one
+    per worker), which are parsed in a process pool. The results are merged
+    in start-time order and written to the columnar store, and in input
+    order to output_file. The returned metadata, the JSON and the store
+    manifest match a serial run over the files one after the other.
+
+    The manifest records the input files: the incremental extraction of
+    any other file leaves the store as it is rather than dropping the
+    days of the other exports (see extract_incremental).
+    """
+    if isinstance(input_files, str):
+        input_files = [input_files]
+    workers = workers or os.cpu_count()
+    min_shards = math.ceil(workers / len(input_files))
+
+    tasks = []
+    for input_file in input_files:
+        shards = max(min_shards, math.ceil(os.path.getsize(input_file) / shard_bytes))
+        tasks.extend((input_file, start, end) for start, end in segment_byte_ranges(input_file, shards))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(_extract_shard, *zip(*tasks))) if tasks else []
+
+    tables = {}
+    for name, schema in SCHEMAS.items():
+        batches = [result[name] for result in results if result[name].num_rows]
+        table = pa.Table.from_batches(batches, schema) if batches else schema.empty_table()
+        tables[name] = table.unify_dictionaries().combine_chunks().sort_by('start_time')
+
+    # Shards are in input order, so each day's summaries extend in order too
+    days = collections.defaultdict(DaySummary)
+    for result in results:
+        for day, summary in result['days'].items():
+            days[day].extend(summary)
+    manifest = {**day_manifest(days), 'inputs': [os.path.abspath(input_file) for input_file in input_files]}
+    write_tables(tables, store_dir, manifest)
+
+    metadata = {
+        'total_segments': sum(result['segments'] for result in results),
+        'total_visits': tables['visits'].num_rows,
+        'total_activities': tables['activities'].num_rows,
+        'extraction_date': datetime.now().isoformat(),
+        'input_files': list(input_files),
+        'shards': len(tasks)
+    }
+    _write_extracted(output_file, results, metadata)
+    ic(f"Extracted {metadata['total_visits']} visits and {metadata['total_activities']} activities "
+       f"from {len(input_files)} files in {len(tasks)} shards")
+    return {'metadata': metadata}
+
+if __name__ == "__main__":
+    import sys
+    extract_timeline_batch(sys.argv[1:] or ['data/Timeline.json'])
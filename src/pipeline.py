@@ -0,0 +1,307 @@
+import hashlib
+import json
+import os
+import threading
+from functools import lru_cache
+from icecream import ic
+import artifacts
+import instrumentation
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+TIMELINE_FILE = 'data/Timeline.json'
+OUTPUT_DIR = 'output'
+MANIFEST_FILE = os.path.join(OUTPUT_DIR, 'pipeline_manifest.json')
+# Written by the extract stage and by merged uploads (see update_store)
+STORE_MANIFEST = 'data/timeline_store/manifest.json'
+
+# Each stage lists the files it reads, the stages it depends on, the source
+# modules whose code determines its output and the artifacts it writes.
+# Stages reading the store list its manifest, so they also rebuild when
+# uploads are merged into it. On-demand stages are only built when
+# explicitly requested.
+STAGES = {
+    'extract': {
+        'inputs': [TIMELINE_FILE],
+        'depends_on': [],
+        'modules': ['data_extraction.py', 'timeline_store.py', 'segments.py', 'coordinates.py'],
+        'outputs': [STORE_MANIFEST]
+    },
+    'temporal': {
+        'inputs': [STORE_MANIFEST],
+        'depends_on': ['extract'],
+        'modules': ['temporal_analysis.py', 'movement_metrics.py', 'timeline_store.py', 'segments.py'],
+        'outputs': ['output/temporal_statistics.json']
+    },
+    'temporal_plot': {
+        'inputs': [STORE_MANIFEST],
+        'depends_on': ['extract'],
+        'modules': ['temporal_analysis.py', 'movement_metrics.py', 'timeline_store.py', 'segments.py'],
+        'outputs': ['output/temporal_patterns.png'],
+        'on_demand': True
+    },
+    'geo': {
+        'inputs': [STORE_MANIFEST],
+        'depends_on': ['extract'],
+        'modules': ['geoanalysis.py', 'movement_metrics.py', 'place_clustering.py', 'timeline_store.py',
+                    'segments.py'],
+        'outputs': ['output/location_analysis.html', 'output/location_statistics.json']
+    },
+    'tiles': {
+        'inputs': [STORE_MANIFEST],
+        'depends_on': ['extract'],
+        'modules': ['spatial_index.py', 'timeline_store.py', 'segments.py'],
+        'outputs': ['data/timeline_store/tiles/visit_clusters.arrow',
+                    'data/timeline_store/tiles/activity_flows.arrow']
+    },
+    'enrich': {
+        'inputs': [STORE_MANIFEST],
+        'depends_on': ['extract'],
+        'modules': ['place_enrichment.py', 'timeline_store.py', 'segments.py'],
+        'outputs': ['data/detailed_places_full.json'],
+        # Needs GOOGLE_API_KEY; the details cache keeps re-runs offline
+        'on_demand': True
+    },
+    'routes': {
+        'inputs': [STORE_MANIFEST],
+        'depends_on': ['extract'],
+        'modules': ['route_index.py', 'timeline_store.py', 'segments.py'],
+        'outputs': ['data/timeline_store/routes/od.arrow']
+    },
+    'rollups': {
+        'inputs': [STORE_MANIFEST],
+        'depends_on': ['extract'],
+        'modules': ['rollups.py', 'place_clustering.py', 'movement_metrics.py', 'route_index.py',
+                    'timeline_store.py', 'segments.py'],
+        'outputs': ['data/timeline_store/rollups/visits.npz', 'data/timeline_store/rollups/activities.npz']
+    }
+}
+
+_lock = threading.Lock()
+# _input_signature at the last successful check, per set of requested stages
+_last_input_stat = {}
+# Number of update_store calls, part of the signature ensure_fresh checks
+_store_updates = 0
+# Sets of requested stages being refreshed by a background thread
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+# outputs_version of the last run_pipeline, read from the manifest on first use
+_UNKNOWN = object()
+_outputs_version = _UNKNOWN
+
+def _run_stage(name):
+    # Imported lazily so serving cached outputs never loads the analysis stack
+    if name == 'extract':
+        from data_extraction import extract_timeline_data
+        extract_timeline_data(TIMELINE_FILE, incremental=True)
+    elif name == 'temporal':
+        from temporal_analysis import write_temporal_statistics
+        write_temporal_statistics()
+    elif name == 'temporal_plot':
+        from temporal_analysis import render_temporal_patterns
+        render_temporal_patterns()
+    elif name == 'geo':
+        from geoanalysis import analyze_locations
+        analyze_locations()
+    elif name == 'tiles':
+        from spatial_index import build_spatial_index
+        build_spatial_index()
+    elif name == 'enrich':
+        from place_enrichment import enrich_places
+        enrich_places()
+    elif name == 'routes':
+        # Only months touched since the last run are recomputed
+        from route_index import update_route_index
+        update_route_index()
+    elif name == 'rollups':
+        from rollups import build_rollups
+        build_rollups()
+
+@lru_cache(maxsize=None)
+def code_version(module_files):
+    """Hash of the source files a stage is built from"""
+    digest = hashlib.sha1()
+    for module_file in module_files:
+        with open(os.path.join(SRC_DIR, module_file), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def file_fingerprint(path, previous=None):
+    """mtime, size and content hash of an input file
+
+    The content is only re-hashed when mtime or size differ from the
+    previous fingerprint, so an untouched file costs a single stat.
+    """
+    stat = os.stat(path)
+    if previous and previous['mtime_ns'] == stat.st_mtime_ns and previous['size'] == stat.st_size:
+        return previous
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha1': digest.hexdigest()}
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_FILE):
+        return {'inputs': {}, 'stages': {}}
+    with open(MANIFEST_FILE, 'r') as f:
+        return json.load(f)
+
+def save_manifest(manifest):
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    with open(MANIFEST_FILE + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(MANIFEST_FILE + '.tmp', MANIFEST_FILE)
+
+def manifest_version(manifest):
+    """Hash of a manifest's stage keys, None before any stage was built"""
+    if not manifest['stages']:
+        return None
+    return hashlib.sha1(json.dumps(manifest['stages'], sort_keys=True).encode()).hexdigest()
+
+def stage_key(name, inputs, keys):
+    """Cache key of a stage from its input hashes, code and upstream keys"""
+    stage = STAGES[name]
+    payload = {
+        'inputs': [inputs[path] and inputs[path]['sha1'] for path in stage['inputs']],
+        'code': code_version(tuple(stage['modules'])),
+        'upstream': [keys[dependency] for dependency in stage['depends_on']]
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+def run_pipeline(force=False, requested=()):
+    """Rebuild the stages whose inputs, code or upstream stages changed
+
+    On-demand stages are only considered when named in requested, and
+    stages with a missing input are skipped, keeping their outputs. Returns
+    the names of the stages that were rebuilt. When anything was rebuilt,
+    compressed copies of its outputs are written (see artifacts) and the
+    timings of its stages go to instrumentation.REPORT_FILE.
+    """
+    global _outputs_version
+    since = instrumentation.mark()
+    manifest = load_manifest()
+    previous = manifest['inputs']
+    inputs = manifest['inputs'] = {}
+
+    keys = {}
+    rebuilt = []
+    # STAGES is declared in dependency order
+    for name, stage in STAGES.items():
+        # Fingerprinted only now, as earlier stages write the store manifest
+        for path in stage['inputs']:
+            if path not in inputs:
+                inputs[path] = file_fingerprint(path, previous.get(path)) if os.path.exists(path) else None
+        keys[name] = stage_key(name, inputs, keys)
+        if stage.get('on_demand') and name not in requested:
+            continue
+        if any(inputs[path] is None for path in stage['inputs']):
+            continue
+        fresh = (manifest['stages'].get(name) == keys[name]
+                 and all(os.path.exists(path) for path in stage['outputs']))
+        if force or not fresh:
+            ic(f"Rebuilding stage '{name}'")
+            with instrumentation.stage(name):
+                _run_stage(name)
+            rebuilt.append(name)
+            manifest['stages'][name] = keys[name]
+            save_manifest(manifest)
+
+    save_manifest(manifest)
+    _outputs_version = manifest_version(manifest)
+    if rebuilt:
+        outputs = [path for name in rebuilt for path in STAGES[name]['outputs']
+                   if path.startswith(OUTPUT_DIR + '/')]
+        with instrumentation.stage('compress') as metrics:
+            for path, encodings in artifacts.precompress_outputs(outputs).items():
+                metrics.count('files')
+                for encoding in encodings:
+                    metrics.wrote_file(path + artifacts.SUFFIXES[encoding])
+        instrumentation.write_run_report(since, rebuilt=rebuilt, forced=force)
+    return rebuilt
+
+def _input_signature():
+    """Timeline.json stat and update_store count, None with nothing to build from"""
+    try:
+        stat = os.stat(TIMELINE_FILE)
+    except FileNotFoundError:
+        # Uploads merged by this process can still be built from
+        return (None, _store_updates) if _store_updates else None
+    return (stat.st_mtime_ns, stat.st_size, _store_updates)
+
+def ensure_fresh(*requested):
+    """Bring the pipeline outputs up to date, cheaply when nothing changed
+
+    requested names on-demand stages to build as well. The Timeline.json
+    stat from the last check is remembered in-process, so repeated calls
+    with an unchanged input do nothing beyond that stat.
+    """
+    requested = frozenset(requested)
+    signature = _input_signature()
+    if signature is None:
+        # Nothing to build from; serve whatever outputs exist
+        return []
+    if _last_input_stat.get(requested) == signature:
+        return []
+    with _lock:
+        if _last_input_stat.get(requested) == signature:
+            return []
+        rebuilt = run_pipeline(requested=requested)
+        _last_input_stat[requested] = signature
+    return rebuilt
+
+def outputs_version():
+    """Token that changes whenever a pipeline run builds from new inputs or code
+
+    Kept in-process: the manifest is read once, then every run_pipeline
+    of this process sets it, so asking costs no file system access. Runs
+    in other processes are picked up after a restart.
+    """
+    global _outputs_version
+    if _outputs_version is _UNKNOWN:
+        _outputs_version = manifest_version(load_manifest())
+    return _outputs_version
+
+def _refresh(requested):
+    try:
+        ensure_fresh(*requested)
+    except Exception as e:
+        # The previous outputs keep being served; the failure is in the metrics
+        ic(f'Background refresh failed: {e!r}')
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(requested)
+
+def refresh_in_background(*requested):
+    """ensure_fresh without waiting for it
+
+    When Timeline.json changed since the last check, the rebuild runs on a
+    background thread (one at a time per set of requested stages) while
+    callers keep using the current outputs. Returns whether a refresh is
+    running.
+    """
+    requested = frozenset(requested)
+    signature = _input_signature()
+    if signature is None or _last_input_stat.get(requested) == signature:
+        return False
+    with _refreshing_lock:
+        if requested not in _refreshing:
+            _refreshing.add(requested)
+            threading.Thread(target=_refresh, args=(requested,), name='pipeline-refresh', daemon=True).start()
+    return True
+
+def update_store(change):
+    """Change the store outside the extract stage, then rebuild its readers
+
+    change() runs under the pipeline lock, so it never interleaves with an
+    extraction or another change; the stages reading the store are rebuilt
+    before the lock is released, on-demand ones when next requested.
+    Returns what change() returned.
+    """
+    global _store_updates
+    with _lock:
+        result = change()
+        _store_updates += 1
+        run_pipeline()
+        _last_input_stat[frozenset()] = _input_signature()
+    return result
@@ -0,0 +1,223 @@
+import glob
+import hashlib
+import json
+import os
+from collections import OrderedDict
+import numpy as np
+from icecream import ic
+from timeline_store import STORE_DIR, load_segments, store_version
+from movement_metrics import EARTH_RADIUS_M, haversine_m
+
+PLACE_COLUMNS = ['start_time', 'end_time', 'place_id', 'semantic_type', 'lat', 'lng']
+
+# Visits within EPS_METERS of each other chain into one place, which needs
+# at least MIN_VISITS visits to count as frequent
+EPS_METERS = 100
+MIN_VISITS = 3
+
+# Visits are first snapped to grid cells this many times smaller than eps;
+# DBSCAN then runs over the (weighted) cells rather than every visit.
+# Finer cells cost more neighbours per cell (about pi * CELL_FRACTION^2).
+CELL_FRACTION = 4
+
+# Cached clusterings kept per store, and in memory per process
+CACHE_ENTRIES = 8
+_loaded = OrderedDict()
+
+def cache_dir(store_dir=STORE_DIR):
+    return os.path.join(store_dir, 'places')
+
+def grid_cells(lat, lng, cell_m):
+    """Row and column of the global grid cell (cell_m on a side) of every point"""
+    step = np.degrees(cell_m / EARTH_RADIUS_M)
+    return np.floor(lat / step).astype(np.int64), np.floor(lng / step).astype(np.int64)
+
+def snap_to_cells(lat, lng, cell_m):
+    """Cell index of every point, and the mean coordinates and size of each cell"""
+    rows, cols = grid_cells(lat, lng, cell_m)
+    # Offset both indexes to be non-negative and pack them into one int64 key
+    keys = ((rows + (1 << 31)) << 32) | (cols + (1 << 31))
+    _, inverse = np.unique(keys, return_inverse=True)
+    inverse = inverse.ravel()
+    counts = np.bincount(inverse)
+    cell_lat = np.bincount(inverse, weights=lat) / counts
+    cell_lng = np.bincount(inverse, weights=lng) / counts
+    return inverse, cell_lat, cell_lng, counts
+
+def cluster_points(lat, lng, eps_m=EPS_METERS, min_visits=MIN_VISITS):
+    """DBSCAN cluster label (-1 for noise) of every point
+
+    Points are snapped to cells of eps_m / CELL_FRACTION and deduplicated
+    first, so the haversine ball tree only sees one weighted point per
+    cell. That keeps every eps-neighbourhood small no matter how many
+    visits share a place, and the whole run O(n log n).
+    """
+    if not len(lat):
+        return np.empty(0, np.int64)
+    from sklearn.cluster import DBSCAN
+
+    inverse, cell_lat, cell_lng, counts = snap_to_cells(lat, lng, eps_m / CELL_FRACTION)
+    model = DBSCAN(eps=eps_m / EARTH_RADIUS_M, min_samples=min_visits,
+                   metric='haversine', algorithm='ball_tree')
+    model.fit(np.radians(np.column_stack([cell_lat, cell_lng])), sample_weight=counts)
+    return model.labels_[inverse].astype(np.int64)
+
+def _summarize_clusters(labels, visits):
+    """Per-cluster counts, dwell-weighted centroids and extents"""
+    keep = labels >= 0
+    labels = labels[keep]
+    size = int(labels.max()) + 1 if len(labels) else 0
+
+    visits = visits[keep]
+    lat, lng = visits.lat, visits.lng
+    start, end = visits.floats('start_time'), visits.floats('end_time')
+    dwell_hours = np.nan_to_num((end - start) / 3_600_000)
+    codes, names = visits.semantic_type, visits.names('semantic_type')
+    place_ids = visits.place_id
+    known_place = place_ids >= 0
+
+    counts = np.bincount(labels, minlength=size)
+    dwell = np.bincount(labels, weights=dwell_hours, minlength=size)
+    # Centroids are weighted by time spent; clusters without any known
+    # duration fall back to plain means
+    weights = np.where(dwell[labels] > 0, dwell_hours, 1.0)
+    weight_sums = np.bincount(labels, weights=weights, minlength=size)
+    center_lat = np.bincount(labels, weights=lat * weights, minlength=size) / weight_sums
+    center_lng = np.bincount(labels, weights=lng * weights, minlength=size) / weight_sums
+
+    radius = np.zeros(size)
+    np.maximum.at(radius, labels, haversine_m(lat, lng, center_lat[labels], center_lng[labels]))
+
+    first = np.full(size, np.inf)
+    last = np.full(size, -np.inf)
+    np.minimum.at(first, labels, np.where(np.isnan(start), np.inf, start))
+    np.maximum.at(last, labels, np.where(np.isnan(end), -np.inf, end))
+
+    # Most common semantic type per cluster, from a (cluster, type) histogram
+    typed = codes >= 0
+    type_counts = np.bincount(labels[typed] * len(names) + codes[typed],
+                              minlength=size * len(names)).reshape(size, len(names))
+
+    # Distinct place ids per cluster
+    pairs = np.unique(np.stack([labels[known_place], place_ids[known_place].astype(np.int64)]), axis=1)
+    distinct_places = np.bincount(pairs[0], minlength=size)
+
+    places = []
+    for i in np.argsort(-dwell, kind='stable'):
+        places.append({
+            'id': int(i),
+            'lat': round(float(center_lat[i]), 6),
+            'lng': round(float(center_lng[i]), 6),
+            'visits': int(counts[i]),
+            'dwell_hours': round(float(dwell[i]), 3),
+            'radius_m': round(float(radius[i]), 1),
+            'place_ids': int(distinct_places[i]),
+            'semantic_type': names[int(type_counts[i].argmax())] if len(names) and type_counts[i].any() else None,
+            'first_visit': int(first[i]) if np.isfinite(first[i]) else None,
+            'last_visit': int(last[i]) if np.isfinite(last[i]) else None
+        })
+    return places
+
+def _cluster_visits(visits, eps_m, min_visits):
+    """compute_frequent_places result and the place id of every visit (-1 for none)"""
+    lat, lng = visits.lat, visits.lng
+    located = ~np.isnan(lat) & ~np.isnan(lng)
+
+    labels = cluster_points(lat[located], lng[located], eps_m, min_visits)
+    places = _summarize_clusters(labels, visits[located])
+    visit_labels = np.full(len(visits), -1, np.int32)
+    visit_labels[located] = labels
+    return {
+        'eps_m': eps_m,
+        'min_visits': min_visits,
+        'located_visits': int(located.sum()),
+        'clustered_visits': int((labels >= 0).sum()),
+        'places': places
+    }, visit_labels
+
+def compute_frequent_places(visits=None, eps_m=EPS_METERS, min_visits=MIN_VISITS):
+    """Cluster located visits into frequently visited places
+
+    Returns the parameters, visit totals and the places sorted by dwell
+    time, each with its dwell-weighted centroid, visit count, radius and
+    most common semantic type.
+    """
+    if visits is None:
+        visits = load_segments('visits', PLACE_COLUMNS)
+    return _cluster_visits(visits, eps_m, min_visits)[0]
+
+def _cache_key(eps_m, min_visits, store_dir):
+    return hashlib.sha1(json.dumps([store_version(store_dir), eps_m, min_visits]).encode()).hexdigest()
+
+def _labels_path(key, store_dir):
+    return os.path.join(cache_dir(store_dir), f'{key}.labels.npy')
+
+def _cluster_store(key, eps_m, min_visits, store_dir, visits=None):
+    """Cluster the store's visits and cache the places and per-visit labels under key"""
+    if visits is None:
+        visits = load_segments('visits', PLACE_COLUMNS, store_dir)
+    result, labels = _cluster_visits(visits, eps_m, min_visits)
+    result['version'] = key
+    os.makedirs(cache_dir(store_dir), exist_ok=True)
+    # Labels first: a cached result always has its labels next to it
+    labels_path = _labels_path(key, store_dir)
+    with open(labels_path + '.tmp', 'wb') as f:
+        np.save(f, labels)
+    os.replace(labels_path + '.tmp', labels_path)
+    path = os.path.join(cache_dir(store_dir), f'{key}.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(result, f)
+    os.replace(path + '.tmp', path)
+
+    # Drop the oldest cached clusterings
+    cached = sorted(glob.glob(os.path.join(cache_dir(store_dir), '*.json')), key=os.path.getmtime)
+    for old in cached[:-CACHE_ENTRIES]:
+        os.remove(old)
+        old_labels = _labels_path(os.path.splitext(os.path.basename(old))[0], store_dir)
+        if os.path.exists(old_labels):
+            os.remove(old_labels)
+    ic(f"Clustered {result['clustered_visits']} of {result['located_visits']} visits "
+       f"into {len(result['places'])} frequent places")
+    return _remember(key, result), labels
+
+def frequent_places(eps_m=EPS_METERS, min_visits=MIN_VISITS, store_dir=STORE_DIR, visits=None):
+    """compute_frequent_places for the store, cached by its fingerprint
+
+    The cache key combines the store version with the parameters, so a
+    re-extraction or different parameters recompute, anything else is a
+    single small file read, or none when this process already read it.
+    Callers that have loaded the store's visits (with PLACE_COLUMNS)
+    already pass them as visits, which a recompute then uses instead of
+    loading them again. The result is shared between callers and must not
+    be modified.
+    """
+    key = _cache_key(eps_m, min_visits, store_dir)
+    if key in _loaded:
+        _loaded.move_to_end(key)
+        return _loaded[key]
+    path = os.path.join(cache_dir(store_dir), f'{key}.json')
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            return _remember(key, json.load(f))
+    return _cluster_store(key, eps_m, min_visits, store_dir, visits)[0]
+
+def visit_places(eps_m=EPS_METERS, min_visits=MIN_VISITS, store_dir=STORE_DIR):
+    """Place id (as in frequent_places) of every visit of the store, -1 for none
+
+    Read from the frequent_places cache, so the visits are only clustered
+    once per store version and parameters.
+    """
+    key = _cache_key(eps_m, min_visits, store_dir)
+    try:
+        return np.load(_labels_path(key, store_dir))
+    except FileNotFoundError:
+        return _cluster_store(key, eps_m, min_visits, store_dir)[1]
+
+def _remember(key, result):
+    _loaded[key] = result
+    while len(_loaded) > CACHE_ENTRIES:
+        _loaded.popitem(last=False)
+    return result
+
+if __name__ == "__main__":
+    frequent_places()
@@ -0,0 +1,267 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+import pyarrow as pa
+import pyarrow.compute as pc
+from dotenv import load_dotenv
+from icecream import ic
+from timeline_store import STORE_DIR, read_table
+
+# Load environment variables
+load_dotenv()
+
+# Get API key from environment variable
+GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
+
+PLACES_BASE_URL = 'https://maps.googleapis.com'
+
+CACHE_FILE = 'data/places_cache.sqlite'
+OUTPUT_FILE = 'data/detailed_places_full.json'
+
+# Place details may be cached for up to 30 days under the Places API terms
+CACHE_TTL_DAYS = 30
+
+# Requests in flight at once, and requests started per second
+CONCURRENCY = 8
+RATE_PER_SECOND = 10
+
+# Transient failures are retried this many times with exponential backoff
+RETRIES = 3
+
+# Everything data_filtering keeps, plus a little context
+DETAIL_FIELDS = ['name', 'geometry/location', 'type', 'rating', 'price_level',
+                 'formatted_address', 'business_status', 'user_ratings_total']
+
+PLACE_COLUMNS = ['start_time', 'end_time', 'place_id', 'semantic_type', 'lat', 'lng']
+
+class PlaceNotFound(Exception):
+    """The backend has no details for a place id; cached like a hit"""
+
+class GoogleMapsBackend:
+    """Place Details through the googlemaps client
+
+    base_url points the client at another server speaking the same
+    protocol, e.g. fake_places_server for offline runs.
+    """
+
+    def __init__(self, api_key=None, base_url=None, fields=DETAIL_FIELDS):
+        self.api_key = api_key or GOOGLE_API_KEY
+        if not self.api_key:
+            raise ValueError('GOOGLE_API_KEY is not set')
+        self.base_url = base_url or PLACES_BASE_URL
+        self.fields = fields
+        # googlemaps clients are not thread-safe; keep one per worker thread
+        self._local = threading.local()
+
+    def _client(self):
+        if not hasattr(self._local, 'client'):
+            from googlemaps import Client
+            # Rate limiting is done by the enrichment run, across all threads
+            self._local.client = Client(key=self.api_key, base_url=self.base_url,
+                                        queries_per_second=1000, retry_over_query_limit=False)
+        return self._local.client
+
+    def fetch(self, place_id):
+        from googlemaps.exceptions import ApiError
+        try:
+            return self._client().place(place_id, fields=self.fields)['result']
+        except ApiError as error:
+            if error.status in ('NOT_FOUND', 'INVALID_REQUEST'):
+                raise PlaceNotFound(place_id) from error
+            raise
+
+class RateLimiter:
+    """Spaces out calls to at most rate per second, across threads"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+class PlaceCache:
+    """SQLite cache of place details with time-to-live eviction
+
+    Misses (status 'NOT_FOUND') are cached as well, so unknown places are
+    not re-requested on every run either.
+    """
+
+    def __init__(self, path=CACHE_FILE, ttl_days=CACHE_TTL_DAYS):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.ttl = ttl_days * 86400
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS place_details (
+                place_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                details TEXT,
+                fetched_at REAL NOT NULL
+            )""")
+        self.connection.commit()
+
+    def evict_expired(self):
+        """Delete entries older than the TTL; returns how many were removed"""
+        cursor = self.connection.execute('DELETE FROM place_details WHERE fetched_at < ?',
+                                         (time.time() - self.ttl,))
+        self.connection.commit()
+        return cursor.rowcount
+
+    def get_many(self, place_ids, batch_size=500):
+        """Fresh cache entries as {place_id: (status, details)}"""
+        entries = {}
+        cutoff = time.time() - self.ttl
+        for i in range(0, len(place_ids), batch_size):
+            batch = place_ids[i:i + batch_size]
+            rows = self.connection.execute(
+                f"SELECT place_id, status, details FROM place_details "
+                f"WHERE fetched_at >= ? AND place_id IN ({','.join('?' * len(batch))})",
+                [cutoff, *batch])
+            for place_id, status, details in rows:
+                entries[place_id] = (status, json.loads(details) if details else None)
+        return entries
+
+    def put(self, place_id, status, details):
+        self.connection.execute(
+            'INSERT OR REPLACE INTO place_details (place_id, status, details, fetched_at) VALUES (?, ?, ?, ?)',
+            (place_id, status, json.dumps(details) if details is not None else None, time.time()))
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+def _iso(epoch_ms):
+    return None if epoch_ms is None else datetime.fromtimestamp(epoch_ms / 1000, timezone.utc).isoformat()
+
+def visited_places(store_dir=STORE_DIR):
+    """One summary per distinct place_id in the visits, most visited first
+
+    Returned in the 'original_data' shape data_filtering reads.
+    """
+    visits = read_table('visits', PLACE_COLUMNS, store_dir)
+    visits = visits.filter(pc.is_valid(visits.column('place_id')))
+    dwell_hours = pc.divide(pc.cast(pc.subtract(visits.column('end_time'), visits.column('start_time')),
+                                    pa.float64()), 3_600_000)
+    visits = visits.append_column('dwell_hours', dwell_hours) \
+                   .set_column(visits.schema.get_field_index('semantic_type'), 'semantic_type',
+                               pc.cast(visits.column('semantic_type'), pa.string()))
+    grouped = visits.group_by('place_id', use_threads=False).aggregate([
+        ('place_id', 'count'),
+        ('dwell_hours', 'sum'),
+        ('start_time', 'min'),
+        ('end_time', 'max'),
+        ('lat', 'mean'),
+        ('lng', 'mean'),
+        ('semantic_type', 'first')
+    ])
+    grouped = grouped.sort_by([('place_id_count', 'descending'), ('place_id', 'ascending')])
+
+    places = []
+    for row in grouped.to_pylist():
+        places.append({
+            'placeId': row['place_id'],
+            'location': {'lat': row['lat_mean'], 'lng': row['lng_mean']},
+            'semanticType': row['semantic_type_first'],
+            'visitCount': row['place_id_count'],
+            'timeSpent': round(row['dwell_hours_sum'] or 0.0, 3),
+            'visitTime': _iso(row['start_time_min']),
+            'lastVisitTime': _iso(row['end_time_max'])
+        })
+    return places
+
+def _fetch_with_retries(backend, limiter, place_id):
+    for attempt in range(RETRIES + 1):
+        limiter.wait()
+        try:
+            return 'OK', backend.fetch(place_id)
+        except PlaceNotFound:
+            return 'NOT_FOUND', None
+        except Exception:
+            if attempt == RETRIES:
+                raise
+            time.sleep(0.5 * 2 ** attempt)
+
+def fetch_place_details(place_ids, backend, cache, concurrency=CONCURRENCY, rate=RATE_PER_SECOND):
+    """Details for every place id: cache hits first, misses from the backend
+
+    Duplicates are looked up once. Misses are fetched by a thread pool of
+    `concurrency` workers sharing one rate limiter, and written to the
+    cache as they arrive. Returns ({place_id: details or None}, counts).
+    """
+    unique_ids = list(dict.fromkeys(place_ids))
+    entries = cache.get_many(unique_ids)
+    misses = [place_id for place_id in unique_ids if place_id not in entries]
+    counts = {'places': len(unique_ids), 'cached': len(entries), 'fetched': 0, 'not_found': 0, 'failed': 0}
+
+    if misses:
+        limiter = RateLimiter(rate)
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = {pool.submit(_fetch_with_retries, backend, limiter, place_id): place_id
+                       for place_id in misses}
+            for future in as_completed(futures):
+                place_id = futures[future]
+                try:
+                    status, details = future.result()
+                except Exception as error:
+                    counts['failed'] += 1
+                    ic(f"Failed to fetch details for {place_id}: {error}")
+                    continue
+                cache.put(place_id, status, details)
+                entries[place_id] = (status, details)
+                counts['fetched' if status == 'OK' else 'not_found'] += 1
+                if (counts['fetched'] + counts['not_found']) % 100 == 0:
+                    cache.commit()
+        cache.commit()
+
+    return {place_id: entries[place_id][1] for place_id in unique_ids if place_id in entries}, counts
+
+def enrich_places(backend=None, output_file=OUTPUT_FILE, cache_file=CACHE_FILE, ttl_days=CACHE_TTL_DAYS,
+                  concurrency=CONCURRENCY, rate=RATE_PER_SECOND, store_dir=STORE_DIR):
+    """Fetch Google place details for every visited place into output_file
+
+    Only place ids missing from (or expired in) the cache are requested, so
+    re-running on an unchanged history makes no network calls. The output
+    has the {'metadata', 'places': [{'original_data', 'google_details'}]}
+    layout read by data_filtering.
+    """
+    backend = GoogleMapsBackend() if backend is None else backend
+    places = visited_places(store_dir)
+    cache = PlaceCache(cache_file, ttl_days)
+    try:
+        evicted = cache.evict_expired()
+        details, counts = fetch_place_details([place['placeId'] for place in places], backend, cache,
+                                              concurrency, rate)
+    finally:
+        cache.close()
+
+    output = {
+        'metadata': {
+            'filtered_date': datetime.now().isoformat(),
+            'total_places': len(places),
+            **{key: value for key, value in counts.items() if key != 'places'},
+            'evicted': evicted
+        },
+        'places': [{'original_data': place, 'google_details': details.get(place['placeId']) or {}}
+                   for place in places]
+    }
+    with open(output_file + '.tmp', 'w') as f:
+        json.dump(output, f)
+    os.replace(output_file + '.tmp', output_file)
+    ic(f"Enriched {len(places)} places: {counts['cached']} cached, {counts['fetched']} fetched, "
+       f"{counts['not_found']} not found, {counts['failed']} failed")
+    return output['metadata']
+
+if __name__ == "__main__":
+    enrich_places()
@@ -0,0 +1,257 @@
+"""Pre-aggregated rollup cubes of the visits and activities
+
+Each table is rolled up into cells of (local day, local start hour,
+semantic/activity type, place cluster) holding the segment count, the hours
+spent and, for activities, the distance travelled. Only non-empty cells are
+stored, as parallel arrays in one .npz file per table, so a cube is a small
+fraction of the store and loads in milliseconds. Weekdays, months and years
+are derived from the day when querying.
+
+Place clusters are the DBSCAN places of place_clustering (the ids served
+by /api/places with the default parameters), read from its cache rather
+than clustered again; an activity belongs to the place of the visit that
+starts right after it. -1 means no place.
+
+    cube = RollupCube('activities')
+    cube.query(by=['weekday', 'hour'], start=day_number('2016-01-01'), types=['WALKING'])
+
+Queries mask and bincount the cells, never the segments.
+"""
+import os
+from datetime import date
+import numpy as np
+from icecream import ic
+from timeline_store import STORE_DIR, load_segments, store_version
+from place_clustering import EPS_METERS, MIN_VISITS, visit_places
+from route_index import BRACKET_GAP_MS
+from instrumentation import stage
+
+# Measures summed per cell besides the segment count
+MEASURES = {
+    'visits': ['dwell_hours'],
+    'activities': ['duration_hours', 'distance_km']
+}
+
+VISIT_COLUMNS = ['start_time', 'end_time', 'timezone_offset', 'semantic_type', 'lat', 'lng']
+ACTIVITY_COLUMNS = ['start_time', 'end_time', 'timezone_offset', 'type', 'distance_meters']
+
+# Dimensions a query can group by; weekday, month and year derive from day
+GROUP_DIMENSIONS = ['day', 'month', 'year', 'weekday', 'hour', 'type', 'place']
+
+DAY_ORDER = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# Largest number of groups a query may return (e.g. day x place)
+MAX_GROUPS = 100_000
+
+MS_PER_MINUTE = 60_000
+MS_PER_HOUR = 3_600_000
+MS_PER_DAY = 86_400_000
+
+def rollup_dir(store_dir=STORE_DIR):
+    return os.path.join(store_dir, 'rollups')
+
+def cube_path(name, store_dir=STORE_DIR):
+    return os.path.join(rollup_dir(store_dir), f'{name}.npz')
+
+def day_number(value):
+    """Days since 1970-01-01 of an ISO date ('2016-03-01')"""
+    return date.fromisoformat(value[:10]).toordinal() - date(1970, 1, 1).toordinal()
+
+def _day_labels(days):
+    return [str(day) for day in days.astype('datetime64[D]')]
+
+def _destination_places(activities, visits, visit_labels):
+    """Place cluster of the visit starting within BRACKET_GAP_MS after each activity ends"""
+    visit_start = visits.floats('start_time')
+    dated = np.flatnonzero(~np.isnan(visit_start))
+    order = dated[np.argsort(visit_start[dated], kind='stable')]
+    places = np.full(len(activities), -1, np.int64)
+    if not len(order):
+        return places
+    end = activities.floats('end_time')
+    index = np.searchsorted(visit_start[order], end, 'left')
+    found = index < len(order)
+    index = np.minimum(index, len(order) - 1)
+    gap = visit_start[order][index] - end
+    found &= gap <= BRACKET_GAP_MS
+    places[found] = visit_labels[order][index[found]]
+    return places
+
+def build_cube(segments, type_column, places, measures):
+    """Sum the measures of dated segments into their non-empty cells
+
+    measures maps a name to one float value per segment (NaN counts as 0).
+    Segments are bucketed by their local start day and hour, using their
+    own timezone offset.
+    """
+    start = segments.floats('start_time')
+    dated = ~np.isnan(start)
+    offset = np.nan_to_num(segments.floats('timezone_offset'))
+    local = (start[dated] + offset[dated] * MS_PER_MINUTE).astype(np.int64)
+    day = np.floor_divide(local, MS_PER_DAY)
+    hour = np.floor_divide(local, MS_PER_HOUR) % 24
+    # Missing types and places (-1) get the last slot of their dimension
+    types = segments.column(type_column)[dated].astype(np.int64)
+    names = segments.names(type_column)
+    types[types < 0] = len(names)
+    place = places[dated].copy()
+    place_count = int(place.max()) + 2 if len(place) else 1
+    place[place < 0] = place_count - 1
+
+    first_day = int(day.min()) if len(day) else 0
+    shape = (int(day.max()) - first_day + 1 if len(day) else 1, 24, len(names) + 1, place_count)
+    keys = np.ravel_multi_index((day - first_day, hour, types, place), shape)
+    cells, inverse = np.unique(keys, return_inverse=True)
+    inverse = inverse.ravel()
+    cell_day, cell_hour, cell_type, cell_place = np.unravel_index(cells, shape)
+    cube = {
+        'day': (cell_day + first_day).astype(np.int32),
+        'hour': cell_hour.astype(np.int8),
+        'type': np.where(cell_type == len(names), -1, cell_type).astype(np.int16),
+        'place': np.where(cell_place == place_count - 1, -1, cell_place).astype(np.int32),
+        'count': np.bincount(inverse, minlength=len(cells)).astype(np.int32),
+        'types': np.array(names, dtype=str)
+    }
+    for name, values in measures.items():
+        sums = np.bincount(inverse, weights=np.nan_to_num(values[dated]), minlength=len(cells))
+        cube[name] = sums.astype(np.float32)
+    return cube
+
+def _write(cube, path):
+    # np.savez appends .npz to names without it
+    np.savez_compressed(path + '.tmp.npz', **cube)
+    os.replace(path + '.tmp.npz', path)
+
+def build_rollups(store_dir=STORE_DIR):
+    """Build the visit and activity cubes of the store"""
+    with stage('rollups.load') as metrics:
+        visits = load_segments('visits', VISIT_COLUMNS, store_dir)
+        activities = load_segments('activities', ACTIVITY_COLUMNS, store_dir)
+        metrics.count('visits', len(visits))
+        metrics.count('activities', len(activities))
+
+    with stage('rollups.places'):
+        places = visit_places(EPS_METERS, MIN_VISITS, store_dir).astype(np.int64)
+        activity_places = _destination_places(activities, visits, places)
+
+    version = np.array(store_version(store_dir))
+    cubes = {
+        'visits': build_cube(visits, 'semantic_type', places, {
+            'dwell_hours': (visits.floats('end_time') - visits.floats('start_time')) / MS_PER_HOUR
+        }),
+        'activities': build_cube(activities, 'type', activity_places, {
+            'duration_hours': (activities.floats('end_time') - activities.floats('start_time')) / MS_PER_HOUR,
+            'distance_km': activities.distance_meters / 1000
+        })
+    }
+    with stage('rollups.save') as metrics:
+        os.makedirs(rollup_dir(store_dir), exist_ok=True)
+        for name, cube in cubes.items():
+            path = cube_path(name, store_dir)
+            _write({**cube, 'version': version}, path)
+            metrics.count(f'{name}_cells', len(cube['count']))
+            metrics.wrote_file(path)
+    ic(f"Rolled up {len(visits)} visits into {len(cubes['visits']['count'])} cells and "
+       f"{len(activities)} activities into {len(cubes['activities']['count'])} cells")
+    return cubes
+
+class RollupCube:
+    """One table's cube, loaded into memory and sliced by query"""
+
+    def __init__(self, name, store_dir=STORE_DIR):
+        if name not in MEASURES:
+            raise ValueError(f'No rollup of {name}')
+        self.name = name
+        self.measures = MEASURES[name]
+        with np.load(cube_path(name, store_dir)) as data:
+            self.cells = {key: data[key] for key in data.files}
+        self.version = str(self.cells.pop('version'))
+        self.types = self.cells.pop('types').tolist()
+        self.type_codes = {name: code for code, name in enumerate(self.types)}
+        # Derived dimensions, computed once per load
+        day = self.cells['day'].astype(np.int64)
+        months = day.astype('datetime64[D]').astype('datetime64[M]')
+        self.cells['weekday'] = ((day + 3) % 7).astype(np.int8)
+        self.cells['month'] = months.astype(np.int64).astype(np.int32)
+        self.cells['year'] = months.astype('datetime64[Y]').astype(np.int64).astype(np.int32)
+
+    def __len__(self):
+        return len(self.cells['count'])
+
+    def mask(self, start=None, end=None, hours=None, weekdays=None, types=None, places=None):
+        """Cells matching every given filter
+
+        start and end are inclusive day numbers (see day_number), hours
+        local start hours, weekdays Monday=0, types names (None for
+        segments without a type) and places cluster ids (-1 for none).
+        """
+        cells = self.cells
+        mask = np.ones(len(self), bool)
+        if start is not None:
+            mask &= cells['day'] >= start
+        if end is not None:
+            mask &= cells['day'] <= end
+        if hours is not None:
+            mask &= np.isin(cells['hour'], list(hours))
+        if weekdays is not None:
+            mask &= np.isin(cells['weekday'], list(weekdays))
+        if types is not None:
+            codes = [-1 if name is None else self.type_codes.get(name, -2) for name in types]
+            mask &= np.isin(cells['type'], codes)
+        if places is not None:
+            mask &= np.isin(cells['place'], list(places))
+        return mask
+
+    def _labels(self, dimension, values):
+        """Group index of every value and the label of every group"""
+        if dimension == 'hour':
+            return values.astype(np.int64), list(range(24))
+        if dimension == 'weekday':
+            return values.astype(np.int64), DAY_ORDER
+        groups, index = np.unique(values, return_inverse=True)
+        if dimension == 'day':
+            labels = _day_labels(groups)
+        elif dimension == 'month':
+            labels = [str(month) for month in groups.astype('datetime64[M]')]
+        elif dimension == 'year':
+            labels = [str(year) for year in groups.astype('datetime64[Y]')]
+        elif dimension == 'type':
+            labels = [self.types[code] if code >= 0 else None for code in groups]
+        else:
+            labels = [int(place) if place >= 0 else None for place in groups]
+        return index.ravel(), labels
+
+    def query(self, by=(), **filters):
+        """Measures of the matching cells, grouped by up to two dimensions
+
+        Returns the labels of each grouping dimension and, per measure,
+        nested lists indexed like them (a single total without by). Takes
+        the filters of mask.
+        """
+        by = list(by)
+        unknown = [dimension for dimension in by if dimension not in GROUP_DIMENSIONS]
+        if unknown or len(by) > 2 or len(set(by)) < len(by):
+            raise ValueError(f'by must be up to two distinct dimensions of {GROUP_DIMENSIONS}')
+        mask = self.mask(**filters)
+
+        index = np.zeros(int(mask.sum()), np.int64)
+        shape = []
+        labels = {}
+        for dimension in by:
+            group, labels[dimension] = self._labels(dimension, self.cells[dimension][mask])
+            index = index * len(labels[dimension]) + group
+            shape.append(len(labels[dimension]))
+        size = int(np.prod(shape))
+        if size > MAX_GROUPS:
+            raise ValueError(f'{size} groups, at most {MAX_GROUPS} can be returned')
+
+        result = {'table': self.name, 'version': self.version, 'by': by, 'labels': labels,
+                  'cells': int(mask.sum())}
+        for measure in ['count'] + self.measures:
+            values = np.bincount(index, weights=self.cells[measure][mask], minlength=size)
+            values = values.astype(np.int64) if measure == 'count' else np.round(values, 3)
+            result[measure] = values.reshape(shape).tolist()
+        return result
+
+if __name__ == "__main__":
+    build_rollups()
@@ -0,0 +1,337 @@
+import json
+import os
+import numpy as np
+import pyarrow as pa
+from icecream import ic
+from timeline_store import STORE_DIR, UNDATED, SCHEMAS, partition_path, table_paths, write_arrow
+from segments import SEGMENT_TYPES
+from place_clustering import grid_cells
+
+ACTIVITY_COLUMNS = ['start_time', 'end_time', 'timezone_offset', 'distance_meters',
+                    'start_lat', 'start_lng', 'end_lat', 'end_lng']
+VISIT_COLUMNS = ['start_time', 'end_time', 'place_id']
+
+# An activity endpoint is snapped to the visit bracketing it when the gap
+# between them is at most this long; otherwise to a grid cell
+BRACKET_GAP_MS = 30 * 60_000
+
+# Size of the grid cells used for endpoints without a bracketing visit
+GRID_METERS = 250
+
+# One row per (origin, destination) pair. Coordinate sums and the number of
+# endpoints with coordinates let the merged matrix place every node at the
+# mean of its located endpoints.
+OD_SCHEMA = pa.schema([
+    ('origin', pa.string()),       # 'place:<place_id>' or 'cell:<row>:<col>'
+    ('destination', pa.string()),
+    ('count', pa.int64()),
+    ('distance_m', pa.float64()),
+    ('duration_s', pa.float64()),
+    ('hours', pa.list_(pa.int32(), 24)),  # trips per local start hour
+    ('origin_lat_sum', pa.float64()),
+    ('origin_lng_sum', pa.float64()),
+    ('destination_lat_sum', pa.float64()),
+    ('destination_lng_sum', pa.float64()),
+    ('origin_located', pa.int64()),
+    ('destination_located', pa.int64())
+])
+
+SUM_COLUMNS = ['count', 'distance_m', 'duration_s', 'origin_lat_sum', 'origin_lng_sum',
+               'destination_lat_sum', 'destination_lng_sum', 'origin_located', 'destination_located']
+COUNT_COLUMNS = ['count', 'origin_located', 'destination_located']
+
+# Part of every OD partition's signature; bumped when OD_SCHEMA changes so
+# partitions written by older code are recomputed
+OD_FORMAT = 2
+
+def index_dir(store_dir=STORE_DIR):
+    return os.path.join(store_dir, 'routes')
+
+def od_path(store_dir=STORE_DIR):
+    return os.path.join(index_dir(store_dir), 'od.arrow')
+
+def _numpy(table, name):
+    return table.column(name).to_numpy(zero_copy_only=False)
+
+def _grid_nodes(lat, lng):
+    rows, cols = grid_cells(lat, lng, GRID_METERS)
+    return np.char.add(np.char.add(np.char.add('cell:', rows.astype(str)), ':'), cols.astype(str))
+
+def _bracketing_place(times, visit_times, place_ids, before):
+    """Place id of the visit ending just before (or starting just after) each time
+
+    visit_times must be sorted. Returns None where no visit with a known
+    place lies within BRACKET_GAP_MS.
+    """
+    if not len(visit_times):
+        return np.full(len(times), None, object)
+    if before:
+        index = np.searchsorted(visit_times, times, 'right') - 1
+        valid = index >= 0
+    else:
+        index = np.searchsorted(visit_times, times, 'left')
+        valid = index < len(visit_times)
+    index = np.clip(index, 0, len(visit_times) - 1)
+    gap = times - visit_times[index] if before else visit_times[index] - times
+    snapped = place_ids[index]
+    valid &= (gap >= 0) & (gap <= BRACKET_GAP_MS) & (snapped != None)  # noqa: E711
+    return np.where(valid, snapped, None)
+
+def snap_endpoints(activities, visits):
+    """Origin and destination node of every activity (None when unknown)
+
+    An endpoint becomes the place of the visit that ends right before the
+    activity starts (origin) or starts right after it ends (destination);
+    without such a visit it falls back to the grid cell of its coordinates.
+    """
+    start = activities.floats('start_time')
+    end = activities.floats('end_time')
+
+    visit_start = visits.floats('start_time')
+    visit_end = visits.floats('end_time')
+    place_ids = visits.decode('place_id')
+    by_end = np.argsort(visit_end, kind='stable')
+    by_start = np.argsort(visit_start, kind='stable')
+
+    nodes = []
+    for times, visit_times, order, before, prefix in ((start, visit_end, by_end, True, 'start'),
+                                                     (end, visit_start, by_start, False, 'end')):
+        place = _bracketing_place(times, visit_times[order], place_ids[order], before)
+        lat = activities.column(f'{prefix}_lat')
+        lng = activities.column(f'{prefix}_lng')
+        located = ~np.isnan(lat) & ~np.isnan(lng)
+        node = np.full(len(times), None, object)
+        node[located] = _grid_nodes(lat[located], lng[located])
+        has_place = place != None  # noqa: E711
+        node[has_place] = np.char.add('place:', place[has_place].astype(str))
+        nodes.append(node)
+    return nodes
+
+def _aggregate(columns, hours):
+    """Sum rows sharing an (origin, destination) pair into an OD table
+
+    hours is either the start hour of every row or, when merging OD
+    tables, their (rows, 24) hour histograms.
+    """
+    if not len(columns['origin']):
+        return OD_SCHEMA.empty_table()
+    pairs = np.char.add(np.char.add(columns['origin'].astype(str), '\n'), columns['destination'].astype(str))
+    _, first, inverse = np.unique(pairs, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    size = len(first)
+    if hours.ndim == 1:
+        histogram = np.bincount(inverse * 24 + hours, minlength=size * 24).reshape(size, 24)
+    else:
+        order = np.argsort(inverse, kind='stable')
+        histogram = np.add.reduceat(hours[order], np.searchsorted(inverse[order], np.arange(size)))
+    result = {
+        'origin': columns['origin'][first].astype(str),
+        'destination': columns['destination'][first].astype(str),
+        **{name: np.bincount(inverse, weights=columns[name], minlength=size) for name in SUM_COLUMNS},
+        'hours': histogram.astype(np.int32)
+    }
+    for name in COUNT_COLUMNS:
+        result[name] = result[name].astype(np.int64)
+    return _to_table(result)
+
+def _to_table(columns):
+    hours = pa.FixedSizeListArray.from_arrays(pa.array(columns['hours'].ravel(), pa.int32()), 24)
+    return pa.table({name: (hours if name == 'hours' else columns[name]) for name in OD_SCHEMA.names},
+                    OD_SCHEMA)
+
+def _from_table(table):
+    columns = {name: _numpy(table, name) for name in OD_SCHEMA.names if name != 'hours'}
+    hours = table.column('hours').combine_chunks()
+    columns['hours'] = hours.flatten().to_numpy(zero_copy_only=False).reshape(-1, 24)
+    return columns
+
+def build_od_partition(activities, visits):
+    """OD table of one batch of activities, snapped against the given visits"""
+    origin, destination = snap_endpoints(activities, visits)
+    known = (origin != None) & (destination != None)  # noqa: E711
+
+    start = activities.floats('start_time')
+    end = activities.floats('end_time')
+    offset = np.nan_to_num(activities.floats('timezone_offset'))
+    local_start = np.nan_to_num(start + offset * 60_000).astype(np.int64)
+    hour = np.floor_divide(local_start, 3_600_000) % 24
+
+    columns = {
+        'origin': origin,
+        'destination': destination,
+        'count': np.ones(len(start)),
+        'distance_m': np.nan_to_num(activities.distance_meters),
+        'duration_s': np.nan_to_num((end - start) / 1000),
+        'origin_lat_sum': activities.start_lat,
+        'origin_lng_sum': activities.start_lng,
+        'destination_lat_sum': activities.end_lat,
+        'destination_lng_sum': activities.end_lng,
+        'origin_located': (~np.isnan(activities.start_lat) & ~np.isnan(activities.start_lng)).astype(np.float64),
+        'destination_located': (~np.isnan(activities.end_lat) & ~np.isnan(activities.end_lng)).astype(np.float64)
+    }
+    # Endpoints without coordinates (only possible for place nodes) add
+    # nothing to the sums and are left out of the located counts
+    for name in ('origin_lat_sum', 'origin_lng_sum', 'destination_lat_sum', 'destination_lng_sum'):
+        columns[name] = np.nan_to_num(columns[name])
+    return _aggregate({name: values[known] for name, values in columns.items()}, hour[known])
+
+def merge_od(tables):
+    """Sum several OD tables into one"""
+    tables = [table for table in tables if table.num_rows]
+    if not tables:
+        return OD_SCHEMA.empty_table()
+    columns = _from_table(pa.concat_tables(tables))
+    return _aggregate({name: columns[name].astype(object) if name in ('origin', 'destination')
+                       else columns[name] for name in columns if name != 'hours'}, columns['hours'])
+
+def _neighbour_months(month):
+    current = np.datetime64(month, 'M')
+    return [str(current - 1), month, str(current + 1)]
+
+def _read_partitions(name, months, columns, store_dir):
+    """Segments of some monthly partitions of a table (see segments.SEGMENT_TYPES)"""
+    paths = [partition_path(name, month, store_dir) for month in months]
+    tables = [pa.ipc.open_file(pa.memory_map(path)).read_all().select(columns)
+              for path in paths if os.path.exists(path)]
+    table = pa.concat_tables(tables) if tables else SCHEMAS[name].empty_table().select(columns)
+    return SEGMENT_TYPES[name].from_arrow(table)
+
+def _signature(neighbours, store_dir):
+    """Stats of the files an OD partition is computed from"""
+    signature = [f'format:{OD_FORMAT}']
+    for name in ('activities', 'visits'):
+        for month in neighbours if name == 'visits' else neighbours[1:2]:
+            path = partition_path(name, month, store_dir)
+            if os.path.exists(path):
+                stat = os.stat(path)
+                signature.append(f'{name}/{month}:{stat.st_mtime_ns}:{stat.st_size}')
+    return signature
+
+def update_route_index(store_dir=STORE_DIR, force=False):
+    """Bring the origin-destination matrix up to date with the store
+
+    The matrix is kept as one OD partition per monthly activities
+    partition. Only the months whose activities, or whose own or
+    neighbouring visits (which bracket activities across month ends),
+    changed since the last run are recomputed before the partitions are
+    merged again. Returns the number of recomputed months.
+    """
+    partitions_dir = os.path.join(index_dir(store_dir), 'partitions')
+    os.makedirs(partitions_dir, exist_ok=True)
+    manifest_file = os.path.join(index_dir(store_dir), 'manifest.json')
+    manifest = {}
+    if os.path.exists(manifest_file) and not force:
+        with open(manifest_file, 'r') as f:
+            manifest = json.load(f)
+
+    # Undated activities cannot be bracketed or binned by hour
+    months = [os.path.splitext(os.path.basename(path))[0] for path in table_paths('activities', store_dir)]
+    months = [month for month in months if month != UNDATED]
+
+    updated = 0
+    for month in months:
+        neighbours = _neighbour_months(month)
+        signature = _signature(neighbours, store_dir)
+        path = os.path.join(partitions_dir, f'{month}.arrow')
+        if manifest.get(month) == signature and os.path.exists(path):
+            continue
+        activities = _read_partitions('activities', neighbours[1:2], ACTIVITY_COLUMNS, store_dir)
+        visits = _read_partitions('visits', neighbours, VISIT_COLUMNS, store_dir)
+        write_arrow(path, build_od_partition(activities, visits))
+        manifest[month] = signature
+        updated += 1
+
+    for month in set(manifest) - set(months):
+        del manifest[month]
+        stale = os.path.join(partitions_dir, f'{month}.arrow')
+        if os.path.exists(stale):
+            os.remove(stale)
+
+    if updated or not os.path.exists(od_path(store_dir)) or set(manifest) != set(months):
+        partials = [pa.ipc.open_file(pa.memory_map(os.path.join(partitions_dir, f'{month}.arrow'))).read_all()
+                    for month in months]
+        od = merge_od(partials)
+        write_arrow(od_path(store_dir), od)
+        ic(f"Route index: recomputed {updated} of {len(months)} months, {od.num_rows} OD pairs")
+
+    with open(manifest_file + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_file + '.tmp', manifest_file)
+    return updated
+
+class RouteIndex:
+    """Sparse origin-destination matrix and frequent-route queries"""
+
+    def __init__(self, store_dir=STORE_DIR):
+        table = pa.ipc.open_file(pa.memory_map(od_path(store_dir))).read_all()
+        self.od = _from_table(table)
+        self.nodes, inverse = np.unique(np.concatenate([self.od['origin'], self.od['destination']]),
+                                        return_inverse=True)
+        inverse = inverse.ravel()
+        pairs = len(self.od['origin'])
+        self.origin_index = inverse[:pairs]
+        self.destination_index = inverse[pairs:]
+
+        # Node coordinates: mean over the snapped endpoints that have coordinates
+        located = np.concatenate([self.od['origin_located'], self.od['destination_located']]).astype(np.float64)
+        size = len(self.nodes)
+        weight = np.bincount(inverse, weights=located, minlength=size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.node_lat = np.bincount(inverse, weights=np.concatenate(
+                [self.od['origin_lat_sum'], self.od['destination_lat_sum']]), minlength=size) / weight
+            self.node_lng = np.bincount(inverse, weights=np.concatenate(
+                [self.od['origin_lng_sum'], self.od['destination_lng_sum']]), minlength=size) / weight
+
+    def matrix(self, values='count'):
+        """The OD matrix as a scipy.sparse CSR matrix over self.nodes"""
+        from scipy.sparse import csr_matrix
+        size = len(self.nodes)
+        data = self.od['hours'].sum(axis=1) if values == 'hours' else self.od[values]
+        return csr_matrix((data, (self.origin_index, self.destination_index)), shape=(size, size))
+
+    def _node(self, index):
+        node = str(self.nodes[index])
+        kind, _, key = node.partition(':')
+        lat, lng = self.node_lat[index], self.node_lng[index]
+        return {
+            'id': node,
+            'place_id': key if kind == 'place' else None,
+            'lat': None if np.isnan(lat) else round(float(lat), 6),
+            'lng': None if np.isnan(lng) else round(float(lng), 6)
+        }
+
+    def top_routes(self, k=20, by='count', hour=None, include_loops=False):
+        """The k most frequent (or longest travelled) origin-destination pairs
+
+        by is 'count', 'distance' or 'duration'; hour restricts counts to
+        trips starting at that local hour.
+        """
+        count = self.od['count'] if hour is None else self.od['hours'][:, hour].astype(np.int64)
+        share = np.divide(count, self.od['count'], out=np.zeros(len(count)), where=self.od['count'] > 0)
+        scores = {'count': count,
+                  'distance': self.od['distance_m'] * share,
+                  'duration': self.od['duration_s'] * share}[by]
+        candidates = count > 0
+        if not include_loops:
+            candidates &= self.origin_index != self.destination_index
+        rows = np.flatnonzero(candidates)
+        if len(rows) > k:
+            rows = rows[np.argpartition(-scores[rows], k - 1)[:k]]
+        rows = rows[np.lexsort((rows, -scores[rows]))]
+
+        routes = []
+        for row in rows:
+            total = self.od['count'][row]
+            routes.append({
+                'origin': self._node(self.origin_index[row]),
+                'destination': self._node(self.destination_index[row]),
+                'count': int(count[row]),
+                'distance_km': round(float(self.od['distance_m'][row] * share[row]) / 1000, 3),
+                'avg_distance_km': round(float(self.od['distance_m'][row] / total) / 1000, 3),
+                'avg_duration_min': round(float(self.od['duration_s'][row] / total) / 60, 1),
+                'hours': self.od['hours'][row].tolist()
+            })
+        return routes
+
+if __name__ == "__main__":
+    update_route_index()
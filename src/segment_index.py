@@ -0,0 +1,180 @@
+import numpy as np
+from timeline_store import STORE_DIR, load_segments
+
+# Columns with an inverted index (value -> rows), per table of the store
+KEY_COLUMNS = {
+    'visits': ['place_id', 'semantic_type'],
+    'activities': ['type']
+}
+
+MS_PER_MINUTE = 60_000
+MS_PER_DAY = 86_400_000
+
+# Start time given to undated rows, so they sort after every dated one
+UNDATED_TIME = np.iinfo(np.int64).max
+
+# Open ends of a time range
+MIN_TIME = -(1 << 62)
+MAX_TIME = 1 << 62
+
+EMPTY_ROWS = np.empty(0, np.int64)
+
+class IntervalList:
+    """Time intervals sorted by start, queried for overlap with a time range
+
+    Intervals are split into duration classes (powers of two minutes long).
+    Within a class, the rows overlapping [start, end] all start between
+    start minus the class's longest duration and end: two binary searches,
+    and then only the ends of those candidates are checked. A class never
+    spans more than a factor two in duration, so the candidates that turn
+    out not to overlap stay proportional to the ones that do.
+    """
+
+    def __init__(self, rows, start, end):
+        duration = np.maximum(end - start, 0)
+        classes = np.ceil(np.log2(np.maximum(duration, MS_PER_MINUTE) / MS_PER_MINUTE)).astype(np.int64)
+        self.classes = []
+        for duration_class in np.unique(classes):
+            member = classes == duration_class
+            self.classes.append((rows[member], start[member], end[member], int(duration[member].max())))
+
+    def overlapping(self, start=MIN_TIME, end=MAX_TIME):
+        """Rows whose interval overlaps [start, end] (inclusive), in row order"""
+        parts = []
+        for rows, starts, ends, longest in self.classes:
+            first = np.searchsorted(starts, start - longest, 'left')
+            last = np.searchsorted(starts, end, 'right')
+            parts.append(rows[first:last][ends[first:last] >= start])
+        if not parts:
+            return EMPTY_ROWS
+        return np.sort(np.concatenate(parts))
+
+def parse_daily_window(value):
+    """'HH:MM-HH:MM' local time of day to (start, end) minutes after midnight"""
+    first, last = value.split('-')
+    minutes = []
+    for part in (first, last):
+        hour, minute = part.split(':') if ':' in part else (part, '0')
+        hour, minute = int(hour), int(minute)
+        if not (0 <= hour <= 24 and 0 <= minute < 60 and hour * 60 + minute <= 1440):
+            raise ValueError(f'Invalid time of day: {part}')
+        minutes.append(hour * 60 + minute)
+    return tuple(minutes)
+
+class SegmentIndex:
+    """Time-range and key lookups over one table (visits or activities)
+
+    The table is loaded once as Visits or Activities (see segments) and its
+    rows reordered by start time, undated rows last. Row numbers returned by
+    query() index that order: index.segments[rows] are the matching
+    segments. Time ranges are answered by an
+    IntervalList over the dated rows, and each value of the KEY_COLUMNS has
+    its own IntervalList over its rows, so "visits to place X in March" is a
+    few binary searches however long the history is.
+    """
+
+    def __init__(self, name, store_dir=STORE_DIR):
+        segments = load_segments(name, None, store_dir)
+        start = np.where(segments.missing('start_time'), UNDATED_TIME, segments.start_time)
+        order = np.argsort(start, kind='stable')
+        self.name = name
+        self.segments = segments[order]
+        self.start = start[order]
+        self.end = np.where(self.segments.missing('end_time'), self.start, self.segments.end_time)
+        # Segments without a timezone offset are taken to be in UTC
+        self.offset = np.where(self.segments.missing('timezone_offset'), 0,
+                               self.segments.timezone_offset).astype(np.int64)
+        self.dated = int(np.searchsorted(self.start, UNDATED_TIME))
+        self.intervals = IntervalList(np.arange(self.dated), self.start[:self.dated], self.end[:self.dated])
+        self.keys = {column: self._postings(column) for column in KEY_COLUMNS[name]}
+
+    def __len__(self):
+        return len(self.segments)
+
+    def _postings(self, column):
+        """value -> (all rows, IntervalList of the dated rows) for one column"""
+        codes = self.segments.column(column).astype(np.int64)
+        names = self.segments.names(column)
+        # Rows grouped by code, each group still in start-time order
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(names) + 1))
+        postings = {}
+        for code, value in enumerate(names):
+            rows = order[bounds[code]:bounds[code + 1]]
+            if len(rows):
+                dated = rows[rows < self.dated]
+                postings[value] = (rows, IntervalList(dated, self.start[dated], self.end[dated]))
+        return postings
+
+    def values(self, column):
+        """Indexed values of a column with their row counts, most frequent first"""
+        counts = {value: len(rows) for value, (rows, _) in self.keys[column].items()}
+        return dict(sorted(counts.items(), key=lambda item: -item[1]))
+
+    def query(self, start=None, end=None, daily=None, weekdays=None, **keys):
+        """Rows of the segments matching every given filter, in start-time order
+
+        start and end (epoch ms, either may be omitted) bound a time range
+        the segment must overlap. keys filter indexed columns on one value
+        or any of a list of values, e.g. place_id='ChIJ...' or
+        type=['WALKING', 'CYCLING']. daily is a (start, end) local time-of-day
+        window in minutes after midnight and weekdays a collection of local
+        weekdays (Monday=0); with either, only segments overlapping that
+        window on one of those days are kept, using each segment's own
+        timezone offset. Undated segments only match queries without any
+        time filter.
+        """
+        timed = start is not None or end is not None
+        start = MIN_TIME if start is None else int(start)
+        end = MAX_TIME if end is None else int(end)
+
+        rows = None
+        for column, wanted in keys.items():
+            if wanted is None:
+                continue
+            if column not in self.keys:
+                raise ValueError(f'{self.name} has no index on {column}')
+            wanted = [wanted] if isinstance(wanted, str) else wanted
+            parts = []
+            for value in wanted:
+                if value in self.keys[column]:
+                    matched, intervals = self.keys[column][value]
+                    parts.append(intervals.overlapping(start, end) if timed else matched)
+            matched = np.unique(np.concatenate(parts)) if parts else EMPTY_ROWS
+            rows = matched if rows is None else np.intersect1d(rows, matched, assume_unique=True)
+
+        if rows is None:
+            rows = self.intervals.overlapping(start, end) if timed else np.arange(len(self))
+        if daily is not None or weekdays is not None:
+            rows = rows[rows < self.dated]
+            rows = rows[self._in_daily_window(rows, daily, weekdays)]
+        return rows
+
+    def _in_daily_window(self, rows, daily, weekdays):
+        """Mask of the rows overlapping a recurring local time-of-day window"""
+        window_start, window_end = (0, 1440) if daily is None else daily
+        window_start *= MS_PER_MINUTE
+        window_end *= MS_PER_MINUTE
+        if window_end <= window_start:
+            # The window runs past midnight into the next day
+            window_end += MS_PER_DAY
+        allowed = np.zeros(7, bool)
+        allowed[list(range(7) if weekdays is None else weekdays)] = True
+
+        offset = self.offset[rows] * MS_PER_MINUTE
+        local_start = self.start[rows] + offset
+        local_end = self.end[rows] + offset
+        # First day whose window ends after the segment starts; the segment
+        # overlaps that day's window, or a later one, if the window opens
+        # before the segment ends. Checking a week of days covers every weekday.
+        day = np.floor_divide(local_start - window_end, MS_PER_DAY) + 1
+        mask = np.zeros(len(rows), bool)
+        for _ in range(7):
+            # 1970-01-01 was a Thursday
+            mask |= allowed[(day + 3) % 7] & (day * MS_PER_DAY + window_start <= local_end)
+            day = day + 1
+        return mask
+
+def load_segment_indexes(store_dir=STORE_DIR):
+    """A SegmentIndex for each table of the store, by table name"""
+    return {name: SegmentIndex(name, store_dir) for name in KEY_COLUMNS}
@@ -0,0 +1,312 @@
+"""Compact struct-of-arrays model of visit and activity segments
+
+One Visits or Activities object holds a column per field instead of a dict
+per segment: int64 UTC millisecond times, int16 timezone offsets (minutes),
+float64 coordinates and probabilities, and int16/int32 codes into interned
+vocabularies for the categorical fields. A segment costs 60-70 bytes
+instead of the ~1.5 KB of a parsed dict with its strings.
+
+Missing values use sentinels so every column stays a plain NumPy array:
+MISSING_TIME and MISSING_INT for integers, NaN for floats and -1 for codes.
+floats() gives any numeric column as float64 with NaN for missing values,
+which is what most of the analysis code wants.
+
+Slicing (segments[a:b]) returns views of the same buffers; boolean masks and
+row arrays copy only the selected rows. Columns that were not loaded are
+None. The Arrow schema of each class is the store's schema (see
+timeline_store), and to_arrow/from_arrow convert without going through
+Python objects.
+"""
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from coordinates import parse_latlng_array
+
+MISSING_TIME = np.iinfo(np.int64).min
+MISSING_INT = np.iinfo(np.int16).min
+MISSING_CODE = -1
+
+# Field kind -> (NumPy dtype, missing value)
+KINDS = {
+    'time': (np.int64, MISSING_TIME),
+    'int16': (np.int16, MISSING_INT),
+    'float': (np.float64, np.nan),
+    'code': (np.int16, MISSING_CODE),
+    'key': (np.int32, MISSING_CODE)
+}
+
+def _to_epoch_ms(timestamps):
+    """Convert ISO-8601 strings with UTC offsets to int64 UTC milliseconds"""
+    return pa.array(timestamps, pa.string()).cast(pa.timestamp('ms', tz='UTC')).cast(pa.int64())
+
+def _intern(values, vocabulary, dtype):
+    """Codes of values in a vocabulary (value -> code), extending it with new values"""
+    return np.fromiter((MISSING_CODE if value is None else vocabulary.setdefault(value, len(vocabulary))
+                        for value in values), dtype, len(values))
+
+def _filled(array, kind):
+    """A non-dictionary Arrow column as NumPy, nulls replaced by the kind's sentinel"""
+    dtype, missing = KINDS[kind]
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks() if array.num_chunks != 1 else array.chunk(0)
+    if array.null_count:
+        array = pc.fill_null(array, pa.scalar(missing, array.type))
+    # Zero-copy whenever the Arrow buffer already has the target type
+    values = array.to_numpy(zero_copy_only=False)
+    return values if values.dtype == dtype else values.astype(dtype)
+
+class SegmentArrays:
+    """Base of Visits and Activities; subclasses list their FIELDS
+
+    FIELDS maps each column to (kind, Arrow type); 'code' columns are
+    dictionary-encoded in the store, 'key' columns (place ids) are plain
+    strings there and only interned in memory.
+    """
+
+    FIELDS = {}
+    __slots__ = ('categories',)
+
+    def __init__(self, categories=None, **columns):
+        unknown = set(columns) - set(self.FIELDS)
+        if unknown:
+            raise ValueError(f'{type(self).__name__} has no fields {sorted(unknown)}')
+        self.categories = dict(categories or {})
+        for name in self.FIELDS:
+            setattr(self, name, columns.get(name))
+
+    @classmethod
+    def schema(cls, columns=None):
+        """Arrow schema of the given (default all) columns, as stored"""
+        return pa.schema([(name, cls.FIELDS[name][1]) for name in (columns or cls.FIELDS)])
+
+    @property
+    def columns(self):
+        """Names of the loaded columns, in field order"""
+        return [name for name in self.FIELDS if getattr(self, name) is not None]
+
+    def __len__(self):
+        for name in self.FIELDS:
+            values = getattr(self, name)
+            if values is not None:
+                return len(values)
+        return 0
+
+    def __getitem__(self, rows):
+        """Segments selected by a slice (views), boolean mask or row numbers"""
+        return type(self)(self.categories, **{name: getattr(self, name)[rows] for name in self.columns})
+
+    def __repr__(self):
+        return f'<{type(self).__name__} {len(self)} segments, columns {self.columns}>'
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.columns)
+
+    def column(self, name):
+        values = getattr(self, name)
+        if values is None:
+            raise KeyError(f'{name} was not loaded')
+        return values
+
+    def missing(self, name):
+        """Mask of the segments without a value for a column"""
+        values = self.column(name)
+        kind = self.FIELDS[name][0]
+        return np.isnan(values) if kind == 'float' else values == KINDS[kind][1]
+
+    def floats(self, name):
+        """A numeric column as float64 with NaN for missing values"""
+        values = self.column(name)
+        if self.FIELDS[name][0] == 'float':
+            return values
+        return np.where(self.missing(name), np.nan, values.astype(np.float64))
+
+    def names(self, name):
+        """Vocabulary of a code column: names[code] is the value of that code"""
+        return self.categories.get(name, [])
+
+    def decode(self, name):
+        """A code column as an object array of its values (None when missing)"""
+        names = np.array(self.names(name) + [None], dtype=object)
+        return names[self.column(name)]
+
+    def value_counts(self, name):
+        """Segments per value of a code column, missing values under None"""
+        codes = self.column(name).astype(np.int64)
+        counts = np.bincount(codes + 1, minlength=len(self.names(name)) + 1)
+        result = {value: int(count) for value, count in zip(self.names(name), counts[1:]) if count}
+        if counts[0]:
+            result[None] = int(counts[0])
+        return result
+
+    def to_numpy(self, columns=None):
+        """The segments as a NumPy structured array, one record per segment"""
+        columns = columns or self.columns
+        records = np.empty(len(self), dtype=[(name, self.column(name).dtype) for name in columns])
+        for name in columns:
+            records[name] = self.column(name)
+        return records
+
+    def to_pandas(self, columns=None):
+        """The segments as a DataFrame, like the store's Arrow table would give
+
+        Code columns become Categoricals; integer columns with missing
+        values become float64 with NaN. Other columns are passed through
+        without copying.
+        """
+        import pandas as pd
+
+        data = {}
+        for name in columns or self.columns:
+            kind = self.FIELDS[name][0]
+            if kind in ('code', 'key'):
+                data[name] = pd.Categorical.from_codes(self.column(name), self.names(name))
+            elif kind != 'float' and self.missing(name).any():
+                data[name] = self.floats(name)
+            else:
+                data[name] = self.column(name)
+        return pd.DataFrame(data, copy=False)
+
+    def to_arrow(self, columns=None):
+        """A record batch in the store's schema
+
+        Code columns are dictionary arrays over the whole vocabulary, so
+        batches built against one shared vocabulary extend each other.
+        """
+        columns = columns or self.columns
+        arrays = []
+        for name in columns:
+            kind, arrow_type = self.FIELDS[name]
+            values = self.column(name)
+            mask = self.missing(name)
+            if kind == 'code':
+                indices = pa.array(values, arrow_type.index_type, mask=mask)
+                arrays.append(pa.DictionaryArray.from_arrays(indices, pa.array(self.names(name), pa.string())))
+            elif kind == 'key':
+                indices = pa.array(values, pa.int32(), mask=mask)
+                arrays.append(pa.DictionaryArray.from_arrays(indices, pa.array(self.names(name), pa.string()))
+                              .cast(arrow_type))
+            elif kind == 'float':
+                arrays.append(pa.array(values, arrow_type, from_pandas=True))
+            else:
+                arrays.append(pa.array(values, arrow_type, mask=mask if mask.any() else None))
+        return pa.record_batch(arrays, schema=self.schema(columns))
+
+    @classmethod
+    def from_arrow(cls, table):
+        """Segments from an Arrow table or record batch with (some of) the FIELDS"""
+        if isinstance(table, pa.RecordBatch):
+            table = pa.Table.from_batches([table])
+        columns = {}
+        categories = {}
+        for name in table.column_names:
+            kind = cls.FIELDS[name][0]
+            values = table.column(name)
+            if kind in ('code', 'key'):
+                if pa.types.is_dictionary(values.type):
+                    chunks = values.unify_dictionaries().chunks
+                    names = chunks[0].dictionary.to_pylist() if chunks else []
+                    indices = [chunk.indices for chunk in chunks]
+                else:
+                    encoded = pc.dictionary_encode(values.combine_chunks())
+                    names = encoded.dictionary.to_pylist()
+                    indices = [encoded.indices]
+                dtype = KINDS[kind][0]
+                columns[name] = (np.concatenate([_filled(part, kind) for part in indices]).astype(dtype, copy=False)
+                                 if indices else np.empty(0, dtype))
+                categories[name] = names
+            else:
+                columns[name] = _filled(values, kind) if values.num_chunks else np.empty(0, KINDS[kind][0])
+        return cls(categories, **columns)
+
+    @classmethod
+    def empty(cls, columns=None):
+        return cls({}, **{name: np.empty(0, KINDS[cls.FIELDS[name][0]][0]) for name in columns or cls.FIELDS})
+
+class Visits(SegmentArrays):
+    FIELDS = {
+        'start_time': ('time', pa.int64()),  # milliseconds since epoch, UTC
+        'end_time': ('time', pa.int64()),
+        'timezone_offset': ('int16', pa.int16()),  # minutes
+        'place_id': ('key', pa.string()),
+        'semantic_type': ('code', pa.dictionary(pa.int16(), pa.string())),
+        'probability': ('float', pa.float64()),
+        'hierarchy_level': ('int16', pa.int16()),
+        'lat': ('float', pa.float64()),
+        'lng': ('float', pa.float64())
+    }
+    __slots__ = tuple(FIELDS)
+
+    @classmethod
+    def from_records(cls, records, vocabularies=None):
+        """Visits from parsed visit dicts (see data_extraction.parse_segment)
+
+        vocabularies maps code columns to value -> code dicts shared across
+        calls; new values are appended to them.
+        """
+        vocabularies = {} if vocabularies is None else vocabularies
+        semantic_types = vocabularies.setdefault('semantic_type', {})
+        place_ids = {}
+        location, _ = parse_latlng_array([record.get('location') for record in records])
+        visits = cls(
+            {},
+            start_time=_filled(_to_epoch_ms([record.get('start_time') for record in records]), 'time'),
+            end_time=_filled(_to_epoch_ms([record.get('end_time') for record in records]), 'time'),
+            timezone_offset=_filled(pa.array([record.get('timezone_offset') for record in records], pa.int16()),
+                                    'int16'),
+            place_id=_intern([record.get('place_id') for record in records], place_ids, np.int32),
+            semantic_type=_intern([record.get('semantic_type') for record in records], semantic_types, np.int16),
+            probability=_filled(pa.array([record.get('probability') for record in records], pa.float64()), 'float'),
+            hierarchy_level=_filled(pa.array([record.get('hierarchy_level') for record in records], pa.int16()),
+                                    'int16'),
+            lat=np.ascontiguousarray(location[:, 0]),
+            lng=np.ascontiguousarray(location[:, 1])
+        )
+        visits.categories = {'place_id': list(place_ids), 'semantic_type': list(semantic_types)}
+        return visits
+
+class Activities(SegmentArrays):
+    FIELDS = {
+        'start_time': ('time', pa.int64()),
+        'end_time': ('time', pa.int64()),
+        'timezone_offset': ('int16', pa.int16()),
+        'type': ('code', pa.dictionary(pa.int16(), pa.string())),
+        'probability': ('float', pa.float64()),
+        'distance_meters': ('float', pa.float64()),
+        'start_lat': ('float', pa.float64()),
+        'start_lng': ('float', pa.float64()),
+        'end_lat': ('float', pa.float64()),
+        'end_lng': ('float', pa.float64())
+    }
+    __slots__ = tuple(FIELDS)
+
+    @classmethod
+    def from_records(cls, records, vocabularies=None):
+        """Activities from parsed activity dicts (see data_extraction.parse_segment)"""
+        vocabularies = {} if vocabularies is None else vocabularies
+        types = vocabularies.setdefault('type', {})
+        start, _ = parse_latlng_array([record.get('start_location') for record in records])
+        end, _ = parse_latlng_array([record.get('end_location') for record in records])
+        activities = cls(
+            {},
+            start_time=_filled(_to_epoch_ms([record.get('start_time') for record in records]), 'time'),
+            end_time=_filled(_to_epoch_ms([record.get('end_time') for record in records]), 'time'),
+            timezone_offset=_filled(pa.array([record.get('timezone_offset') for record in records], pa.int16()),
+                                    'int16'),
+            type=_intern([record.get('type') for record in records], types, np.int16),
+            probability=_filled(pa.array([record.get('probability') for record in records], pa.float64()), 'float'),
+            distance_meters=_filled(pa.array([record.get('distance_meters') for record in records], pa.float64()),
+                                    'float'),
+            start_lat=np.ascontiguousarray(start[:, 0]),
+            start_lng=np.ascontiguousarray(start[:, 1]),
+            end_lat=np.ascontiguousarray(end[:, 0]),
+            end_lng=np.ascontiguousarray(end[:, 1])
+        )
+        activities.categories = {'type': list(types)}
+        return activities
+
+# Table name in the store -> segment class
+SEGMENT_TYPES = {
+    'visits': Visits,
+    'activities': Activities
+}
@@ -0,0 +1,274 @@
+import os
+import numpy as np
+import pyarrow as pa
+from icecream import ic
+from timeline_store import STORE_DIR, load_segments, write_arrow
+
+# Clustered aggregates are precomputed for zoom levels 0..CLUSTER_MAX_ZOOM;
+# beyond that, tiles are cut from the raw segments
+CLUSTER_MAX_ZOOM = 12
+
+# Each tile is split into 2^CELL_BITS x 2^CELL_BITS clustering cells
+CELL_BITS = 3
+
+MAX_LATITUDE = 85.05112878
+
+VISIT_CLUSTERS_SCHEMA = pa.schema([
+    ('zoom', pa.int8()),
+    ('tile_x', pa.int32()),
+    ('tile_y', pa.int32()),
+    ('count', pa.int64()),
+    ('lat', pa.float64()),  # centroid
+    ('lng', pa.float64()),
+    ('dwell_hours', pa.float64())
+])
+
+ACTIVITY_FLOWS_SCHEMA = pa.schema([
+    ('zoom', pa.int8()),
+    ('start_tile_x', pa.int32()),
+    ('start_tile_y', pa.int32()),
+    ('end_tile_x', pa.int32()),
+    ('end_tile_y', pa.int32()),
+    ('count', pa.int64()),
+    ('start_lat', pa.float64()),  # mean endpoints
+    ('start_lng', pa.float64()),
+    ('end_lat', pa.float64()),
+    ('end_lng', pa.float64()),
+    ('distance_km', pa.float64())
+])
+
+def index_dir(store_dir=STORE_DIR):
+    return os.path.join(store_dir, 'tiles')
+
+def index_files(store_dir=STORE_DIR):
+    """Paths of the visit cluster and activity flow tables"""
+    return (os.path.join(index_dir(store_dir), 'visit_clusters.arrow'),
+            os.path.join(index_dir(store_dir), 'activity_flows.arrow'))
+
+def mercator_cells(lat, lng, level):
+    """Integer Web Mercator (slippy map) cell coordinates at a quadtree level"""
+    n = 1 << level
+    lat_rad = np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(lng) + 180.0) / 360.0 * n
+    y = (1.0 - np.arcsinh(np.tan(lat_rad)) / np.pi) / 2.0 * n
+    return (np.clip(x, 0, n - 1).astype(np.int64),
+            np.clip(y, 0, n - 1).astype(np.int64))
+
+def tile_bounds(zoom, x, y):
+    """(west, south, east, north) of a slippy map tile"""
+    n = 1 << zoom
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * y / n))))
+    south = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + 1) / n))))
+    return west, south, east, north
+
+def _group_sums(keys, columns):
+    """Unique keys and the per-key sums of each column"""
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return unique, {name: np.bincount(inverse, weights=values, minlength=len(unique))
+                    for name, values in columns.items()}
+
+def _pack(*coords):
+    """Pack up to four 16-bit cell coordinates into one int64 key"""
+    key = np.zeros(len(coords[0]), np.int64)
+    for coord in coords:
+        key = (key << 16) | coord
+    return key
+
+def _unpack(key, count):
+    coords = []
+    for _ in range(count):
+        coords.append(key & 0xFFFF)
+        key = key >> 16
+    return coords[::-1]
+
+def cluster_visits(lat, lng, dwell_hours):
+    """Quadtree-aggregate visits into per-zoom cluster rows
+
+    Points are bucketed once at the finest level; each coarser level is
+    built from the cells of the level below, so the cost is one sort of
+    the points plus shrinking sorts of the cells.
+    """
+    level = CLUSTER_MAX_ZOOM + CELL_BITS
+    cell_x, cell_y = mercator_cells(lat, lng, level)
+    keys, sums = _group_sums(_pack(cell_x, cell_y), {
+        'count': np.ones(len(lat)), 'lat': lat, 'lng': lng, 'dwell_hours': dwell_hours
+    })
+
+    columns = {name: [] for name in VISIT_CLUSTERS_SCHEMA.names}
+    for zoom in range(CLUSTER_MAX_ZOOM, -1, -1):
+        cell_x, cell_y = _unpack(keys, 2)
+        columns['zoom'].append(np.full(len(keys), zoom, np.int8))
+        columns['tile_x'].append(cell_x >> CELL_BITS)
+        columns['tile_y'].append(cell_y >> CELL_BITS)
+        columns['count'].append(sums['count'].astype(np.int64))
+        columns['lat'].append(sums['lat'] / sums['count'])
+        columns['lng'].append(sums['lng'] / sums['count'])
+        columns['dwell_hours'].append(sums['dwell_hours'])
+        # Merge 2x2 cells into their parent for the next zoom level
+        keys, sums = _group_sums(_pack(cell_x >> 1, cell_y >> 1), sums)
+
+    return _sorted_table(columns, VISIT_CLUSTERS_SCHEMA, ['zoom', 'tile_x', 'tile_y'])
+
+def aggregate_flows(start_lat, start_lng, end_lat, end_lng, distance_km):
+    """Aggregate activities into per-zoom flows between clustering cells
+
+    Activities whose endpoints fall in the same cell at a zoom level are
+    below that level's resolution and are left out of it.
+    """
+    level = CLUSTER_MAX_ZOOM + CELL_BITS
+    start_x, start_y = mercator_cells(start_lat, start_lng, level)
+    end_x, end_y = mercator_cells(end_lat, end_lng, level)
+    keys, sums = _group_sums(_pack(start_x, start_y, end_x, end_y), {
+        'count': np.ones(len(start_lat)), 'start_lat': start_lat, 'start_lng': start_lng,
+        'end_lat': end_lat, 'end_lng': end_lng, 'distance_km': distance_km
+    })
+
+    columns = {name: [] for name in ACTIVITY_FLOWS_SCHEMA.names}
+    for zoom in range(CLUSTER_MAX_ZOOM, -1, -1):
+        start_x, start_y, end_x, end_y = _unpack(keys, 4)
+        moving = (start_x != end_x) | (start_y != end_y)
+        columns['zoom'].append(np.full(int(moving.sum()), zoom, np.int8))
+        columns['start_tile_x'].append(start_x[moving] >> CELL_BITS)
+        columns['start_tile_y'].append(start_y[moving] >> CELL_BITS)
+        columns['end_tile_x'].append(end_x[moving] >> CELL_BITS)
+        columns['end_tile_y'].append(end_y[moving] >> CELL_BITS)
+        count = sums['count'][moving]
+        columns['count'].append(count.astype(np.int64))
+        for name in ('start_lat', 'start_lng', 'end_lat', 'end_lng'):
+            columns[name].append(sums[name][moving] / count)
+        columns['distance_km'].append(sums['distance_km'][moving])
+        keys, sums = _group_sums(_pack(start_x >> 1, start_y >> 1, end_x >> 1, end_y >> 1), sums)
+
+    return _sorted_table(columns, ACTIVITY_FLOWS_SCHEMA, ['zoom', 'start_tile_x', 'start_tile_y'])
+
+def _sorted_table(columns, schema, sort_keys):
+    table = pa.table({name: np.concatenate(parts) for name, parts in columns.items()}).cast(schema)
+    return table.sort_by([(key, 'ascending') for key in sort_keys])
+
+def build_spatial_index(store_dir=STORE_DIR):
+    """Precompute clustered visit and activity tiles from the store"""
+    v = load_segments('visits', ['start_time', 'end_time', 'lat', 'lng'], store_dir)
+    a = load_segments('activities', ['distance_meters', 'start_lat', 'start_lng', 'end_lat', 'end_lng'],
+                      store_dir)
+
+    located = ~np.isnan(v.lat) & ~np.isnan(v.lng)
+    dwell_hours = np.nan_to_num((v.floats('end_time') - v.floats('start_time')) / 3_600_000)
+    clusters = cluster_visits(v.lat[located], v.lng[located], dwell_hours[located])
+
+    routed = ~(np.isnan(a.start_lat) | np.isnan(a.start_lng) | np.isnan(a.end_lat) | np.isnan(a.end_lng))
+    flows = aggregate_flows(a.start_lat[routed], a.start_lng[routed], a.end_lat[routed], a.end_lng[routed],
+                            np.nan_to_num(a.distance_meters[routed]) / 1000)
+
+    os.makedirs(index_dir(store_dir), exist_ok=True)
+    clusters_file, flows_file = index_files(store_dir)
+    write_arrow(clusters_file, clusters)
+    write_arrow(flows_file, flows)
+    ic(f"Spatial index built: {clusters.num_rows} visit clusters, {flows.num_rows} activity flows")
+
+def _by_longitude(lat, lng):
+    """Rows with coordinates sorted by longitude, and their sorted longitudes"""
+    located = np.flatnonzero(~np.isnan(lat) & ~np.isnan(lng))
+    order = located[np.argsort(lng[located], kind='stable')]
+    return order, lng[order]
+
+def _tile_keys(zoom, x, y):
+    return (np.asarray(zoom, np.int64) << 48) | (np.asarray(x, np.int64) << 24) | np.asarray(y, np.int64)
+
+class SpatialIndex:
+    """Tile lookups over the precomputed clusters and the raw segments"""
+
+    def __init__(self, store_dir=STORE_DIR):
+        def load(path):
+            table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+            return {name: table.column(name).to_numpy() for name in table.column_names}
+
+        clusters_file, flows_file = index_files(store_dir)
+        self.clusters = load(clusters_file)
+        self.flows = load(flows_file)
+        self.cluster_keys = _tile_keys(self.clusters['zoom'], self.clusters['tile_x'], self.clusters['tile_y'])
+        self.flow_start_keys = _tile_keys(self.flows['zoom'], self.flows['start_tile_x'], self.flows['start_tile_y'])
+        end_keys = _tile_keys(self.flows['zoom'], self.flows['end_tile_x'], self.flows['end_tile_y'])
+        self.flow_end_order = np.argsort(end_keys, kind='stable')
+        self.flow_end_keys = end_keys[self.flow_end_order]
+
+        self.visits = load_segments('visits', ['lat', 'lng', 'start_time', 'end_time'], store_dir)
+        self.activities = load_segments('activities', ['start_lat', 'start_lng', 'end_lat', 'end_lng',
+                                                       'distance_meters'], store_dir)
+        # Raw tiles only look at the rows within their range of longitudes
+        self.visits_by_lng = _by_longitude(self.visits.lat, self.visits.lng)
+        self.starts_by_lng = _by_longitude(self.activities.start_lat, self.activities.start_lng)
+        self.ends_by_lng = _by_longitude(self.activities.end_lat, self.activities.end_lng)
+
+    def _rows(self, sorted_keys, key):
+        return np.arange(*np.searchsorted(sorted_keys, [key, key + 1]))
+
+    def query_tile(self, zoom, x, y):
+        """Visit clusters and activity flows to draw for one map tile
+
+        Flows touching the tile are returned whether it holds their start or
+        their end, with a flow id so clients can draw each flow once.
+        """
+        if zoom > CLUSTER_MAX_ZOOM:
+            return self._raw_tile(zoom, x, y)
+
+        key = int(_tile_keys(zoom, x, y))
+        clusters = self._rows(self.cluster_keys, key)
+        starting = self._rows(self.flow_start_keys, key)
+        ending = self.flow_end_order[self._rows(self.flow_end_keys, key)]
+        flows = np.union1d(starting, ending)
+        return {
+            'zoom': zoom,
+            'clustered': True,
+            'visits': {
+                'lat': self.clusters['lat'][clusters].round(6).tolist(),
+                'lng': self.clusters['lng'][clusters].round(6).tolist(),
+                'count': self.clusters['count'][clusters].tolist(),
+                'dwell_hours': self.clusters['dwell_hours'][clusters].round(2).tolist()
+            },
+            'activities': {
+                'id': flows.tolist(),
+                'start': np.column_stack([self.flows['start_lat'][flows],
+                                          self.flows['start_lng'][flows]]).round(6).tolist(),
+                'end': np.column_stack([self.flows['end_lat'][flows],
+                                        self.flows['end_lng'][flows]]).round(6).tolist(),
+                'count': self.flows['count'][flows].tolist(),
+                'distance_km': self.flows['distance_km'][flows].round(3).tolist()
+            }
+        }
+
+    def _raw_tile(self, zoom, x, y):
+        """Unclustered visits and activities inside a high-zoom tile"""
+        west, south, east, north = tile_bounds(zoom, x, y)
+
+        def inside(by_lng, lat):
+            order, lngs = by_lng
+            rows = order[np.searchsorted(lngs, west):np.searchsorted(lngs, east)]
+            return np.sort(rows[(lat[rows] >= south) & (lat[rows] < north)])
+
+        v = self.visits[inside(self.visits_by_lng, self.visits.lat)]
+        activity_rows = np.union1d(inside(self.starts_by_lng, self.activities.start_lat),
+                                   inside(self.ends_by_lng, self.activities.end_lat))
+        a = self.activities[activity_rows]
+        return {
+            'zoom': zoom,
+            'clustered': False,
+            'visits': {
+                'lat': v.lat.tolist(),
+                'lng': v.lng.tolist(),
+                'count': [1] * len(v),
+                'dwell_hours': np.round(np.nan_to_num((v.floats('end_time') - v.floats('start_time')) / 3_600_000),
+                                        2).tolist()
+            },
+            'activities': {
+                'id': activity_rows.tolist(),
+                'start': np.column_stack([a.start_lat, a.start_lng]).tolist(),
+                'end': np.column_stack([a.end_lat, a.end_lng]).tolist(),
+                'count': [1] * len(a),
+                'distance_km': np.round(np.nan_to_num(a.distance_meters) / 1000, 3).tolist()
+            }
+        }
+
+if __name__ == "__main__":
+    build_spatial_index()
@@ -1,108 +1,261 @@
 import json
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from datetime import datetime
+import numpy as np
+from datetime import datetime, timezone
 from icecream import ic
+from timeline_store import load_segments
+from movement_metrics import movement_metrics, summarize_movements
+from instrumentation import stage
+
+VISIT_COLUMNS = ['start_time', 'end_time', 'timezone_offset', 'semantic_type']
+ACTIVITY_COLUMNS = ['start_time', 'end_time', 'timezone_offset', 'type', 'distance_meters',
+                    'start_lat', 'start_lng', 'end_lat', 'end_lng']
+
+DAY_ORDER = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+MS_PER_MINUTE = 60_000
+MS_PER_HOUR = 3_600_000
+MS_PER_DAY = 86_400_000
 
 def load_data():
-    """Load the extracted timeline data"""
-    with open('data/extracted_timeline.json', 'r') as f:
-        return json.load(f)
-
-def analyze_temporal_patterns():
-    """Analyze temporal patterns in visits and activities"""
-    data = load_data()
-    
-    # Convert visits to DataFrame with proper timezone handling
-    visits_df = pd.DataFrame(data['visits'])
-    visits_df['start_time'] = pd.to_datetime(visits_df['start_time'], utc=True)
-    visits_df['end_time'] = pd.to_datetime(visits_df['end_time'], utc=True)
-    
-    # Convert to local time using timezone offset
-    visits_df['timezone_offset'] = pd.to_numeric(visits_df['timezone_offset'], errors='coerce')
-    visits_df['start_time_local'] = visits_df['start_time'] + pd.to_timedelta(visits_df['timezone_offset'], unit='m')
-    visits_df['end_time_local'] = visits_df['end_time'] + pd.to_timedelta(visits_df['timezone_offset'], unit='m')
-    visits_df['duration_hours'] = (visits_df['end_time'] - visits_df['start_time']).dt.total_seconds() / 3600
-    
-    # Convert activities to DataFrame
-    activities_df = pd.DataFrame(data['activities'])
-    activities_df['start_time'] = pd.to_datetime(activities_df['start_time'], utc=True)
-    activities_df['end_time'] = pd.to_datetime(activities_df['end_time'], utc=True)
-    
-    # Convert activities to local time
-    activities_df['timezone_offset'] = pd.to_numeric(activities_df['timezone_offset'], errors='coerce')
-    activities_df['start_time_local'] = activities_df['start_time'] + pd.to_timedelta(activities_df['timezone_offset'], unit='m')
-    activities_df['end_time_local'] = activities_df['end_time'] + pd.to_timedelta(activities_df['timezone_offset'], unit='m')
-    activities_df['duration_minutes'] = (activities_df['end_time'] - activities_df['start_time']).dt.total_seconds() / 60
-    
-    # Create visualizations
-    fig = plt.figure(figsize=(20, 15))
-    
-    # 1. Visit durations by semantic type
-    plt.subplot(3, 2, 1)
-    sns.boxplot(data=visits_df, x='semantic_type', y='duration_hours')
-    plt.xticks(rotation=45)
-    plt.title('Visit Durations by Type')
-    
-    # 2. Activity durations by type
-    plt.subplot(3, 2, 2)
-    sns.boxplot(data=activities_df, x='type', y='duration_minutes')
-    plt.xticks(rotation=45)
-    plt.title('Activity Durations by Type')
-    
-    # 3. Visits by hour of day (local time)
-    plt.subplot(3, 2, 3)
-    visits_df['hour'] = visits_df['start_time_local'].dt.hour
-    sns.histplot(data=visits_df, x='hour', bins=24)
-    plt.title('Visits by Hour of Day (Local Time)')
-    
-    # 4. Activities by hour of day (local time)
-    plt.subplot(3, 2, 4)
-    activities_df['hour'] = activities_df['start_time_local'].dt.hour
-    sns.histplot(data=activities_df, x='hour', bins=24)
-    plt.title('Activities by Hour of Day (Local Time)')
-    
-    # 5. Visit counts by day of week
-    plt.subplot(3, 2, 5)
-    visits_df['day'] = visits_df['start_time_local'].dt.day_name()
-    day_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    sns.countplot(data=visits_df, x='day', order=day_order)
-    plt.xticks(rotation=45)
-    plt.title('Visits by Day of Week')
-    
-    # 6. Activity types distribution
-    plt.subplot(3, 2, 6)
-    sns.countplot(data=activities_df, x='type')
-    plt.xticks(rotation=45)
-    plt.title('Activity Types Distribution')
-    
-    plt.tight_layout()
-    plt.savefig('output/temporal_patterns.png')
-    ic("Saved temporal analysis plots to 'output/temporal_patterns.png'")
-    
-    # Generate statistics
-    stats = {
-        'visits': {
-            'total_count': len(visits_df),
-            'average_duration_hours': float(visits_df['duration_hours'].mean()),
-            'most_common_type': visits_df['semantic_type'].mode().iloc[0],
-            'date_range': {
-                'start': visits_df['start_time_local'].min().isoformat(),
-                'end': visits_df['end_time_local'].max().isoformat()
+    """Load the visit and activity columns needed from the timeline store"""
+    with stage('temporal.load') as metrics:
+        visits, activities = load_segments('visits', VISIT_COLUMNS), load_segments('activities', ACTIVITY_COLUMNS)
+        metrics.count('visits', len(visits))
+        metrics.count('activities', len(activities))
+    return visits, activities
+
+def _time_arrays(segments, type_column):
+    """UTC/local start times, durations and type codes of visits or activities"""
+    start = segments.floats('start_time')
+    end = segments.floats('end_time')
+    # Segments without a timezone offset are bucketed in UTC
+    offset = np.nan_to_num(segments.floats('timezone_offset'))
+    codes, names = segments.column(type_column), segments.names(type_column)
+    valid = ~np.isnan(start)
+    local_start = start + offset * MS_PER_MINUTE
+    local_end = end + offset * MS_PER_MINUTE
+    return {
+        'valid': valid,
+        'local_start': local_start,
+        'local_end': local_end,
+        'duration_ms': end - start,
+        'codes': codes,
+        'names': names
+    }
+
+def _local_groups(local_start, valid):
+    """Hour-of-day, weekday (Monday=0) and month indexes of local start times"""
+    local_ms = np.where(valid, local_start, 0).astype(np.int64)
+    days = np.floor_divide(local_ms, MS_PER_DAY)
+    hours = np.floor_divide(local_ms, MS_PER_HOUR) % 24
+    # 1970-01-01 was a Thursday
+    weekdays = (days + 3) % 7
+    months = local_ms.astype('datetime64[ms]').astype('datetime64[M]')
+    return hours, weekdays, months
+
+def _grouped(index, size, valid, measures):
+    """Counts and sums of each measure per group index"""
+    index = index[valid]
+    result = {'count': np.bincount(index, minlength=size).tolist()}
+    for name, values in measures.items():
+        result[name] = np.round(np.bincount(index, weights=np.nan_to_num(values[valid]), minlength=size), 3).tolist()
+    return result
+
+def _group_stats(arrays, measures):
+    """Per-hour, per-weekday and per-month aggregates of the given measures"""
+    valid = arrays['valid']
+    hours, weekdays, months = _local_groups(arrays['local_start'], valid)
+    month_labels, month_index = np.unique(months[valid], return_inverse=True)
+    month_index_full = np.zeros(len(valid), np.int64)
+    month_index_full[valid] = month_index
+    return {
+        'by_hour': _grouped(hours, 24, valid, measures),
+        'by_weekday': {'labels': DAY_ORDER, **_grouped(weekdays, 7, valid, measures)},
+        'by_month': {'labels': [str(label) for label in month_labels],
+                     **_grouped(month_index_full, len(month_labels), valid, measures)}
+    }
+
+def _by_type(arrays, measures):
+    """Counts and measure totals per semantic/activity type"""
+    codes = arrays['codes']
+    size = len(arrays['names'])
+    present = codes >= 0
+    counts = np.bincount(codes[present], minlength=size)
+    totals = {name: np.bincount(codes[present], weights=np.nan_to_num(values[present]), minlength=size)
+              for name, values in measures.items()}
+    return {
+        type_name: {'count': int(counts[code]),
+                    **{name: round(float(total[code]), 3) for name, total in totals.items()}}
+        for code, type_name in enumerate(arrays['names']) if counts[code]
+    }
+
+def _most_common(arrays):
+    codes = arrays['codes']
+    codes = codes[codes >= 0]
+    if not len(codes):
+        return None
+    return arrays['names'][int(np.bincount(codes).argmax())]
+
+def _iso_local(local_ms):
+    return datetime.fromtimestamp(local_ms / 1000, timezone.utc).isoformat()
+
+def _nanmean(values):
+    return float(np.nanmean(values)) if np.any(~np.isnan(values)) else None
+
+def compute_temporal_statistics(visits=None, activities=None):
+    """Temporal statistics of visits and activities, without any plotting
+
+    Takes Visits and Activities with VISIT_COLUMNS / ACTIVITY_COLUMNS (loaded
+    from the store when omitted). Everything is computed with NumPy on the raw int64
+    timestamps; local time uses each segment's timezone offset.
+    """
+    if visits is None or activities is None:
+        loaded_visits, loaded_activities = load_data()
+        visits = loaded_visits if visits is None else visits
+        activities = loaded_activities if activities is None else activities
+
+    with stage('temporal.compute') as metrics:
+        metrics.count('visits', len(visits))
+        metrics.count('activities', len(activities))
+        v = _time_arrays(visits, 'semantic_type')
+        visit_hours = v['duration_ms'] / MS_PER_HOUR
+        visit_measures = {'total_hours': visit_hours}
+
+        a = _time_arrays(activities, 'type')
+        activity_minutes = a['duration_ms'] / MS_PER_MINUTE
+        movement = movement_metrics(activities)
+        distance_km = movement['distance_m'] / 1000
+        activity_measures = {'total_minutes': activity_minutes, 'distance_km': distance_km,
+                             'great_circle_km': movement['great_circle_m'] / 1000}
+
+        visit_start = v['local_start'][v['valid']]
+        visit_end = v['local_end'][v['valid'] & ~np.isnan(v['local_end'])]
+
+        return {
+            'visits': {
+                'total_count': len(visits),
+                'average_duration_hours': _nanmean(visit_hours),
+                'most_common_type': _most_common(v),
+                'date_range': {
+                    'start': _iso_local(visit_start.min()) if len(visit_start) else None,
+                    'end': _iso_local(visit_end.max()) if len(visit_end) else None
+                },
+                'by_type': _by_type(v, visit_measures),
+                **_group_stats(v, visit_measures)
+            },
+            'activities': {
+                'total_count': len(activities),
+                'average_duration_minutes': _nanmean(activity_minutes),
+                'most_common_type': _most_common(a),
+                'total_distance_km': float(np.nansum(distance_km)),
+                'movement': summarize_movements(movement),
+                'by_type': _by_type(a, activity_measures),
+                **_group_stats(a, activity_measures)
             }
-        },
-        'activities': {
-            'total_count': len(activities_df),
-            'average_duration_minutes': float(activities_df['duration_minutes'].mean()),
-            'most_common_type': activities_df['type'].mode().iloc[0],
-            'total_distance_km': float(activities_df['distance_meters'].sum() / 1000)
         }
-    }
-    
-    with open('output/temporal_statistics.json', 'w') as f:
-        json.dump(stats, f, indent=2)
-    ic("Saved temporal statistics to 'output/temporal_statistics.json'")
+
+def write_temporal_statistics(stats=None, output_file='output/temporal_statistics.json'):
+    """Compute (if needed) and save the temporal statistics"""
+    stats = compute_temporal_statistics() if stats is None else stats
+    with stage('temporal.write') as metrics:
+        with open(output_file, 'w') as f:
+            json.dump(stats, f, indent=2)
+        metrics.wrote_file(output_file)
+    ic(f"Saved temporal statistics to '{output_file}'")
+    return stats
+
+def render_temporal_patterns(visits=None, activities=None, output_file='output/temporal_patterns.png'):
+    """Plot the temporal pattern figure; the only part that needs matplotlib"""
+    import pandas as pd
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    if visits is None or activities is None:
+        visits, activities = load_data()
+    with stage('temporal.to_pandas') as metrics:
+        visits_df = visits.to_pandas()
+        activities_df = activities.to_pandas()
+
+        # Convert visit timestamps (UTC milliseconds) to datetimes
+        visits_df['start_time'] = pd.to_datetime(visits_df['start_time'], unit='ms', utc=True)
+        visits_df['end_time'] = pd.to_datetime(visits_df['end_time'], unit='ms', utc=True)
+
+        # Convert to local time using timezone offset
+        visits_df['timezone_offset'] = pd.to_numeric(visits_df['timezone_offset'], errors='coerce')
+        visits_df['start_time_local'] = visits_df['start_time'] + pd.to_timedelta(visits_df['timezone_offset'], unit='m')
+        visits_df['duration_hours'] = (visits_df['end_time'] - visits_df['start_time']).dt.total_seconds() / 3600
+
+        # Convert activity timestamps
+        activities_df['start_time'] = pd.to_datetime(activities_df['start_time'], unit='ms', utc=True)
+        activities_df['end_time'] = pd.to_datetime(activities_df['end_time'], unit='ms', utc=True)
+
+        # Convert activities to local time
+        activities_df['timezone_offset'] = pd.to_numeric(activities_df['timezone_offset'], errors='coerce')
+        activities_df['start_time_local'] = activities_df['start_time'] + pd.to_timedelta(activities_df['timezone_offset'], unit='m')
+        activities_df['duration_minutes'] = (activities_df['end_time'] - activities_df['start_time']).dt.total_seconds() / 60
+        metrics.count('visits', len(visits_df))
+        metrics.count('activities', len(activities_df))
+
+    with stage('temporal.plot') as metrics:
+        # Create visualizations
+        fig = plt.figure(figsize=(20, 15))
+
+        # 1. Visit durations by semantic type
+        plt.subplot(3, 2, 1)
+        sns.boxplot(data=visits_df, x='semantic_type', y='duration_hours')
+        plt.xticks(rotation=45)
+        plt.title('Visit Durations by Type')
+
+        # 2. Activity durations by type
+        plt.subplot(3, 2, 2)
+        sns.boxplot(data=activities_df, x='type', y='duration_minutes')
+        plt.xticks(rotation=45)
+        plt.title('Activity Durations by Type')
+
+        # 3. Visits by hour of day (local time)
+        plt.subplot(3, 2, 3)
+        visits_df['hour'] = visits_df['start_time_local'].dt.hour
+        sns.histplot(data=visits_df, x='hour', bins=24)
+        plt.title('Visits by Hour of Day (Local Time)')
+
+        # 4. Activities by hour of day (local time)
+        plt.subplot(3, 2, 4)
+        activities_df['hour'] = activities_df['start_time_local'].dt.hour
+        sns.histplot(data=activities_df, x='hour', bins=24)
+        plt.title('Activities by Hour of Day (Local Time)')
+
+        # 5. Visit counts by day of week
+        plt.subplot(3, 2, 5)
+        visits_df['day'] = visits_df['start_time_local'].dt.day_name()
+        sns.countplot(data=visits_df, x='day', order=DAY_ORDER)
+        plt.xticks(rotation=45)
+        plt.title('Visits by Day of Week')
+
+        # 6. Activity types distribution
+        plt.subplot(3, 2, 6)
+        sns.countplot(data=activities_df, x='type')
+        plt.xticks(rotation=45)
+        plt.title('Activity Types Distribution')
+
+        plt.tight_layout()
+        plt.savefig(output_file)
+        plt.close(fig)
+        metrics.wrote_file(output_file)
+
+    ic(f"Saved temporal analysis plots to '{output_file}'")
+
+def analyze_temporal_patterns(render=True):
+    """Analyze temporal patterns in visits and activities
+
+    Statistics are always written; the figure only when render is True.
+    """
+    visits, activities = load_data()
+    stats = write_temporal_statistics(compute_temporal_statistics(visits, activities))
+    if render:
+        render_temporal_patterns(visits, activities)
+    return stats
 
 if __name__ == "__main__":
-    analyze_temporal_patterns() 
\ No newline at end of file
+    analyze_temporal_patterns()
@@ -0,0 +1,292 @@
+import collections
+import glob
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from segments import SEGMENT_TYPES, Visits, Activities
+
+# Typed columnar copy of the extracted timeline: one directory per table,
+# holding one Arrow IPC file per calendar month (UTC) of segment start times
+STORE_DIR = 'data/timeline_store'
+
+# Partition for rows without a start time
+UNDATED = 'undated'
+
+MS_PER_DAY = 86_400_000
+
+# store_version results per store, reused while the table directories are
+# unchanged. Directories modified this recently are not trusted to have a
+# distinct mtime from their next change, so their version is recomputed.
+_versions = {}
+RACY_SECONDS = 2
+
+# The store holds exactly the columns of the shared segment model
+VISITS_SCHEMA = Visits.schema()
+ACTIVITIES_SCHEMA = Activities.schema()
+
+SCHEMAS = {
+    'visits': VISITS_SCHEMA,
+    'activities': ACTIVITIES_SCHEMA
+}
+
+def table_dir(name, store_dir=STORE_DIR):
+    """Directory holding the monthly partition files of one table"""
+    return os.path.join(store_dir, name)
+
+def partition_path(name, partition, store_dir=STORE_DIR):
+    """Path of the Arrow file holding one monthly partition of a table"""
+    return os.path.join(table_dir(name, store_dir), f'{partition}.arrow')
+
+def table_paths(name, store_dir=STORE_DIR):
+    """Partition files of one table, in chronological order"""
+    return sorted(glob.glob(os.path.join(table_dir(name, store_dir), '*.arrow')))
+
+def partition_keys(start_times):
+    """Monthly partition key ('YYYY-MM') of each UTC millisecond start time"""
+    start_times = pc.fill_null(start_times, np.iinfo(np.int64).min).to_numpy()
+    missing = start_times == np.iinfo(np.int64).min
+    keys = np.datetime_as_string(start_times.astype('datetime64[ms]').astype('datetime64[M]'))
+    return np.where(missing, UNDATED, keys)
+
+def day_numbers(start_times):
+    """UTC day number (days since the epoch) of each millisecond start time"""
+    return pc.floor(pc.divide(pc.cast(start_times, pa.float64()), MS_PER_DAY)).cast(pa.int64())
+
+def visits_to_batch(visits, vocabularies=None):
+    """Build a visits record batch from extracted visit dicts"""
+    return Visits.from_records(visits, vocabularies).to_arrow()
+
+def activities_to_batch(activities, vocabularies=None):
+    """Build an activities record batch from extracted activity dicts"""
+    return Activities.from_records(activities, vocabularies).to_arrow()
+
+BATCH_BUILDERS = {
+    'visits': visits_to_batch,
+    'activities': activities_to_batch
+}
+
+def write_arrow(path, table):
+    """Atomically write a table to one Arrow IPC file, as a single record batch
+
+    The file is written next to path and renamed over it, so readers
+    (including memory maps of the previous file) never see a partial one.
+    """
+    table = table.unify_dictionaries().combine_chunks()
+    with pa.ipc.new_file(path + '.tmp', table.schema) as writer:
+        writer.write_table(table)
+    os.replace(path + '.tmp', path)
+
+def _split_by_partition(batch):
+    """Yield (partition, sub-batch) pairs of a record batch"""
+    keys = partition_keys(batch.column('start_time'))
+    for partition in np.unique(keys):
+        yield str(partition), batch.filter(pa.array(keys == partition))
+
+class StoreWriter:
+    """Incrementally write visit and activity records into the store
+
+    Records are buffered per table and flushed as one record batch every
+    chunk_size records, routed to the file of their monthly partition. The
+    new store is built in a temporary directory and only replaces the
+    previous one on a clean close.
+
+    Set manifest before closing to save it with the new store (see
+    extract_incremental); otherwise the previous manifest, which no longer
+    applies, is removed.
+    """
+
+    def __init__(self, store_dir=STORE_DIR, chunk_size=10000):
+        os.makedirs(store_dir, exist_ok=True)
+        self.store_dir = store_dir
+        self.build_dir = store_dir.rstrip(os.sep) + '.tmp'
+        shutil.rmtree(self.build_dir, ignore_errors=True)
+        for name in SCHEMAS:
+            os.makedirs(table_dir(name, self.build_dir))
+        self.chunk_size = chunk_size
+        self.buffers = {name: [] for name in SCHEMAS}
+        self.vocabularies = {name: {} for name in SCHEMAS}
+        self.writers = {name: {} for name in SCHEMAS}
+        self.manifest = None
+
+    def _writer(self, name, partition):
+        writers = self.writers[name]
+        if partition not in writers:
+            options = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+            writers[partition] = pa.ipc.new_file(partition_path(name, partition, self.build_dir),
+                                                 SCHEMAS[name], options=options)
+        return writers[partition]
+
+    def add(self, name, record):
+        buffer = self.buffers[name]
+        buffer.append(record)
+        if len(buffer) >= self.chunk_size:
+            self.flush(name)
+
+    def flush(self, name):
+        buffer = self.buffers[name]
+        if buffer:
+            self.add_batch(name, BATCH_BUILDERS[name](buffer, self.vocabularies[name]))
+            buffer.clear()
+
+    def add_batch(self, name, batch):
+        """Write an already built record batch, routed to its partitions
+
+        Batches added to one table must share their dictionaries (or extend
+        them), as with batches built from the writer's own vocabularies.
+        """
+        for partition, part in _split_by_partition(batch):
+            self._writer(name, partition).write_batch(part)
+
+    def close(self, commit=True):
+        for name, writers in self.writers.items():
+            if commit:
+                self.flush(name)
+            for writer in writers.values():
+                writer.close()
+        if not commit:
+            shutil.rmtree(self.build_dir)
+            return
+        # Swap the freshly built store in, along with its own manifest
+        for name in SCHEMAS:
+            shutil.rmtree(table_dir(name, self.store_dir), ignore_errors=True)
+            os.replace(table_dir(name, self.build_dir), table_dir(name, self.store_dir))
+        shutil.rmtree(self.build_dir)
+        if self.manifest is not None:
+            save_manifest(self.manifest, self.store_dir)
+        elif os.path.exists(manifest_path(self.store_dir)):
+            os.remove(manifest_path(self.store_dir))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(commit=exc_type is None)
+
+def write_store(visits, activities, store_dir=STORE_DIR, manifest=None):
+    """Write complete lists of visit and activity records to the store"""
+    with StoreWriter(store_dir, chunk_size=max(len(visits), len(activities), 1)) as writer:
+        writer.manifest = manifest
+        for visit in visits:
+            writer.add('visits', visit)
+        for activity in activities:
+            writer.add('activities', activity)
+
+def write_tables(tables, store_dir=STORE_DIR, manifest=None):
+    """Replace the store with complete visits and activities tables"""
+    with StoreWriter(store_dir) as writer:
+        writer.manifest = manifest
+        for name, table in tables.items():
+            table = table.unify_dictionaries().combine_chunks()
+            for batch in table.to_batches():
+                writer.add_batch(name, batch)
+
+def replace_days(name, records, days, store_dir=STORE_DIR):
+    """Replace every row of the given UTC days with freshly extracted records
+
+    days holds ISO dates (or UNDATED); their rows are dropped from the
+    partitions they fall in and the new records (a list, or a table read
+    from another store) are merged in start-time order. Only the monthly
+    partitions touched by those days are rewritten.
+    """
+    os.makedirs(table_dir(name, store_dir), exist_ok=True)
+    if isinstance(records, pa.Table):
+        batches = records.unify_dictionaries().combine_chunks().to_batches()
+    else:
+        batches = [BATCH_BUILDERS[name](records)] if records else []
+    new_parts = collections.defaultdict(list)
+    for batch in batches:
+        for partition, part in _split_by_partition(batch):
+            new_parts[partition].append(part)
+
+    partitions = {UNDATED if day == UNDATED else day[:7] for day in days} | set(new_parts)
+    day_set = pa.array([np.datetime64(day, 'D').astype(np.int64) for day in days if day != UNDATED], pa.int64())
+    drop_undated = UNDATED in days
+
+    for partition in sorted(partitions):
+        path = partition_path(name, partition, store_dir)
+        tables = []
+        if os.path.exists(path):
+            existing = pa.ipc.open_file(pa.memory_map(path)).read_all()
+            start_times = existing.column('start_time')
+            stale = pc.is_in(day_numbers(start_times), value_set=day_set)
+            if drop_undated:
+                # is_in never matches nulls against a null-free value set
+                stale = pc.or_(stale, pc.is_null(start_times))
+            tables.append(existing.filter(pc.invert(stale)))
+        if partition in new_parts:
+            tables.append(pa.Table.from_batches(new_parts[partition]))
+
+        merged = pa.concat_tables(tables) if tables else None
+        if merged is None or merged.num_rows == 0:
+            if os.path.exists(path):
+                os.remove(path)
+            continue
+        write_arrow(path, merged.sort_by('start_time'))
+
+def manifest_path(store_dir=STORE_DIR):
+    return os.path.join(store_dir, 'manifest.json')
+
+def load_manifest(store_dir=STORE_DIR):
+    """Load the incremental-extraction manifest, or an empty one"""
+    if not os.path.exists(manifest_path(store_dir)):
+        return {'watermark': None, 'partitions': {}}
+    with open(manifest_path(store_dir), 'r') as f:
+        return json.load(f)
+
+def save_manifest(manifest, store_dir=STORE_DIR):
+    path = manifest_path(store_dir)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+def _directory_stat(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+def store_version(store_dir=STORE_DIR):
+    """Cheap fingerprint of the store contents, from partition file stats
+
+    Partitions are only ever renamed into their table directory (or the
+    whole directory replaced), which changes the directory's mtime, so the
+    fingerprint is reused while the table directories are unchanged and a
+    repeated call costs one stat per table.
+    """
+    directories = tuple(_directory_stat(table_dir(name, store_dir)) for name in SCHEMAS)
+    cached = _versions.get(store_dir)
+    if cached is not None and cached[0] == directories:
+        return cached[1]
+    digest = hashlib.sha1()
+    for name in SCHEMAS:
+        for path in table_paths(name, store_dir):
+            stat = os.stat(path)
+            digest.update(f'{path}:{stat.st_mtime_ns}:{stat.st_size}'.encode())
+    version = digest.hexdigest()
+    newest = max((directory[1] for directory in directories if directory), default=0)
+    if time.time_ns() - newest > RACY_SECONDS * 1_000_000_000:
+        _versions[store_dir] = (directories, version)
+    return version
+
+def read_table(name, columns=None, store_dir=STORE_DIR):
+    """Memory-map one table of the store, keeping only the requested columns"""
+    schema = SCHEMAS[name]
+    tables = [pa.ipc.open_file(pa.memory_map(path)).read_all() for path in table_paths(name, store_dir)]
+    table = pa.concat_tables(tables) if tables else schema.empty_table()
+    if columns is not None:
+        table = table.select(columns)
+    return table
+
+def load_segments(name, columns=None, store_dir=STORE_DIR):
+    """Load one table of the store as a Visits or Activities segment model"""
+    return SEGMENT_TYPES[name].from_arrow(read_table(name, columns, store_dir))
+
+def load_frame(name, columns=None, store_dir=STORE_DIR):
+    """Load one table of the store as a pandas DataFrame"""
+    return read_table(name, columns, store_dir).to_pandas()
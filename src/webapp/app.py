@@ -1,116 +1,733 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, Request, Response, abort, g, render_template, request, jsonify, send_file
+from werkzeug.security import safe_join
+import gzip
+import mimetypes
 import os
-import sys
 import shutil
-from bs4 import BeautifulSoup
-import folium
-import re
-import traceback
+import sys
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from datetime import datetime, timezone
+import numpy as np
 
 # Add parent directory to path to access existing modules
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
-from data_extraction import extract_timeline_data
-from temporal_analysis import analyze_temporal_patterns
-from geoanalysis import analyze_locations
+import artifacts
+import pipeline
+import jobs
+import instrumentation
+from timeline_store import store_version
+from place_clustering import EPS_METERS, MIN_VISITS, frequent_places
+from segment_index import KEY_COLUMNS, parse_daily_window
+
+class UploadRequest(Request):
+    """Request that writes Timeline uploads straight into a job directory
+
+    Werkzeug otherwise spools multipart files to an anonymous temporary
+    file; here each file part is streamed into its own job's upload path
+    as the body is parsed, so it never has to be copied afterwards.
+    """
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint != 'process_timeline':
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        job_id, path = jobs.create_job()
+        stream = open(path, 'wb+')
+        self.upload_jobs = getattr(self, 'upload_jobs', []) + [(job_id, stream)]
+        return stream
+
+    def _load_form_data(self):
+        try:
+            super()._load_form_data()
+        except Exception:
+            # e.g. too many parts or a client that disconnected mid-upload
+            for job_id, stream in getattr(self, 'upload_jobs', []):
+                stream.close()
+                jobs.discard_job(job_id)
+            self.upload_jobs = []
+            raise
+
+# Raw (non-multipart) uploads are copied to disk in blocks of this size
+UPLOAD_BLOCK_SIZE = 1 << 20
 
 app = Flask(__name__)
+app.request_class = UploadRequest
+# Set by run_production: stale outputs are rebuilt without holding up requests
+app.config['REFRESH_IN_BACKGROUND'] = False
+
+# Coordinates are sent as integers in units of 10^-COORD_PRECISION degrees
+COORD_PRECISION = 5
+
+_segment_cache = {'version': None, 'indexes': {}}
+_tile_cache = {'version': None, 'index': None}
+_route_cache = {'version': None, 'index': None}
+# Table name -> (version, cube)
+_rollup_cache = {}
+# Held while looking up or building any of the indexes above, so threads
+# wanting the same cold index wait for one build instead of each doing it
+_index_lock = threading.Lock()
+
+# Rendered pages and API responses kept in memory (see RenderedCache)
+PAGE_CACHE_SIZE = 32
+RESPONSE_CACHE_SIZE = 256
+RESPONSE_CACHE_BYTES = 64 << 20
+
+# Dynamic JSON, HTML and text responses at least this large are gzipped
+# for clients that accept it; pipeline outputs are compressed ahead of time
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = 6
+COMPRESSED_MIMETYPES = {'application/json', 'text/html', 'text/plain'}
+
+# Worker threads of the production server
+SERVER_THREADS = int(os.getenv('TIMELINE_SERVER_THREADS', 8))
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+    g.request_cpu = time.process_time()
+
+@app.after_request
+def record_request(response):
+    """Count every request as a run of the 'http.<endpoint>' stage"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        instrumentation.record(
+            f'http.{request.endpoint or "unmatched"}', time.perf_counter() - started,
+            # Process-wide, so only indicative when requests overlap
+            cpu_seconds=time.process_time() - g.pop('request_cpu'),
+            counts={f'status_{response.status_code}': 1},
+            bytes_read=request.content_length or 0,
+            bytes_written=response.calculate_content_length() or 0,
+            keep=False)
+    return response
+
+def accepts_gzip():
+    return 'gzip' in artifacts.accepted_encodings(request.headers.get('Accept-Encoding'))
+
+@app.after_request
+def compress_response(response):
+    """Gzip large dynamic responses for clients that accept it
+
+    The ETag becomes weak, as the compressed body differs from the
+    uncompressed one; If-None-Match uses the weak comparison anyway.
+    """
+    if (response.status_code != 200 or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSED_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    length = response.calculate_content_length()
+    if not accepts_gzip() or length is None or length < COMPRESS_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(response.get_data(), COMPRESS_LEVEL, mtime=0))
+    response.headers['Content-Encoding'] = 'gzip'
+    etag, _ = response.get_etag()
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
+
+def not_modified(etag):
+    """Whether the client's copy (If-None-Match) is current, by weak comparison"""
+    return request.if_none_match.contains_weak(etag)
+
+def update_analysis_files(*requested):
+    """Rebuild stale analysis outputs (a single stat when nothing changed)
+
+    requested names on-demand stages to build as well. In production mode
+    (REFRESH_IN_BACKGROUND) the rebuild runs on a background thread and
+    requests are answered from the current outputs meanwhile.
+    """
+    if app.config['REFRESH_IN_BACKGROUND']:
+        pipeline.refresh_in_background(*requested)
+    else:
+        pipeline.ensure_fresh(*requested)
+
+class RenderedCache:
+    """Thread-safe LRU of rendered response bodies and their gzipped copies
+
+    Holds at most max_entries bodies and max_bytes of body and copy
+    together. Keys must change whenever the content would (the ETags of
+    the API routes do, as they include the version of their data).
+    """
+
+    def __init__(self, max_entries, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, render):
+        """(body, gzipped body or None) for key, calling render() on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        body = render()
+        entry = (body, gzip.compress(body, COMPRESS_LEVEL, mtime=0) if len(body) >= COMPRESS_MIN_BYTES else None)
+        size = len(body) + len(entry[1] or b'')
+        if self.max_bytes is not None and size > self.max_bytes:
+            return entry
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = entry
+                self.nbytes += size
+            while len(self._entries) > self.max_entries or \
+                    (self.max_bytes is not None and self.nbytes > self.max_bytes):
+                old_body, old_gzipped = self._entries.popitem(last=False)[1]
+                self.nbytes -= len(old_body) + len(old_gzipped or b'')
+        return entry
+
+_pages = RenderedCache(PAGE_CACHE_SIZE)
+_responses = RenderedCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_BYTES)
+
+def rendered_response(entry, mimetype, etag):
+    """Response from a RenderedCache entry, gzipped when the client accepts it"""
+    body, gzipped = entry
+    use_gzip = gzipped is not None and accepts_gzip()
+    response = Response(gzipped if use_gzip else body, mimetype=mimetype)
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    response.set_etag(etag, weak=True)
+    return response
+
+def cached_json(etag, build):
+    """JSON response of build() (called only on a cache miss), tagged etag"""
+    entry = _responses.get((request.endpoint, etag), lambda: jsonify(build()).get_data())
+    return rendered_response(entry, 'application/json', etag)
+
+def cached_page(*requested):
+    """Serve a page view's HTML from an LRU of rendered pages
 
-# Ensure static directories exist
-os.makedirs(os.path.join(app.static_folder, 'analysis'), exist_ok=True)
-
-def update_analysis_files():
-    """Run analysis and copy output files to static folder"""
-    # Run analysis if needed
-    if not os.path.exists('output/location_analysis.html'):
-        extract_timeline_data()
-        analyze_temporal_patterns()
-        analyze_locations()
-    
-    # Copy analysis files to static folder
-    shutil.copy('output/location_analysis.html', 
-                os.path.join(app.static_folder, 'analysis/location_analysis.html'))
-    shutil.copy('output/temporal_patterns.png',
-                os.path.join(app.static_folder, 'analysis/temporal_patterns.png'))
-    shutil.copy('output/location_statistics.json',
-                os.path.join(app.static_folder, 'analysis/location_statistics.json'))
-    shutil.copy('output/temporal_statistics.json',
-                os.path.join(app.static_folder, 'analysis/temporal_statistics.json'))
+    The view only renders. Pages are keyed on the endpoint, the query
+    string and the version of the pipeline outputs, so a rebuild renders
+    them again. requested is passed to update_analysis_files.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            update_analysis_files(*requested)
+            key = (request.endpoint, request.query_string, pipeline.outputs_version())
+            etag = hashlib.sha1(repr(key).encode()).hexdigest()
+            if not_modified(etag):
+                return '', 304
+            entry = _pages.get(key, lambda: view(*args, **kwargs).encode())
+            return rendered_response(entry, 'text/html', etag)
+        return wrapper
+    return decorator
+
+@app.route('/static/analysis/<path:filename>')
+def analysis_file(filename):
+    """Serve generated analysis outputs in place from the output directory
+
+    The .br / .gz copies written with each pipeline run (see artifacts) are
+    sent to clients accepting them. The ETag and Last-Modified come from
+    the output file, so conditional requests get a 304.
+    """
+    path = safe_join(os.path.abspath(pipeline.OUTPUT_DIR), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    served, encoding = artifacts.compressed_variant(path, request.headers.get('Accept-Encoding'))
+    stat = os.stat(path)
+    etag = f'{stat.st_mtime_ns:x}-{stat.st_size:x}' + (f'-{encoding}' if encoding else '')
+    response = send_file(served, mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream',
+                         conditional=True, etag=etag, last_modified=stat.st_mtime, max_age=0)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if artifacts.compressible(path):
+        response.vary.add('Accept-Encoding')
+    return response
 
 @app.route('/')
+@cached_page()
 def index():
-    update_analysis_files()
     return render_template('index.html')
 
 @app.route('/map')
+@cached_page()
 def map_view():
-    update_analysis_files()
-    
-    # Create a new map instance
+    import folium
+
+    # Create a new map instance; markers are fetched from /api/markers
     m = folium.Map(location=[0, 0], zoom_start=2)
-    
-    # Read the original map file to get the layers
-    map_path = os.path.join(app.static_folder, 'analysis/location_analysis.html')
+    return render_template('map.html',
+                           map=m.get_root().render(),
+                           map_name=m.get_name(),
+                           markers=[])
+
+def load_segment_index(name):
+    """Time-range / key index of the visits or activities table
+
+    Each table's index is built on first use and dropped when the store
+    version changes.
+    """
+    version = store_version()
+    with _index_lock:
+        if _segment_cache['version'] != version:
+            _segment_cache.update(version=version, indexes={})
+        indexes = _segment_cache['indexes']
+        if name not in indexes:
+            from segment_index import SegmentIndex
+            indexes[name] = SegmentIndex(name)
+        return version, indexes[name]
+
+def parse_time_param(value):
+    """Parse an epoch-milliseconds or ISO-8601 query parameter to epoch ms"""
+    if value is None:
+        return None
+    if value.lstrip('-').isdigit():
+        return int(value)
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+def delta_encode(values):
+    """Delta-encode an integer array into a compact JSON list"""
+    return np.diff(values, prepend=0).tolist()
+
+def segment_filters(name, args, type_param='type'):
+    """Keyword arguments of SegmentIndex.query from request arguments
+
+    start and end are epoch ms or ISO-8601, daily is 'HH:MM-HH:MM' local
+    time, weekdays a comma-separated list (Monday=0). Each indexed column
+    of the table is a repeatable parameter; type_param names the one used
+    for the table's type column (semantic_type for visits). Raises
+    ValueError on malformed values.
+    """
+    filters = {
+        'start': parse_time_param(args.get('start')),
+        'end': parse_time_param(args.get('end')),
+        'daily': parse_daily_window(args['daily']) if args.get('daily') else None,
+        'weekdays': None
+    }
+    if args.get('weekdays'):
+        weekdays = [int(day) for day in args['weekdays'].split(',')]
+        if not all(0 <= day <= 6 for day in weekdays):
+            raise ValueError('weekdays must be between 0 (Monday) and 6 (Sunday)')
+        filters['weekdays'] = weekdays
+    for column in KEY_COLUMNS[name]:
+        param = type_param if column in ('semantic_type', 'type') else column
+        filters[column] = args.getlist(param) or None
+    return filters
+
+@app.route('/api/markers')
+def api_markers():
+    """Visit markers inside a bbox and time range, delta-encoded
+
+    Query parameters: bbox=west,south,east,north, start and end (epoch ms
+    or ISO-8601), type (semantic type, repeatable), place_id (repeatable),
+    daily (local 'HH:MM-HH:MM') and weekdays (e.g. 0,1,2,3,4). Coordinates
+    are integers in 1e-5 degrees and times are epoch seconds, each sent as
+    differences from the previous marker.
+    """
+    update_analysis_files()
+    version, visits = load_segment_index('visits')
+
+    etag = hashlib.sha1(f'{version}?{request.query_string.decode()}'.encode()).hexdigest()
+    if not_modified(etag):
+        return '', 304
+
     try:
-        with open(map_path, 'r') as f:
-            content = f.read()
-            soup = BeautifulSoup(content, 'html.parser')
-            
-            # Extract marker data instead of scripts
-            markers = []
-            scripts = soup.find_all('script')
-            for script in scripts:
-                if not script.string:
-                    continue
-                    
-                if 'circle_marker_' in script.string:
-                    # Extract marker data using regex
-                    coords_match = re.search(r'L\.circleMarker\(\s*\[([-\d.]+),\s*([-\d.]+)\]', script.string)
-                    # Capture the entire options object
-                    options_match = re.search(r'{\s*"[^}]+":\s*[^}]+(?:,\s*"[^}]+":\s*[^}]+)*}', script.string)
-                    # Capture the entire popup HTML content
-                    popup_match = re.search(r'\$\(`<div[^>]*>(.*?)</div>`\)', script.string, re.DOTALL)
-                    
-                    if coords_match and options_match:
-                        markers.append({
-                            'lat': float(coords_match.group(1)),
-                            'lng': float(coords_match.group(2)),
-                            'options': options_match.group(0),  # Use the full options object
-                            'popup': popup_match.group(1).strip() if popup_match else ''
-                        })
-            
-            print(f"Extracted {len(markers)} markers")  # Debug info
-            
-            return render_template('map.html', 
-                                map=m.get_root().render(),
-                                markers=markers)
-                
-    except Exception as e:
-        print(f"Error processing map file: {e}")
-        traceback.print_exc()  # Print full stack trace
-        return render_template('map.html', 
-                             map=m.get_root().render(),
-                             markers=[])
+        bbox = request.args.get('bbox')
+        bbox = parse_bbox(bbox) if bbox else (-180, -90, 180, 90)
+        filters = segment_filters('visits', request.args)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameter: {e}'}), 400
+
+    return cached_json(etag, lambda: visit_markers(visits, visits.query(**filters), *bbox))
+
+def parse_bbox(value):
+    """(west, south, east, north) of a 'west,south,east,north' parameter"""
+    bbox = tuple(float(part) for part in value.split(','))
+    if len(bbox) != 4 or not np.isfinite(bbox).all():
+        raise ValueError('bbox must be four finite numbers west,south,east,north')
+    return bbox
+
+def visit_markers(visits, rows, west, south, east, north):
+    """The /api/markers payload of the visit rows inside the bbox"""
+    lat = visits.segments.lat[rows]
+    lng = visits.segments.lng[rows]
+    mask = (lat >= south) & (lat <= north)
+    if west <= east:
+        mask &= (lng >= west) & (lng <= east)
+    else:
+        # bbox crossing the antimeridian
+        mask &= (lng >= west) | (lng <= east)
+    rows = rows[mask]
+
+    start_time = visits.start[rows]
+    scale = 10 ** COORD_PRECISION
+    probability = visits.segments.probability[rows]
+    return {
+        'count': len(rows),
+        'precision': COORD_PRECISION,
+        'lat': delta_encode(np.round(lat[mask] * scale).astype(np.int64)),
+        'lng': delta_encode(np.round(lng[mask] * scale).astype(np.int64)),
+        'start': delta_encode(start_time // 1000),
+        'duration': ((visits.end[rows] - start_time) // 1000).tolist(),
+        'types': visits.segments.names('semantic_type'),
+        'type': visits.segments.semantic_type[rows].tolist(),
+        'probability': np.round(np.nan_to_num(probability, nan=0), 2).tolist()
+    }
+
+@app.route('/api/segments/<name>')
+def api_segments(name):
+    """Visits or activities matching time, key and time-of-day filters
 
+    Takes the filters of /api/markers (type is the activity type for
+    activities) plus limit (rows returned, default 1000, max 10000) and
+    offset. Answers the total count and the rows in start-time order, with
+    times in epoch ms; NaN coordinates are sent as null.
+    """
+    if name not in KEY_COLUMNS:
+        return jsonify({'error': 'Unknown table'}), 404
+    try:
+        filters = segment_filters(name, request.args)
+        limit = int(request.args.get('limit', 1000))
+        offset = int(request.args.get('offset', 0))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameter: {e}'}), 400
+    if not 0 <= limit <= 10000 or offset < 0:
+        return jsonify({'error': 'Parameters out of range'}), 400
+
+    update_analysis_files()
+    version, index = load_segment_index(name)
+    etag = hashlib.sha1(f'{version}/{name}?{request.query_string.decode()}'.encode()).hexdigest()
+    if not_modified(etag):
+        return '', 304
+
+    def build():
+        rows = index.query(**filters)
+        segments = index.segments[rows[offset:offset + limit]].to_pandas()
+        segments = segments.astype(object).where(segments.notna(), None)
+        return {'count': len(rows), 'offset': offset, 'segments': segments.to_dict('records')}
+    return cached_json(etag, build)
+
+@app.route('/api/segments/<name>/values/<column>')
+def api_segment_values(name, column):
+    """Values of an indexed column with their segment counts, for filter menus"""
+    if name not in KEY_COLUMNS or column not in KEY_COLUMNS[name]:
+        return jsonify({'error': 'Unknown index'}), 404
+    update_analysis_files()
+    version, index = load_segment_index(name)
+    etag = hashlib.sha1(f'{version}/{name}/{column}'.encode()).hexdigest()
+    if not_modified(etag):
+        return '', 304
+    # A list rather than an object, so the most-frequent-first order survives
+    return cached_json(etag, lambda: [{'value': value, 'count': count}
+                                      for value, count in index.values(column).items()])
+
+@app.route('/api/temporal-stats')
+def api_temporal_stats():
+    """Temporal statistics of the visits and activities matching filters
+
+    Same filters as /api/segments: time filters apply to both tables,
+    place_id and type only to visits (type being the semantic type) and
+    activity_type only to activities. Without filters this is the content
+    of temporal_statistics.json.
+    """
+    try:
+        visit_filters = segment_filters('visits', request.args)
+        activity_filters = segment_filters('activities', request.args, type_param='activity_type')
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameter: {e}'}), 400
+
+    from temporal_analysis import compute_temporal_statistics
+
+    update_analysis_files()
+    version, visits = load_segment_index('visits')
+    _, activities = load_segment_index('activities')
+    etag = hashlib.sha1(f'{version}/temporal?{request.query_string.decode()}'.encode()).hexdigest()
+    if not_modified(etag):
+        return '', 304
+
+    return cached_json(etag, lambda: compute_temporal_statistics(
+        visits.segments[visits.query(**visit_filters)],
+        activities.segments[activities.query(**activity_filters)]))
+
+def artifact_version(*paths):
+    """Fingerprint of built artifacts from their file stats, None while one is missing
+
+    Stages replace their artifacts atomically once built, so the
+    fingerprint changes when a rebuild finishes, not when the store it is
+    built from changes.
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        digest.update(f'{path}:{stat.st_mtime_ns}:{stat.st_size}'.encode())
+    return digest.hexdigest()
+
+def index_not_built():
+    return jsonify({'error': 'Index is being built, try again shortly'}), 503
+
+def load_spatial_index():
+    """Spatial tile index, reloaded when its tiles or the store change
+
+    High-zoom tiles are cut from the store, so both are part of the
+    version. Returns (None, None) while the tiles are not built.
+    """
+    from spatial_index import SpatialIndex, index_files
+    tiles_version = artifact_version(*index_files())
+    if tiles_version is None:
+        return None, None
+    version = f'{tiles_version}/{store_version()}'
+    with _index_lock:
+        if _tile_cache['version'] != version:
+            _tile_cache.update(version=version, index=SpatialIndex())
+        return version, _tile_cache['index']
+
+@app.route('/api/tiles/<int:z>/<int:x>/<int:y>.json')
+def api_tile(z, x, y):
+    """Zoom-aware clustered visits and activity flows for one map tile"""
+    if not (0 <= z <= 22 and 0 <= x < (1 << z) and 0 <= y < (1 << z)):
+        return jsonify({'error': 'Tile out of range'}), 404
+
+    update_analysis_files()
+    version, index = load_spatial_index()
+    if index is None:
+        return index_not_built()
+    etag = hashlib.sha1(f'{version}/{z}/{x}/{y}'.encode()).hexdigest()
+    if not_modified(etag):
+        return '', 304
+
+    return cached_json(etag, lambda: index.query_tile(z, x, y))
+
+def load_route_index():
+    """Origin-destination route index, reloaded when it is rebuilt
+
+    Returns (None, None) while the index is not built.
+    """
+    from route_index import RouteIndex, od_path
+    version = artifact_version(od_path())
+    if version is None:
+        return None, None
+    with _index_lock:
+        if _route_cache['version'] != version:
+            _route_cache.update(version=version, index=RouteIndex())
+        return version, _route_cache['index']
+
+@app.route('/api/routes/top')
+def api_top_routes():
+    """Most frequent origin-destination routes
+
+    Optional query parameters: k (1-500, default 20), by (count, distance
+    or duration), hour (local start hour 0-23) and loops (1 to include
+    trips that start and end at the same place).
+    """
+    try:
+        k = int(request.args.get('k', 20))
+        hour = int(request.args['hour']) if 'hour' in request.args else None
+    except ValueError:
+        return jsonify({'error': 'Invalid parameters'}), 400
+    by = request.args.get('by', 'count')
+    if not 1 <= k <= 500 or by not in ('count', 'distance', 'duration') or \
+            (hour is not None and not 0 <= hour <= 23):
+        return jsonify({'error': 'Parameters out of range'}), 400
+    loops = request.args.get('loops') == '1'
+
+    update_analysis_files()
+    version, index = load_route_index()
+    if index is None:
+        return index_not_built()
+    etag = hashlib.sha1(f'{version}/{k}/{by}/{hour}/{loops}'.encode()).hexdigest()
+    if not_modified(etag):
+        return '', 304
+
+    return cached_json(etag, lambda: {'routes': index.top_routes(k, by, hour, loops)})
+
+def load_rollup_cube(name):
+    """Rollup cube of the visits or activities, reloaded when it is rebuilt
+
+    Returns (None, None) while the cube is not built.
+    """
+    from rollups import RollupCube, cube_path
+    version = artifact_version(cube_path(name))
+    if version is None:
+        return None, None
+    with _index_lock:
+        if _rollup_cache.get(name, (None,))[0] != version:
+            _rollup_cache[name] = (version, RollupCube(name))
+        return _rollup_cache[name]
+
+def _int_list(value, low, high, name):
+    values = [int(part) for part in value.split(',')]
+    if not all(low <= part <= high for part in values):
+        raise ValueError(f'{name} must be between {low} and {high}')
+    return values
+
+def rollup_filters(args):
+    """Keyword arguments of RollupCube.query from request arguments
+
+    start and end are inclusive local dates (YYYY-MM-DD), hours and
+    weekdays comma-separated lists, type and place repeatable (place 'none'
+    for segments outside every place) and by up to two comma-separated
+    dimensions. Raises ValueError on malformed values.
+    """
+    from rollups import day_number
+    filters = {
+        'by': args['by'].split(',') if args.get('by') else [],
+        'start': day_number(args['start']) if args.get('start') else None,
+        'end': day_number(args['end']) if args.get('end') else None,
+        'hours': _int_list(args['hours'], 0, 23, 'hours') if args.get('hours') else None,
+        'weekdays': _int_list(args['weekdays'], 0, 6, 'weekdays') if args.get('weekdays') else None,
+        'types': args.getlist('type') or None,
+        'places': None
+    }
+    if args.getlist('place'):
+        filters['places'] = [-1 if place == 'none' else int(place) for place in args.getlist('place')]
+    return filters
+
+@app.route('/api/rollups/<name>')
+def api_rollups(name):
+    """Counts, hours and distances of visits or activities from the rollup cubes
+
+    Grouped by up to two of day, month, year, weekday, hour, type and place
+    (by=weekday,hour) and filtered by start, end, hours, weekdays, type and
+    place (see rollup_filters). Answered from pre-aggregated cells without
+    reading any segment; measures are nested lists indexed like the labels.
+    """
+    if name not in ('visits', 'activities'):
+        return jsonify({'error': 'Unknown table'}), 404
+    try:
+        filters = rollup_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameter: {e}'}), 400
+
+    update_analysis_files()
+    version, cube = load_rollup_cube(name)
+    if cube is None:
+        return index_not_built()
+    etag = hashlib.sha1(f'{version}/rollups/{name}?{request.query_string.decode()}'.encode()).hexdigest()
+    if not_modified(etag):
+        return '', 304
+
+    try:
+        return cached_json(etag, lambda: cube.query(**filters))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/places')
+def api_places():
+    """Frequently visited places (DBSCAN clusters of visits), by dwell time
+
+    Optional query parameters: eps (meters, 10-2000), min_visits (>= 1) and
+    limit (>= 0, number of places returned).
+    """
+    try:
+        eps_m = float(request.args.get('eps', EPS_METERS))
+        min_visits = int(request.args.get('min_visits', MIN_VISITS))
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+    except ValueError:
+        return jsonify({'error': 'Invalid parameters'}), 400
+    if not 10 <= eps_m <= 2000 or min_visits < 1 or (limit is not None and limit < 0):
+        return jsonify({'error': 'Parameters out of range'}), 400
+
+    update_analysis_files()
+    places = frequent_places(eps_m, min_visits)
+    etag = hashlib.sha1(f"{places['version']}/{limit}".encode()).hexdigest()
+    if not_modified(etag):
+        return '', 304
+
+    return cached_json(etag, lambda: {**places, 'places': places['places'][:limit]})
+
+# The temporal page shows the figure, so render it if it is stale
 @app.route('/temporal')
+@cached_page('temporal_plot')
 def temporal_view():
-    update_analysis_files()
     return render_template('temporal.html')
 
 @app.route('/statistics')
+@cached_page()
 def statistics_view():
-    update_analysis_files()
     return render_template('statistics.html')
 
+@app.route('/metrics')
+def metrics():
+    """Per-stage timings, record counts, bytes and peak memory of this process
+
+    Pipeline stages run by this process and every endpoint ('http.<name>')
+    are included. JSON by default; ?format=prometheus gives the Prometheus
+    text format.
+    """
+    snapshot = instrumentation.snapshot()
+    if request.args.get('format') == 'prometheus':
+        return Response(instrumentation.prometheus_text(snapshot), mimetype='text/plain; version=0.0.4')
+    return jsonify(snapshot)
+
 @app.route('/api/process-timeline', methods=['POST'])
 def process_timeline():
-    """API endpoint for processing uploaded Timeline.json"""
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file uploaded'}), 400
-    
-    # Handle file upload and processing
-    # This will be implemented later
-    return jsonify({'status': 'success'})
+    """Accept a Timeline.json upload and extract it in the background
+
+    The export can be sent as the 'file' field of a multipart form or as the
+    raw request body. Either way it is streamed to disk, queued on the job
+    worker pool and answered with 202 and the job id right away; poll
+    /api/jobs/<id> for progress.
+    """
+    if request.mimetype == 'multipart/form-data':
+        # Parsing the form streams every file part into a job directory
+        upload = request.files.get('file')
+        uploads = dict(getattr(request, 'upload_jobs', []))
+        job_id = next((job_id for job_id, stream in uploads.items()
+                       if upload and stream is upload.stream), None)
+        # Any other file parts were streamed to disk as well; drop them
+        for other_id, stream in uploads.items():
+            stream.close()
+            if other_id != job_id:
+                jobs.discard_job(other_id)
+        if job_id is None:
+            return jsonify({'error': 'No file uploaded'}), 400
+    else:
+        if not request.content_length:
+            return jsonify({'error': 'No file uploaded'}), 400
+        job_id, path = jobs.create_job()
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(request.stream, f, UPLOAD_BLOCK_SIZE)
+
+    jobs.submit_job(job_id)
+    response = jsonify({'job_id': job_id, 'status_url': f'/api/jobs/{job_id}'})
+    response.status_code = 202
+    response.headers['Location'] = f'/api/jobs/{job_id}'
+    return response
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    """State and progress (bytes read, segments parsed) of an upload job"""
+    status = jobs.job_status(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(status)
+
+def run_production(host='127.0.0.1', port=5000, threads=SERVER_THREADS):
+    """Serve with waitress when it is installed, else werkzeug's threaded server
+
+    The pipeline outputs are brought up to date and pre-compressed before
+    the first request; later rebuilds run in the background.
+    """
+    app.config['REFRESH_IN_BACKGROUND'] = True
+    pipeline.ensure_fresh()
+    artifacts.precompress_outputs(directory=pipeline.OUTPUT_DIR)
+    try:
+        from waitress import serve
+    except ImportError:
+        serve = None
+    if serve is not None:
+        serve(app, host=host, port=port, threads=threads)
+        return
+    import logging
+    from werkzeug.serving import run_simple
+    # A log line per request costs more than most cached responses
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    run_simple(host, port, app, threaded=True)
 
 if __name__ == '__main__':
     app.run(debug=True) 
\ No newline at end of file
@@ -1,2 +1,15 @@
 // Common JavaScript functionality
-console.log('Timeline Analysis App loaded'); 
\ No newline at end of file
+console.log('Timeline Analysis App loaded'); 
+// Query string for the segment filters shared by /api/markers, /api/segments
+// and /api/temporal-stats; array values become repeated parameters
+function segmentParams(filters) {
+    const params = new URLSearchParams();
+    for (const [key, value] of Object.entries(filters)) {
+        for (const item of Array.isArray(value) ? value : [value]) {
+            if (item !== null && item !== undefined && item !== '') {
+                params.append(key, item);
+            }
+        }
+    }
+    return params;
+}
@@ -0,0 +1,207 @@
+// Viewport-driven visit markers backed by /api/markers
+
+function decodeDeltas(values) {
+    const decoded = new Array(values.length);
+    let current = 0;
+    for (let i = 0; i < values.length; i++) {
+        current += values[i];
+        decoded[i] = current;
+    }
+    return decoded;
+}
+
+function clampBounds(bounds) {
+    const clamp = (value, limit) => Math.max(-limit, Math.min(limit, value));
+    return [
+        clamp(bounds.getWest(), 180),
+        clamp(bounds.getSouth(), 90),
+        clamp(bounds.getEast(), 180),
+        clamp(bounds.getNorth(), 90)
+    ].map(value => value.toFixed(5)).join(',');
+}
+
+// Call from map.html with the folium map variable and the API url, e.g.
+// initMarkerLayer({{ map_name }}, "{{ url_for('api_markers') }}")
+// Filters (start, end, type, place_id, daily, weekdays) can be changed later
+// with layer.setFilters({ daily: '08:00-09:00', weekdays: '0,1,2,3,4' }).
+function initMarkerLayer(map, apiUrl, extraParams = {}) {
+    const layer = L.layerGroup().addTo(map);
+    let pending = null;
+
+    async function refresh() {
+        if (pending) {
+            pending.abort();
+        }
+        pending = new AbortController();
+        const params = segmentParams({ ...extraParams, bbox: clampBounds(map.getBounds()) });
+
+        let data;
+        try {
+            const response = await fetch(`${apiUrl}?${params}`, { signal: pending.signal });
+            data = await response.json();
+        } catch (error) {
+            if (error.name !== 'AbortError') {
+                console.error('Failed to load markers', error);
+            }
+            return;
+        }
+
+        const scale = Math.pow(10, data.precision);
+        const lats = decodeDeltas(data.lat);
+        const lngs = decodeDeltas(data.lng);
+        const starts = decodeDeltas(data.start);
+
+        layer.clearLayers();
+        for (let i = 0; i < data.count; i++) {
+            const type = data.type[i] >= 0 ? data.types[data.type[i]] : 'UNKNOWN';
+            const color = type === 'INFERRED_HOME' ? 'red' : 'blue';
+            const start = new Date(starts[i] * 1000);
+            const end = new Date((starts[i] + data.duration[i]) * 1000);
+            L.circleMarker([lats[i] / scale, lngs[i] / scale], {
+                radius: 8,
+                color: color,
+                fill: true,
+                fillColor: color
+            }).bindPopup(
+                `Type: ${type}<br>` +
+                `Time: ${start.toISOString()} - ${end.toISOString()}<br>` +
+                `Probability: ${data.probability[i].toFixed(2)}`
+            ).addTo(layer);
+        }
+    }
+
+    layer.setFilters = filters => {
+        extraParams = filters;
+        refresh();
+    };
+
+    map.on('moveend', refresh);
+    refresh();
+    return layer;
+}
+
+// Zoom-aware clustered tiles backed by /api/tiles/<z>/<x>/<y>.json, e.g.
+// initTileLayer({{ map_name }}, "/api/tiles/{z}/{x}/{y}.json")
+function initTileLayer(map, tileUrl) {
+    const layer = L.layerGroup().addTo(map);
+    const cache = new Map();
+
+    function fetchTile(z, x, y) {
+        const key = `${z}/${x}/${y}`;
+        if (!cache.has(key)) {
+            const url = tileUrl.replace('{z}', z).replace('{x}', x).replace('{y}', y);
+            cache.set(key, fetch(url).then(response => response.ok ? response.json() : null));
+        }
+        return cache.get(key);
+    }
+
+    function visibleTiles(zoom) {
+        const bounds = map.getPixelBounds();
+        const size = 256;
+        const max = (1 << zoom) - 1;
+        const tiles = [];
+        for (let x = Math.max(0, Math.floor(bounds.min.x / size)); x <= Math.min(max, Math.floor(bounds.max.x / size)); x++) {
+            for (let y = Math.max(0, Math.floor(bounds.min.y / size)); y <= Math.min(max, Math.floor(bounds.max.y / size)); y++) {
+                tiles.push([zoom, x, y]);
+            }
+        }
+        return tiles;
+    }
+
+    async function refresh() {
+        const zoom = Math.round(map.getZoom());
+        const tiles = await Promise.all(visibleTiles(zoom).map(tile => fetchTile(...tile)));
+        if (Math.round(map.getZoom()) !== zoom) {
+            return;
+        }
+
+        layer.clearLayers();
+        const drawnFlows = new Set();
+        for (const tile of tiles) {
+            if (!tile) {
+                continue;
+            }
+            const visits = tile.visits;
+            for (let i = 0; i < visits.count.length; i++) {
+                L.circleMarker([visits.lat[i], visits.lng[i]], {
+                    radius: 4 + 2 * Math.sqrt(visits.count[i]),
+                    color: 'blue',
+                    fill: true,
+                    fillOpacity: 0.4
+                }).bindPopup(
+                    `Visits: ${visits.count[i]}<br>Time spent: ${visits.dwell_hours[i].toFixed(1)} h`
+                ).addTo(layer);
+            }
+
+            const flows = tile.activities;
+            for (let i = 0; i < flows.id.length; i++) {
+                if (drawnFlows.has(flows.id[i])) {
+                    continue;
+                }
+                drawnFlows.add(flows.id[i]);
+                L.polyline([flows.start[i], flows.end[i]], {
+                    weight: Math.min(8, 1 + Math.log2(flows.count[i])),
+                    color: 'green',
+                    opacity: 0.8
+                }).bindPopup(
+                    `Movements: ${flows.count[i]}<br>Distance: ${flows.distance_km[i].toFixed(1)} km`
+                ).addTo(layer);
+            }
+        }
+    }
+
+    map.on('moveend', refresh);
+    refresh();
+    return layer;
+}
+
+// Frequently visited places backed by /api/places, e.g.
+// initPlacesLayer({{ map_name }}, "{{ url_for('api_places') }}")
+function initPlacesLayer(map, apiUrl, params = {}) {
+    const layer = L.layerGroup().addTo(map);
+    fetch(`${apiUrl}?${new URLSearchParams(params)}`)
+        .then(response => response.json())
+        .then(data => {
+            for (const place of data.places) {
+                L.circle([place.lat, place.lng], {
+                    radius: Math.max(place.radius_m, 25),
+                    color: 'purple',
+                    fill: true,
+                    fillOpacity: Math.min(0.8, 0.1 + place.dwell_hours / 1000)
+                }).bindPopup(
+                    `Type: ${place.semantic_type}<br>` +
+                    `Visits: ${place.visits}<br>` +
+                    `Time spent: ${place.dwell_hours.toFixed(1)} h`
+                ).addTo(layer);
+            }
+        })
+        .catch(error => console.error('Failed to load places', error));
+    return layer;
+}
+
+// Most frequent routes backed by /api/routes/top, e.g.
+// initRoutesLayer({{ map_name }}, "{{ url_for('api_top_routes') }}", { k: 50 })
+function initRoutesLayer(map, apiUrl, params = {}) {
+    const layer = L.layerGroup().addTo(map);
+    fetch(`${apiUrl}?${new URLSearchParams(params)}`)
+        .then(response => response.json())
+        .then(data => {
+            for (const route of data.routes) {
+                const { origin, destination } = route;
+                if (origin.lat === null || destination.lat === null) {
+                    continue;
+                }
+                L.polyline([[origin.lat, origin.lng], [destination.lat, destination.lng]], {
+                    weight: Math.min(10, 1 + Math.log2(route.count)),
+                    color: 'orange',
+                    opacity: 0.8
+                }).bindPopup(
+                    `Trips: ${route.count}<br>` +
+                    `Average distance: ${route.avg_distance_km.toFixed(1)} km<br>` +
+                    `Average duration: ${route.avg_duration_min.toFixed(0)} min`
+                ).addTo(layer);
+            }
+        })
+        .catch(error => console.error('Failed to load routes', error));
+    return layer;
+}
@@ -0,0 +1,60 @@
+// Filtered temporal statistics backed by /api/temporal-stats
+
+// Read the segment filters from a form whose fields are named after the
+// API parameters (start, end, daily, weekdays, type, activity_type, place_id)
+function readSegmentFilters(form) {
+    const filters = {};
+    for (const [key, value] of new FormData(form)) {
+        (filters[key] = filters[key] || []).push(value);
+    }
+    return filters;
+}
+
+// Counts, hours and distances from /api/rollups/<table>, grouped by up to two
+// dimensions, e.g. fetchRollup('/api/rollups/visits', ['weekday', 'hour'],
+// { start: '2016-01-01', type: ['INFERRED_WORK'] }); answers in milliseconds
+// from the precomputed cubes, so it can follow every filter change
+async function fetchRollup(apiUrl, by, filters, signal) {
+    const params = segmentParams({ ...filters, by: by.join(',') });
+    const response = await fetch(`${apiUrl}?${params}`, { signal });
+    const rollup = await response.json();
+    if (!response.ok) {
+        throw new Error(rollup.error);
+    }
+    return rollup;
+}
+
+// Call from temporal.html with the filter form, the API url and a function
+// drawing the statistics, e.g.
+// initTemporalFilter(form, "{{ url_for('api_temporal_stats') }}", drawCharts)
+function initTemporalFilter(form, apiUrl, render) {
+    let pending = null;
+
+    async function refresh() {
+        if (pending) {
+            pending.abort();
+        }
+        pending = new AbortController();
+        try {
+            const params = segmentParams(readSegmentFilters(form));
+            const response = await fetch(`${apiUrl}?${params}`, { signal: pending.signal });
+            const stats = await response.json();
+            if (!response.ok) {
+                console.error('Invalid filters', stats.error);
+                return;
+            }
+            render(stats);
+        } catch (error) {
+            if (error.name !== 'AbortError') {
+                console.error('Failed to load temporal statistics', error);
+            }
+        }
+    }
+
+    form.addEventListener('change', refresh);
+    form.addEventListener('submit', event => {
+        event.preventDefault();
+        refresh();
+    });
+    refresh();
+}
@@ -0,0 +1,51 @@
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The modules import each other by bare name, as when run from src/
+for directory in ('src', os.path.join('src', 'webapp'), 'benchmarks'):
+    sys.path.insert(0, os.path.join(ROOT, directory))
+
+from synthetic_timeline import write_timeline  # noqa: E402
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """Empty working directory laid out like the repository root"""
+    os.makedirs(tmp_path / 'data')
+    os.makedirs(tmp_path / 'output')
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.fixture(autouse=True)
+def pipeline_state(monkeypatch):
+    """Fresh in-process pipeline state, as every test has a workspace of its own"""
+    import pipeline
+    monkeypatch.setattr(pipeline, '_last_input_stat', {})
+    monkeypatch.setattr(pipeline, '_store_updates', 0)
+    monkeypatch.setattr(pipeline, '_outputs_version', pipeline._UNKNOWN)
+
+@pytest.fixture
+def timeline(workspace):
+    """Path of a small synthetic Timeline.json in the workspace"""
+    return write_timeline(str(workspace / 'data' / 'Timeline.json'), 400, seed=3)
+
+@pytest.fixture
+def client(workspace):
+    """Test client of the web app, serving from the workspace"""
+    from app import app
+    return app.test_client()
+
+@pytest.fixture
+def store(timeline, workspace):
+    """The synthetic timeline extracted into the workspace's store
+
+    The export is moved aside afterwards so the web app serves the store
+    as it is instead of running the pipeline.
+    """
+    from data_extraction import extract_timeline_data
+    extract_timeline_data(timeline, str(workspace / 'data' / 'extracted_timeline.json'),
+                          store_dir=str(workspace / 'data' / 'timeline_store'))
+    os.replace(timeline, str(workspace / 'data' / 'export.json'))
+    return str(workspace / 'data' / 'timeline_store')
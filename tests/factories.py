@@ -0,0 +1,48 @@
+"""Hand-written Timeline.json segments for tests that need exact contents"""
+import json
+from datetime import datetime, timedelta
+
+def _timestamp(moment):
+    return moment.isoformat(timespec='milliseconds')
+
+def visit_segment(start, minutes=60, lat=51.5, lng=-0.12, place_id='home', semantic_type='INFERRED_HOME',
+                  location=None):
+    """A visit segment starting at start (ISO time with offset), or an undated one for None"""
+    begin = datetime.fromisoformat(start) if start else None
+    segment = {
+        'visit': {
+            'hierarchyLevel': 0,
+            'probability': 0.9,
+            'topCandidate': {
+                'placeId': place_id,
+                'semanticType': semantic_type,
+                'probability': 0.8,
+                'placeLocation': {'latLng': location or f'{lat}°, {lng}°'}
+            }
+        }
+    }
+    if begin is not None:
+        segment['startTime'] = _timestamp(begin)
+        segment['endTime'] = _timestamp(begin + timedelta(minutes=minutes))
+        segment['startTimeTimezoneUtcOffsetMinutes'] = int(begin.utcoffset().total_seconds() // 60)
+    return segment
+
+def activity_segment(start, minutes=20, start_point=(51.5, -0.12), end_point=(51.55, -0.2), kind='WALKING',
+                     distance=1500.0):
+    begin = datetime.fromisoformat(start)
+    return {
+        'startTime': _timestamp(begin),
+        'endTime': _timestamp(begin + timedelta(minutes=minutes)),
+        'startTimeTimezoneUtcOffsetMinutes': int(begin.utcoffset().total_seconds() // 60),
+        'activity': {
+            'start': {'latLng': f'{start_point[0]}°, {start_point[1]}°'},
+            'end': {'latLng': f'{end_point[0]}°, {end_point[1]}°'},
+            'distanceMeters': distance,
+            'topCandidate': {'type': kind, 'probability': 0.7}
+        }
+    }
+
+def write_export(path, segments):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'semanticSegments': segments}, f, ensure_ascii=False)
+    return str(path)
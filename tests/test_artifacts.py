@@ -0,0 +1,58 @@
+import gzip
+import os
+import pytest
+import artifacts
+from artifacts import accepted_encodings, compressed_variant, precompress, precompress_outputs
+
+class FakeBrotli:
+    """Stands in for the optional brotli package (any smaller encoding will do)"""
+
+    @staticmethod
+    def compress(data, quality):
+        return b'br' + gzip.compress(data, 1, mtime=0)
+
+@pytest.fixture
+def page(tmp_path):
+    path = tmp_path / 'location_analysis.html'
+    path.write_text('<div class="marker"></div>\n' * 200)
+    return str(path)
+
+def test_precompress_writes_a_gzip_copy_with_the_source_mtime(page):
+    assert precompress(page) == ['gzip']
+    with open(page + '.gz', 'rb') as f, open(page, 'rb') as source:
+        assert gzip.decompress(f.read()) == source.read()
+    assert os.stat(page + '.gz').st_mtime_ns == os.stat(page).st_mtime_ns
+    # Up to date copies are left alone
+    assert precompress(page) == []
+
+def test_precompress_skips_small_and_binary_files(tmp_path):
+    small = tmp_path / 'stats.json'
+    small.write_text('{"visits": 1}')
+    image = tmp_path / 'plot.png'
+    image.write_bytes(b'\x89PNG' * 1000)
+    assert precompress(str(small)) == precompress(str(image)) == []
+    assert precompress_outputs(directory=str(tmp_path)) == {}
+    assert sorted(os.listdir(tmp_path)) == ['plot.png', 'stats.json']
+
+def test_rewritten_file_is_not_served_its_old_copy(page):
+    precompress(page)
+    assert compressed_variant(page, 'gzip') == (page + '.gz', 'gzip')
+    with open(page, 'a') as f:
+        f.write('<p>more</p>')
+    os.utime(page, ns=(0, os.stat(page).st_mtime_ns + 1))
+    assert compressed_variant(page, 'gzip') == (page, None)
+    assert precompress_outputs([page]) == {page: ['gzip']}
+    assert compressed_variant(page, 'gzip') == (page + '.gz', 'gzip')
+
+def test_brotli_copy_is_preferred_when_accepted(page, monkeypatch):
+    monkeypatch.setattr(artifacts, '_brotli', lambda: FakeBrotli)
+    assert precompress(page) == ['br', 'gzip']
+    assert compressed_variant(page, 'gzip, deflate, br') == (page + '.br', 'br')
+    assert compressed_variant(page, 'br;q=0, gzip') == (page + '.gz', 'gzip')
+    assert compressed_variant(page, '*') == (page + '.br', 'br')
+    assert compressed_variant(page, 'identity') == (page, None)
+    assert compressed_variant(page, None) == (page, None)
+
+def test_accepted_encodings():
+    assert accepted_encodings('GZIP;q=0.5, br;q=0, deflate ; q=0.0, identity') == {'gzip', 'identity'}
+    assert accepted_encodings('') == set()
@@ -0,0 +1,79 @@
+import json
+from datetime import datetime, timedelta
+import pytest
+import load_test
+import run_benchmarks
+from run_benchmarks import BENCHMARKS, compare, run_probe, summarize
+from synthetic_timeline import HISTORY_YEARS, SEGMENTS_PER_DAY, TimelineGenerator, generate_segments, write_timeline
+
+def test_synthetic_timeline_is_deterministic(tmp_path):
+    first = write_timeline(str(tmp_path / 'a.json'), 300, seed=7)
+    second = write_timeline(str(tmp_path / 'b.json'), 300, seed=7)
+    with open(first, 'rb') as a, open(second, 'rb') as b:
+        assert a.read() == b.read()
+
+def test_synthetic_timeline_shape(timeline):
+    with open(timeline, 'r', encoding='utf-8') as f:
+        segments = json.load(f)['semanticSegments']
+    assert len(segments) == 400
+    assert {'visit', 'activity', 'timelinePath'} <= {key for segment in segments for key in segment}
+    starts = [datetime.fromisoformat(segment['startTime']) for segment in segments]
+    assert starts == sorted(starts)
+    assert all(segment['startTime'] <= segment['endTime'] for segment in segments)
+
+def test_days_stay_anchored_to_the_morning():
+    # Years of history: a drifting day start would spread commutes over the clock
+    arrivals = [datetime.fromisoformat(segment['startTime']) for segment in TimelineGenerator(20000, seed=1)
+                if segment.get('visit', {}).get('topCandidate', {}).get('placeId') == 'work']
+    assert arrivals[-1] - arrivals[0] > timedelta(days=3 * 365)
+    morning = sum(6 <= arrival.hour < 10 for arrival in arrivals)
+    assert morning / len(arrivals) > 0.95
+
+def test_merged_people_stay_in_time_order():
+    # One more segment than a single person's history holds
+    segments = list(generate_segments(HISTORY_YEARS * 365 * SEGMENTS_PER_DAY + 1, seed=1))
+    starts = [datetime.fromisoformat(segment['startTime']) for segment in segments]
+    assert starts == sorted(starts)
+    assert len({segment['visit']['topCandidate']['placeId'][:3] for segment in segments
+                if 'visit' in segment and segment['visit']['topCandidate']['placeId'].startswith('p')}) == 2
+
+def test_run_probe_times_every_round(workspace):
+    result = run_probe(str(workspace), "total = 0", "total += 1", 4)
+    assert len(result['times']) == 4
+    assert result['peak_rss_kb'] >= result['setup_rss_kb'] > 0
+
+@pytest.mark.parametrize('name', ['extract', 'extract_streaming'])
+def test_extract_benchmarks_run(timeline, workspace, name):
+    setup, statement = BENCHMARKS[name]
+    result = run_probe(str(workspace), setup, statement, 1)
+    assert len(result['times']) == 1
+    with open(workspace / 'data' / 'extracted_timeline.json', 'r') as f:
+        assert json.load(f)['metadata']['total_segments'] == 400
+
+def test_every_benchmark_compiles():
+    for name, (setup, statement) in BENCHMARKS.items():
+        code = run_benchmarks.PROBE.format(src=run_benchmarks.SRC_DIR, setup=setup.format(src=run_benchmarks.SRC_DIR),
+                                           statement=statement, rounds=1)
+        compile(code, name, 'exec')
+
+def test_summarize_and_compare():
+    stats = summarize({'times': [0.5, 0.2, 0.3], 'setup_rss_kb': 10240, 'peak_rss_kb': 20480})
+    assert stats == {'min_s': 0.2, 'median_s': 0.3, 'first_s': 0.5, 'rounds': 3, 'peak_mb': 20.0, 'setup_mb': 10.0}
+    assert compare('x', stats, {'min_s': 0.2, 'peak_mb': 20.0}, 1.5, 1.5) == []
+    # Small absolute differences are noise, large relative ones regressions
+    assert compare('x', stats, {'min_s': 0.19, 'peak_mb': 19.0}, 1.01, 1.01) == []
+    failures = compare('x', stats, {'min_s': 0.1, 'peak_mb': 20.0}, 1.5, 1.5)
+    assert len(failures) == 1 and 'takes 200 ms' in failures[0]
+    failures = compare('x', {**stats, 'peak_mb': 100.0}, {'min_s': 0.2, 'peak_mb': 20.0}, 1.5, 1.5)
+    assert len(failures) == 1 and 'peaks at 100 MB' in failures[0]
+
+def test_load_test_summary():
+    samples = [('/a', 200, 0.01, 100), ('/a', 304, 0.02, 0), ('/b', 200, 0.03, 50), ('/b', None, 0.5, 0)]
+    summary = load_test.summarize(samples, 1.0)
+    assert summary['requests'] == 4
+    assert summary['errors'] == 1
+    assert summary['not_modified'] == 1
+    assert summary['requests_per_s'] == 3.0
+    assert summary['by_url']['/a']['requests'] == 2
+    assert summary['by_url']['/b']['p50_ms'] == 30.0
+    assert load_test.percentiles([]) == {'p50_ms': None, 'p90_ms': None, 'p99_ms': None, 'max_ms': None}
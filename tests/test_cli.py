@@ -0,0 +1,33 @@
+import json
+import os
+import pytest
+import cli
+from timeline_store import read_table
+
+@pytest.mark.parametrize('argv', [
+    ['a.json', 'b.json', '--streaming'],
+    ['a.json', 'b.json', '--incremental'],
+    ['a.json', 'b.json', '--validate'],
+    ['a.json', '--workers', '2', '--validate'],
+    ['a.json', '--workers', '2', '--incremental']
+])
+def test_extract_rejects_options_batches_ignore(argv, capsys):
+    with pytest.raises(SystemExit) as exit:
+        cli.main(['extract', *argv])
+    assert exit.value.code == 2
+    assert 'error' in capsys.readouterr().err
+
+def test_extract_single_input_honours_output(timeline, workspace):
+    cli.main(['extract', timeline, '--streaming', '--output', 'data/out.json'])
+    assert os.path.exists('data/out.json')
+    assert not os.path.exists('data/extracted_timeline.json')
+    assert read_table('visits', ['start_time'], 'data/timeline_store').num_rows > 0
+
+def test_extract_several_inputs(timeline, workspace):
+    cli.main(['extract', timeline, timeline, '--workers', '1', '--output', 'data/batch.json'])
+    rows = read_table('visits', ['start_time'], 'data/timeline_store').num_rows
+    with open('data/batch.json') as f:
+        assert len(json.load(f)['visits']) == rows
+    cli.main(['extract', timeline])
+    assert read_table('visits', ['start_time'], 'data/timeline_store').num_rows * 2 == rows
+    assert os.path.exists('data/extracted_timeline.json')
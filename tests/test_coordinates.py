@@ -0,0 +1,22 @@
+import numpy as np
+import pyarrow as pa
+from coordinates import parse_latlng_array
+
+def test_parses_timeline_latlng_strings():
+    coords, mask = parse_latlng_array(['51.5007292°, -0.1246254°', ' -33.8568°,151.2153° ', '1e1°, .5°', '2., +3'])
+    assert mask.tolist() == [True] * 4
+    np.testing.assert_array_equal(coords, [[51.5007292, -0.1246254], [-33.8568, 151.2153], [10, 0.5], [2, 3]])
+    assert coords.flags['C_CONTIGUOUS']
+
+def test_malformed_rows_are_nan_without_failing_the_column():
+    values = ['51.5°, -0.12°', '1.2.3°, 4°', '.°, 1°', '1°, 2°, 3°', '°, 1°', 'north, east', '', None, '5°, 6°']
+    coords, mask = parse_latlng_array(values)
+    assert mask.tolist() == [True, False, False, False, False, False, False, False, True]
+    np.testing.assert_array_equal(coords[mask], [[51.5, -0.12], [5, 6]])
+    assert np.isnan(coords[~mask]).all()
+
+def test_accepts_arrow_and_empty_input():
+    coords, mask = parse_latlng_array(pa.array(['1°, 2°', None]))
+    assert mask.tolist() == [True, False]
+    coords, mask = parse_latlng_array([])
+    assert coords.shape == (0, 2) and len(mask) == 0
@@ -0,0 +1,107 @@
+import json
+import os
+import pytest
+from data_extraction import extract_incremental, extract_timeline_data
+from timeline_store import load_manifest, partition_path, read_table, table_paths
+from tests.factories import activity_segment, visit_segment, write_export
+
+def _history():
+    """Two days in January, one in March (partly in another timezone) and an undated visit"""
+    return [
+        visit_segment('2016-01-04T08:00:00+00:00', place_id='home'),
+        activity_segment('2016-01-04T09:00:00+00:00'),
+        visit_segment('2016-01-04T09:20:00+00:00', 480, place_id='work'),
+        visit_segment('2016-01-05T08:00:00+00:00', place_id='home'),
+        visit_segment('2016-03-10T08:00:00+01:00', place_id='abroad'),
+        activity_segment('2016-03-10T09:00:00+01:00', kind='IN_BUS'),
+        visit_segment(None, place_id='undated')
+    ]
+
+def _files(store_dir):
+    contents = {}
+    for name in ('visits', 'activities'):
+        for path in table_paths(name, store_dir):
+            with open(path, 'rb') as f:
+                contents[path] = f.read()
+    return contents
+
+def _rows(store_dir):
+    return {name: read_table(name, store_dir=store_dir).to_pylist() for name in ('visits', 'activities')}
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_incremental_run_after_full_extract_reextracts_nothing(workspace, streaming):
+    timeline = write_export(workspace / 'data' / 'Timeline.json', _history())
+    store_dir = str(workspace / 'store')
+    extract_timeline_data(timeline, str(workspace / 'extracted.json'), streaming=streaming, store_dir=store_dir)
+    manifest = load_manifest(store_dir)
+    assert set(manifest['partitions']) == {'2016-01-04', '2016-01-05', '2016-03-10', 'undated'}
+    assert manifest['watermark'] == '2016-03-10T09:20:00+01:00'
+    files = _files(store_dir)
+
+    metadata = extract_incremental(timeline, store_dir)['metadata']
+    assert (metadata['new_days'], metadata['changed_days'], metadata['removed_days']) == (0, 0, 0)
+    assert _files(store_dir) == files
+    assert load_manifest(store_dir) == manifest
+
+def test_full_extract_and_incremental_write_the_same_manifest(workspace):
+    timeline = write_export(workspace / 'data' / 'Timeline.json', _history())
+    extract_timeline_data(timeline, str(workspace / 'extracted.json'), store_dir=str(workspace / 'full'))
+    extract_incremental(timeline, str(workspace / 'incremental'))
+    assert load_manifest(str(workspace / 'full')) == load_manifest(str(workspace / 'incremental'))
+    assert _rows(str(workspace / 'full')) == _rows(str(workspace / 'incremental'))
+
+def test_changed_day_is_replaced_and_other_months_untouched(workspace):
+    segments = _history()
+    timeline = write_export(workspace / 'data' / 'Timeline.json', segments)
+    store_dir = str(workspace / 'store')
+    extract_timeline_data(timeline, str(workspace / 'extracted.json'), store_dir=store_dir)
+    march = partition_path('visits', '2016-03', store_dir)
+    with open(march, 'rb') as f:
+        march_bytes = f.read()
+
+    segments[2] = visit_segment('2016-01-04T09:20:00+00:00', 300, place_id='office')
+    write_export(timeline, segments)
+    metadata = extract_incremental(timeline, store_dir)['metadata']
+    assert (metadata['new_days'], metadata['changed_days'], metadata['removed_days']) == (0, 1, 0)
+    with open(march, 'rb') as f:
+        assert f.read() == march_bytes
+
+    # The result matches a full extraction of the edited export
+    extract_timeline_data(timeline, str(workspace / 'extracted.json'), store_dir=str(workspace / 'full'))
+    assert _rows(store_dir) == _rows(str(workspace / 'full'))
+    assert 'office' in [row['place_id'] for row in _rows(store_dir)['visits']]
+
+def test_new_removed_and_undated_days(workspace):
+    segments = _history()
+    timeline = write_export(workspace / 'data' / 'Timeline.json', segments)
+    store_dir = str(workspace / 'store')
+    extract_incremental(timeline, store_dir)
+
+    # Drop a day and the undated visit, add a day past the watermark
+    segments = [segment for segment in segments[:-1] if not segment['startTime'].startswith('2016-01-05')]
+    segments.append(visit_segment('2016-04-01T08:00:00+01:00', place_id='later'))
+    write_export(timeline, segments)
+    metadata = extract_incremental(timeline, store_dir)['metadata']
+    assert (metadata['new_days'], metadata['changed_days'], metadata['removed_days']) == (1, 0, 2)
+    assert not os.path.exists(partition_path('visits', 'undated', store_dir))
+    assert metadata['total_visits'] == len(_rows(store_dir)['visits']) == 4
+
+def test_extracted_json_matches_between_modes(workspace):
+    timeline = write_export(workspace / 'data' / 'Timeline.json', _history())
+    extract_timeline_data(timeline, str(workspace / 'a.json'), store_dir=None)
+    extract_timeline_data(timeline, str(workspace / 'b.json'), streaming=True, store_dir=None)
+    with open(workspace / 'a.json') as a, open(workspace / 'b.json') as b:
+        full, streamed = json.load(a), json.load(b)
+    assert full['visits'] == streamed['visits']
+    assert full['activities'] == streamed['activities']
+    assert not os.path.exists(workspace / 'data' / 'timeline_store')
+
+def test_malformed_location_does_not_abort_extraction(workspace):
+    segments = _history()
+    segments.insert(1, visit_segment('2016-01-04T08:30:00+00:00', 10, place_id='bad', location='1.2.3°, 4°'))
+    timeline = write_export(workspace / 'data' / 'Timeline.json', segments)
+    store_dir = str(workspace / 'store')
+    extract_timeline_data(timeline, str(workspace / 'extracted.json'), store_dir=store_dir)
+    visits = {row['place_id']: row for row in _rows(store_dir)['visits']}
+    assert visits['bad']['lat'] is None
+    assert visits['work']['lat'] == 51.5
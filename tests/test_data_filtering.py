@@ -0,0 +1,75 @@
+import io
+import json
+import pytest
+from data_filtering import (PROJECTIONS, compile_projection, filter_place_details_minimal,
+                            filter_place_details_temporal, filter_places, iter_places, project_place)
+
+def _place(i, **original):
+    return {
+        'original_data': {'placeId': f'place-{i}', 'location': {'lat': i, 'lng': -i}, **original},
+        'google_details': {
+            'name': f'Place {i}',
+            'geometry': {'location': {'lat': i, 'lng': -i}, 'viewport': {'northeast': {}}},
+            'types': ['cafe'],
+            'rating': 4.5,
+            'price_level': 2,
+            'reviews': [{'text': 'dropped'}]
+        }
+    }
+
+def test_minimal_projection_keeps_nested_location_only():
+    assert filter_place_details_minimal(_place(1, timestamp='2024-01-01')) == {
+        'original_data': {'placeId': 'place-1', 'location': {'lat': 1, 'lng': -1}},
+        'google_details': {'name': 'Place 1', 'geometry': {'location': {'lat': 1, 'lng': -1}},
+                           'types': ['cafe'], 'rating': 4.5, 'price_level': 2}
+    }
+
+def test_temporal_projection_keeps_time_fields():
+    projected = filter_place_details_temporal(_place(2, timestamp='2024-01-01', duration=60))
+    assert projected['original_data'] == {
+        'placeId': 'place-2', 'location': {'lat': 2, 'lng': -2}, 'timestamp': '2024-01-01',
+        'duration': 60, 'visitTime': None, 'lastVisitTime': None, 'timeSpent': None,
+        'visitStartTime': None, 'visitEndTime': None
+    }
+    assert 'price_level' not in projected['google_details']
+
+def test_missing_fields_take_their_defaults():
+    compiled = compile_projection(PROJECTIONS['minimal'])
+    assert project_place({'original_data': {}, 'google_details': {'geometry': 'unexpected'}}, compiled) == {
+        'original_data': {'placeId': None, 'location': None},
+        'google_details': {'name': None, 'geometry': {'location': {}}, 'types': None,
+                           'rating': None, 'price_level': None}
+    }
+    assert project_place({}, compiled)['google_details']['geometry'] == {'location': {}}
+
+@pytest.mark.parametrize('metadata_first', [True, False])
+def test_iter_places_finds_metadata_anywhere(metadata_first):
+    places = [_place(i) for i in range(5)]
+    metadata = {'filtered_date': '2024-02-01'}
+    document = {'metadata': metadata, 'places': places} if metadata_first else {'places': places, 'metadata': metadata}
+    items = list(iter_places(io.BytesIO(json.dumps(document).encode()), chunk_size=64))
+    assert [value for kind, value in items if kind == 'place'] == places
+    assert [value for kind, value in items if kind == 'metadata'] == [metadata]
+
+def test_filter_places_writes_every_projection_in_one_pass(workspace):
+    places = [_place(i, timestamp=f'2024-01-0{i + 1}') for i in range(3)]
+    with open(workspace / 'detailed.json', 'w') as f:
+        json.dump({'metadata': {'filtered_date': '2024-02-01', 'other': 1}, 'places': places}, f)
+    projections = {name: {**projection, 'output': str(workspace / f'{name}.json')}
+                   for name, projection in PROJECTIONS.items()}
+
+    metadata = filter_places(str(workspace / 'detailed.json'), projections)
+    assert metadata == {'total_places': 3, 'filtered_date': '2024-02-01'}
+    for name, project in (('minimal', filter_place_details_minimal), ('temporal', filter_place_details_temporal)):
+        with open(projections[name]['output']) as f:
+            assert json.load(f) == {'places': [project(place) for place in places], 'metadata': metadata}
+
+def test_filter_places_without_places_or_metadata(workspace):
+    with open(workspace / 'detailed.json', 'w') as f:
+        json.dump({'places': []}, f)
+    output = str(workspace / 'minimal.json')
+    projections = {'minimal': {**PROJECTIONS['minimal'], 'output': output}}
+    metadata = filter_places(str(workspace / 'detailed.json'), projections)
+    assert metadata == {'total_places': 0, 'filtered_date': None}
+    with open(output) as f:
+        assert json.load(f) == {'places': [], 'metadata': metadata}
@@ -0,0 +1,63 @@
+import json
+import pytest
+from explore_data_structure import check_input, profile_timeline, validate_report, _window_segments
+from tests.factories import activity_segment, visit_segment, write_export
+
+def test_profile_counts_kinds_and_fields(workspace):
+    path = write_export(workspace / 'Timeline.json', [
+        visit_segment('2016-01-04T08:00:00+01:00', lat=51.5, lng=-0.12),
+        visit_segment('2016-01-05T08:00:00+00:00', lat=48.85, lng=2.35, semantic_type='UNKNOWN'),
+        activity_segment('2016-01-04T09:00:00+00:00'),
+        {'startTime': '2016-01-04T09:00:00+00:00', 'timelinePath': [{'point': '51.5°, -0.12°'}]}
+    ])
+    report = profile_timeline(path)
+    assert not report['sampled'] and report['segments'] == 4
+    assert {kind: entry['count'] for kind, entry in report['kinds'].items()} == \
+        {'visit': 2, 'activity': 1, 'timelinePath': 1}
+    assert report['unexpected_kinds'] == {'timelinePath': 1}
+
+    fields = report['kinds']['visit']['fields']
+    location = fields['visit.topCandidate.placeLocation.latLng']
+    assert (location['lat_range'], location['lng_range']) == ([48.85, 51.5], [-0.12, 2.35])
+    assert fields['visit.topCandidate.semanticType']['values'] == {'INFERRED_HOME': 1, 'UNKNOWN': 1}
+    assert fields['startTime']['min'] == '2016-01-04T08:00:00+01:00'
+    offsets = fields['startTimeTimezoneUtcOffsetMinutes']
+    assert (offsets['min'], offsets['max'], offsets['types']) == (0, 60, {'number': 2})
+    assert report['kinds']['timelinePath']['fields']['timelinePath[].point']['missing_rate'] is None
+
+    assert validate_report(report) == [('warning', '1 timelinePath segments are not extracted')]
+
+def test_bad_timestamps_fail_validation(workspace):
+    broken = visit_segment('2016-01-04T08:00:00+00:00')
+    broken['startTime'] = '4 January 2016'
+    unlocated = visit_segment('2016-01-05T08:00:00+00:00', location='somewhere')
+    path = write_export(workspace / 'Timeline.json', [broken, unlocated])
+    with pytest.raises(ValueError, match='startTime has 1 unparseable values'):
+        check_input(path, str(workspace / 'report.json'))
+    with open(workspace / 'report.json') as f:
+        problems = json.load(f)['problems']
+    assert {'level': 'warning', 'message': 'visit: visit.topCandidate.placeLocation.latLng has 1 unparseable values'} \
+        in problems
+
+def test_empty_export_fails_validation(workspace):
+    path = write_export(workspace / 'Timeline.json', [])
+    with pytest.raises(ValueError, match='no semanticSegments found'):
+        check_input(path)
+
+def test_sampled_profile_estimates_the_whole_file(timeline):
+    full = profile_timeline(timeline)
+    sampled = profile_timeline(timeline, full=False, windows=8, window_bytes=8 << 10)
+    assert sampled['sampled'] and sampled['scanned_bytes'] < sampled['bytes']
+    assert sampled['scanned_segments'] < full['segments']
+    assert sampled['segments'] == pytest.approx(full['segments'], rel=0.25)
+    assert set(sampled['kinds']) <= set(full['kinds'])
+    assert not [problem for problem in validate_report(sampled) if problem[0] == 'error']
+
+def test_windows_skip_the_segment_they_start_in():
+    # Exports list the times before the payload, which is what windows look for
+    segments = [visit_segment('2016-01-04T08:00:00+00:00', place_id='a'),
+                visit_segment('2016-01-05T08:00:00+00:00', place_id='b')]
+    segments = [{'startTime': segment.pop('startTime'), **segment} for segment in segments]
+    text = json.dumps({'semanticSegments': segments})
+    window = text[text.index('"startTime"') + 5:]
+    assert [segment['visit']['topCandidate']['placeId'] for segment in _window_segments(window)] == ['b']
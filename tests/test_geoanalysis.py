@@ -0,0 +1,57 @@
+import os
+import pytest
+import timeline_store
+from data_extraction import extract_timeline_data
+from geoanalysis import analyze_locations
+from timeline_store import STORE_DIR
+from tests.factories import activity_segment, visit_segment, write_export
+
+def test_full_detail_map_draws_visits_without_an_end_time(workspace):
+    open_visit = visit_segment('2016-01-05T08:00:00+00:00', place_id='open')
+    del open_visit['endTime']
+    timeline = write_export(workspace / 'data' / 'Timeline.json', [
+        visit_segment('2016-01-04T08:00:00+00:00', place_id='home'),
+        activity_segment('2016-01-04T09:00:00+00:00'),
+        open_visit
+    ])
+    extract_timeline_data(timeline, str(workspace / 'data' / 'extracted_timeline.json'),
+                          store_dir=str(workspace / 'data' / 'timeline_store'))
+
+    stats = analyze_locations(max_features=None, max_html_bytes=None)
+    assert stats['visits']['total_locations'] == 2
+    with open(os.path.join('output', 'location_analysis.html'), encoding='utf-8') as f:
+        assert 'None - 2016-01-05' in f.read()
+
+def test_map_is_uncapped_and_reads_the_store_once(store, monkeypatch):
+    import geoanalysis
+    import movement_metrics
+    import place_clustering
+    loads = []
+
+    def load_segments(name, columns=None, store_dir=STORE_DIR):
+        loads.append(name)
+        return timeline_store.load_segments(name, columns, store_dir)
+    for module in (geoanalysis, movement_metrics, place_clustering):
+        monkeypatch.setattr(module, 'load_segments', load_segments)
+
+    stats = analyze_locations()
+    assert sorted(loads) == ['activities', 'visits']
+    assert stats['map']['max_features'] is None and 'visits_left_out' not in stats['map']
+    assert stats['map']['markers'] == stats['visits']['total_locations']
+    assert stats['visits']['frequent_places'] == len(place_clustering.frequent_places()['places'])
+    assert stats['activities']['movement'] == movement_metrics.summarize_movements()
+
+def test_budget_logs_what_it_leaves_out(store, capsys):
+    stats = analyze_locations(max_features=6)
+    assert stats['map']['visits_left_out'] > 0
+    assert f"left out {stats['map']['visits_left_out']} visits" in capsys.readouterr().err
+
+@pytest.mark.parametrize('argv, max_features', [([], None), (['--max-features', '0'], None),
+                                                 (['--max-features', '50'], 50)])
+def test_cli_opts_in_to_a_budget(monkeypatch, argv, max_features):
+    import cli
+    import geoanalysis
+    calls = []
+    monkeypatch.setattr(geoanalysis, 'analyze_locations', lambda **options: calls.append(options))
+    cli.main(['geo', *argv])
+    assert calls == [{'max_features': max_features, 'max_html_bytes': None}]
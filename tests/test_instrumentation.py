@@ -0,0 +1,79 @@
+import collections
+import json
+import os
+import tracemalloc
+import pytest
+import instrumentation
+from instrumentation import mark, prometheus_text, recent_runs, snapshot, stage, write_run_report
+
+@pytest.fixture(autouse=True)
+def fresh_metrics(monkeypatch):
+    monkeypatch.setattr(instrumentation, '_totals', {})
+    monkeypatch.setattr(instrumentation, '_recent', collections.deque(maxlen=instrumentation.RECENT_RUNS))
+
+def test_stage_records_counts_bytes_and_errors(tmp_path):
+    path = tmp_path / 'out.txt'
+    path.write_text('x' * 100)
+    for _ in range(2):
+        with stage('extract') as metrics:
+            metrics.count('visits', 3)
+            metrics.read(10)
+            metrics.wrote_file(str(path))
+            metrics.read_file(str(tmp_path / 'missing'))
+    with pytest.raises(ValueError):
+        with stage('extract'):
+            raise ValueError
+
+    total = snapshot()['stages']['extract']
+    assert (total['runs'], total['errors']) == (3, 1)
+    assert (total['bytes_read'], total['bytes_written'], total['counts']) == (20, 200, {'visits': 6})
+    assert total['max_seconds'] >= total['last_seconds'] >= 0
+    assert [run['error'] for run in recent_runs()] == [None, None, 'ValueError']
+
+def test_nested_stages_share_their_python_peak():
+    tracemalloc.start()
+    try:
+        with stage('outer'):
+            with stage('outer.inner'):
+                block = bytearray(8 << 20)
+                del block
+            with stage('outer.small'):
+                pass
+    finally:
+        tracemalloc.stop()
+    peaks = {run['stage']: run['python_peak_mb'] for run in recent_runs()}
+    assert peaks['outer.inner'] >= 8 and peaks['outer'] >= peaks['outer.inner']
+    assert peaks['outer.small'] < 1
+
+def test_profiled_stages_dump_their_stats(workspace, monkeypatch):
+    monkeypatch.setenv(instrumentation.PROFILE_ENV, 'geo.render, other')
+    with stage('geo.render'):
+        sum(range(1000))
+    with stage('geo.load'):
+        pass
+    profiled = {run['stage']: run.get('profile') for run in recent_runs()}
+    assert profiled['geo.load'] is None
+    assert os.path.exists(profiled['geo.render'])
+
+def test_run_report_lists_the_runs_since_a_mark(workspace):
+    with stage('before'):
+        pass
+    since = mark()
+    with stage('geo'):
+        with stage('geo.render'):
+            pass
+    report = write_run_report(since, trigger='test')
+    assert [run['stage'] for run in report['stages']] == ['geo.render', 'geo']
+    assert report['seconds'] == report['stages'][1]['seconds']
+    assert report['trigger'] == 'test'
+    with open(instrumentation.REPORT_FILE) as f:
+        assert json.load(f) == report
+
+def test_prometheus_text():
+    instrumentation.record('http.index', 0.5, counts={'status_200': 2}, bytes_written=10, keep=False)
+    text = prometheus_text()
+    assert 'timeline_stage_runs_total{stage="http.index"} 1\n' in text
+    assert 'timeline_stage_written_bytes_total{stage="http.index"} 10\n' in text
+    assert 'timeline_stage_records_total{stage="http.index",kind="status_200"} 2\n' in text
+    assert '# TYPE timeline_stage_max_seconds gauge\n' in text
+    assert recent_runs() == []
@@ -0,0 +1,147 @@
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+import pytest
+import jobs
+import pipeline
+from data_extraction import extract_incremental, merge_store
+from timeline_store import STORE_DIR, load_manifest, read_table
+from tests.factories import visit_segment, write_export
+
+@pytest.fixture
+def pipeline_runs(monkeypatch):
+    runs = []
+    monkeypatch.setattr(pipeline, 'run_pipeline', lambda *args, **kwargs: runs.append(kwargs))
+    return runs
+
+def _upload(segments):
+    job_id, path = jobs.create_job()
+    write_export(path, segments)
+    return job_id
+
+def _place_ids(store_dir=STORE_DIR):
+    return sorted(read_table('visits', ['place_id'], store_dir).column('place_id').to_pylist())
+
+def test_run_job_extracts_into_the_job_store(workspace):
+    write_export(pipeline.TIMELINE_FILE, [visit_segment('2015-01-01T08:00:00+00:00')])
+    with open(pipeline.TIMELINE_FILE, 'rb') as f:
+        live = f.read()
+    job_id = _upload([visit_segment('2016-01-01T08:00:00+00:00'), visit_segment('2016-01-02T08:00:00+00:00')])
+
+    metadata = jobs.run_job(jobs.job_dir(job_id))
+
+    assert metadata['total_visits'] == 2
+    assert _place_ids(os.path.join(jobs.job_dir(job_id), jobs.JOB_STORE_DIR)) == ['home', 'home']
+    assert sorted(os.listdir(jobs.job_dir(job_id))) == [jobs.PROGRESS_FILE, jobs.JOB_STORE_DIR]
+    with open(pipeline.TIMELINE_FILE, 'rb') as f:
+        assert f.read() == live
+    assert not os.path.exists(STORE_DIR)
+
+def test_failed_job_leaves_the_store_alone(workspace):
+    job_id, path = jobs.create_job()
+    with open(path, 'w') as f:
+        f.write('{"semanticSegments": [{"startTime": ')
+
+    with pytest.raises(Exception):
+        jobs.run_job(jobs.job_dir(job_id))
+    assert not os.path.exists(STORE_DIR)
+
+def test_merged_uploads_all_reach_the_store(workspace, pipeline_runs):
+    first = _upload([visit_segment('2016-01-01T08:00:00+00:00', place_id='a'),
+                     visit_segment('2016-01-02T08:00:00+00:00', place_id='b')])
+    second = _upload([visit_segment('2016-01-02T09:00:00+00:00', place_id='c'),
+                      visit_segment('2016-02-01T08:00:00+00:00', place_id='d')])
+    for job_id in (first, second):
+        jobs.run_job(jobs.job_dir(job_id))
+    for job_id in (second, first):
+        jobs.merge_job(jobs.job_dir(job_id))
+
+    # The later merge owns the day both uploads hold
+    assert _place_ids() == ['a', 'b', 'd']
+    assert set(load_manifest()['partitions']) == {'2016-01-01', '2016-01-02', '2016-02-01'}
+    assert len(pipeline_runs) == 2
+    assert sorted(os.listdir(jobs.job_dir(first))) == [jobs.PROGRESS_FILE]
+
+def test_merged_upload_rebuilds_the_outputs(timeline, workspace):
+    # No live Timeline.json: the upload is all there is to build from
+    job_id, path = jobs.create_job()
+    os.replace(timeline, path)
+    jobs.run_job(jobs.job_dir(job_id))
+    jobs.merge_job(jobs.job_dir(job_id))
+
+    assert len(_place_ids()) > 0
+    with open(os.path.join('output', 'temporal_statistics.json')) as f:
+        assert json.load(f)
+    assert os.path.exists(os.path.join(STORE_DIR, 'routes', 'od.arrow'))
+    assert pipeline.ensure_fresh() == []
+
+def test_incremental_extract_keeps_merged_days(workspace):
+    write_export(pipeline.TIMELINE_FILE, [visit_segment('2016-01-01T08:00:00+00:00', place_id='a')])
+    extract_incremental(pipeline.TIMELINE_FILE)
+    job_id = _upload([visit_segment('2016-01-05T08:00:00+00:00', place_id='uploaded')])
+    jobs.run_job(jobs.job_dir(job_id))
+    merge_store(os.path.join(jobs.job_dir(job_id), jobs.JOB_STORE_DIR))
+
+    write_export(pipeline.TIMELINE_FILE, [visit_segment('2016-01-01T08:00:00+00:00', place_id='a2')])
+    metadata = extract_incremental(pipeline.TIMELINE_FILE)['metadata']
+    assert metadata['removed_days'] == 0
+    assert _place_ids() == ['a2', 'uploaded']
+
+def _extract(job_id, result=None, error=None):
+    jobs._jobs[job_id] = {'state': 'queued', 'created': 0, 'bytes_total': 1}
+    future = Future()
+    if error is None:
+        future.set_result(result)
+    else:
+        future.set_exception(error)
+    jobs._extracted(job_id, future)
+
+def test_job_is_done_once_merged(workspace, monkeypatch):
+    merged = threading.Event()
+    release = threading.Event()
+
+    def merge_job(directory):
+        merged.set()
+        release.wait(5)
+    monkeypatch.setattr(jobs, 'merge_job', merge_job)
+
+    _extract('ok', result={'total_segments': 1})
+    assert merged.wait(5)
+    assert jobs.job_status('ok')['state'] == 'merging'
+    release.set()
+    for _ in range(500):
+        if jobs._jobs['ok']['state'] != 'merging':
+            break
+        time.sleep(0.01)
+    job = jobs._jobs.pop('ok')
+    assert job['state'] == 'done' and job['result'] == {'total_segments': 1}
+
+def test_failed_extraction_is_not_merged(workspace, monkeypatch):
+    monkeypatch.setattr(jobs, 'merge_job', lambda directory: pytest.fail('merged'))
+    _extract('bad', error=ValueError('broken export'))
+    job = jobs._jobs.pop('bad')
+    assert job['state'] == 'failed' and 'broken export' in job['error']
+
+def test_upload_is_queued(client, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(jobs, 'submit_job', submitted.append)
+    response = client.post('/api/process-timeline',
+                           data={'file': (io.BytesIO(b'{"semanticSegments": []}'), 'Timeline.json')})
+    assert response.status_code == 202
+    assert submitted == [response.get_json()['job_id']]
+    with open(os.path.join(jobs.job_dir(submitted[0]), jobs.UPLOAD_FILE), 'rb') as f:
+        assert f.read() == b'{"semanticSegments": []}'
+
+def test_rejected_multipart_upload_leaves_no_job(client, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(jobs, 'submit_job', submitted.append)
+    monkeypatch.setitem(client.application.config, 'MAX_FORM_PARTS', 1)
+    response = client.post('/api/process-timeline',
+                           data={'file': (io.BytesIO(b'{"semanticSegments": []}'), 'Timeline.json'),
+                                 'other': (io.BytesIO(b'{}'), 'other.json')})
+    assert response.status_code == 413
+    assert submitted == []
+    assert os.listdir(jobs.UPLOAD_DIR) == []
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from data_extraction import parse_segment
+from movement_metrics import MOVEMENT_COLUMNS, haversine_m, movement_metrics, summarize_movements
+from segments import Activities
+from timeline_store import load_segments
+from tests.factories import activity_segment
+
+# One degree of longitude along the equator
+DEGREE_M = haversine_m(0, 0, 0, 1)
+
+def _activities(*segments):
+    return Activities.from_records([parse_segment(segment)[1] for segment in segments])
+
+def test_haversine():
+    assert DEGREE_M == pytest.approx(111_195, abs=1)
+    np.testing.assert_allclose(haversine_m([51.5, 0], [-0.12, 0], [51.5, 0], [-0.12, 180]),
+                               [0, np.pi * 6_371_008.8])
+
+def test_metrics_of_each_activity():
+    metrics = movement_metrics(_activities(
+        activity_segment('2016-01-04T09:00:00+00:00', 60, (0, 0), (0, 1), 'CYCLING', 2 * DEGREE_M),
+        activity_segment('2016-01-04T11:00:00+00:00', 30, (0, 0), (0, 0), 'WALKING', 0.0),
+        activity_segment('2016-01-04T12:00:00+00:00', 0, (0, 0), (0, 1), 'WALKING', 1000.0)))
+    np.testing.assert_allclose(metrics['great_circle_m'], [DEGREE_M, 0, DEGREE_M])
+    np.testing.assert_allclose(metrics['straightness'], [0.5, np.nan, DEGREE_M / 1000])
+    np.testing.assert_allclose(metrics['duration_s'], [3600, 1800, 0])
+    np.testing.assert_allclose(metrics['speed_kmh'], [2 * DEGREE_M / 1000, 0, np.nan])
+    assert [metrics['names'][code] for code in metrics['codes']] == ['CYCLING', 'WALKING', 'WALKING']
+
+def test_summary_weighs_speed_by_time():
+    summary = summarize_movements(movement_metrics(_activities(
+        activity_segment('2016-01-04T09:00:00+00:00', 60, (0, 0), (0, 1), 'CYCLING', 20_000.0),
+        activity_segment('2016-01-04T11:00:00+00:00', 30, (0, 0), (0, 0), 'WALKING', 2000.0),
+        activity_segment('2016-01-04T12:00:00+00:00', 90, (0, 0), (0, 0), 'WALKING', 4000.0))))
+    assert summary['count'] == 3
+    assert summary['distance_km'] == 26.0
+    assert summary['avg_speed_kmh'] == round(26 / 3, 3)
+    assert summary['by_type']['WALKING'] == {
+        'count': 2, 'distance_km': 6.0, 'great_circle_km': 0.0, 'avg_speed_kmh': 3.0, 'mean_straightness': 0.0
+    }
+    assert summary['by_type']['CYCLING']['mean_straightness'] == round(DEGREE_M / 20_000, 3)
+
+def test_summary_of_the_store_matches_a_loop(store):
+    activities = load_segments('activities', MOVEMENT_COLUMNS, store)
+    metrics = movement_metrics(activities)
+    summary = summarize_movements(metrics)
+    types = activities.decode('type')
+    assert summary['count'] == len(activities)
+    for name, expected in summary['by_type'].items():
+        rows = [i for i, value in enumerate(types) if value == name]
+        assert expected['count'] == len(rows)
+        assert expected['distance_km'] == pytest.approx(np.nansum(metrics['distance_m'][rows]) / 1000, abs=1e-3)
+    assert sum(group['count'] for group in summary['by_type'].values()) == len(activities)
+
+def test_empty_history():
+    summary = summarize_movements(movement_metrics(Activities.empty(MOVEMENT_COLUMNS)))
+    assert summary == {'count': 0, 'distance_km': 0.0, 'great_circle_km': 0.0, 'avg_speed_kmh': None,
+                       'mean_straightness': None, 'by_type': {}}
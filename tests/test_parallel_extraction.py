@@ -0,0 +1,50 @@
+import json
+import pytest
+from data_extraction import extract_incremental, extract_timeline_data
+from parallel_extraction import extract_timeline_batch
+from synthetic_timeline import write_timeline
+from timeline_store import load_manifest, read_table
+
+COUNTS = ['total_segments', 'total_visits', 'total_activities']
+
+def _rows(store_dir):
+    return {name: read_table(name, store_dir=store_dir).to_pylist() for name in ('visits', 'activities')}
+
+def _load(path):
+    with open(path) as f:
+        return json.load(f)
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_batch_matches_a_serial_run(timeline, workspace, workers):
+    serial = extract_timeline_data(timeline, str(workspace / 'serial.json'), store_dir=str(workspace / 'serial'))
+    batch = extract_timeline_batch(timeline, str(workspace / 'batch.json'), str(workspace / 'batch'),
+                                   workers=workers, shard_bytes=16 << 10)
+
+    assert batch['metadata']['shards'] > 1
+    assert {key: batch['metadata'][key] for key in COUNTS} == {key: serial['metadata'][key] for key in COUNTS}
+    assert _rows(str(workspace / 'batch')) == _rows(str(workspace / 'serial'))
+    batch_json, serial_json = _load(workspace / 'batch.json'), _load(workspace / 'serial.json')
+    assert batch_json['visits'] == serial_json['visits']
+    assert batch_json['activities'] == serial_json['activities']
+
+    # Days split across shards hash as in one pass, so nothing is re-extracted
+    manifest = load_manifest(str(workspace / 'batch'))
+    assert manifest.pop('inputs') == [timeline]
+    assert manifest == load_manifest(str(workspace / 'serial'))
+    metadata = extract_incremental(timeline, str(workspace / 'batch'))['metadata']
+    assert (metadata['new_days'], metadata['changed_days'], metadata['removed_days']) == (0, 0, 0)
+
+def test_incremental_extract_keeps_a_batch_of_several_exports(timeline, workspace):
+    other = write_timeline(str(workspace / 'data' / 'other.json'), 300, seed=5)
+    store_dir = str(workspace / 'batch')
+    batch = extract_timeline_batch([timeline, other], str(workspace / 'batch.json'), store_dir, workers=2)
+    serial = [extract_timeline_data(path, str(workspace / 'serial.json'), store_dir=None)['metadata']
+              for path in (timeline, other)]
+    for key in COUNTS:
+        assert batch['metadata'][key] == sum(metadata[key] for metadata in serial)
+    rows = _rows(store_dir)
+
+    metadata = extract_incremental(timeline, store_dir)['metadata']
+    assert metadata['total_segments'] == batch['metadata']['total_segments']
+    assert metadata['removed_days'] == 0
+    assert _rows(store_dir) == rows
@@ -0,0 +1,30 @@
+import os
+import pytest
+import pipeline
+
+@pytest.fixture
+def quick_pipeline(timeline, monkeypatch):
+    """The pipeline with stages that build nothing"""
+    monkeypatch.setattr(pipeline, '_run_stage', lambda name: None)
+    return timeline
+
+def test_outputs_version_follows_pipeline_runs_without_file_access(quick_pipeline, monkeypatch):
+    assert pipeline.outputs_version() is None
+    pipeline.run_pipeline()
+    first = pipeline.outputs_version()
+    assert first is not None
+
+    with monkeypatch.context() as patch:
+        patch.setattr(os, 'stat', None)
+        patch.setattr(pipeline, 'load_manifest', None)
+        assert pipeline.outputs_version() == first
+
+    with open(quick_pipeline, 'a') as f:
+        f.write('\n')
+    pipeline.run_pipeline()
+    second = pipeline.outputs_version()
+    assert second != first
+
+    # A new process reads the version of the last run from the manifest
+    monkeypatch.setattr(pipeline, '_outputs_version', pipeline._UNKNOWN)
+    assert pipeline.outputs_version() == second
@@ -0,0 +1,77 @@
+import os
+import numpy as np
+import pytest
+import place_clustering
+from data_extraction import parse_segment
+from place_clustering import cache_dir, cluster_points, compute_frequent_places, frequent_places, visit_places
+from segments import Visits
+from timeline_store import write_store
+from tests.factories import visit_segment
+
+def _visits(*segments):
+    return Visits.from_records([parse_segment(segment)[1] for segment in segments])
+
+def _around(lat, lng, count, spread_m=20, seed=0):
+    """count points scattered within spread_m of (lat, lng)"""
+    offsets = np.random.default_rng(seed).uniform(-1, 1, (count, 2)) * spread_m / 111_195
+    return lat + offsets[:, 0], lng + offsets[:, 1] / np.cos(np.radians(lat))
+
+def test_separate_places_get_separate_labels():
+    home = _around(51.5, -0.12, 30)
+    work = _around(51.52, -0.08, 10, seed=1)
+    # Too few visits to count as a place, and nowhere near the others
+    elsewhere = _around(48.85, 2.35, 2, seed=2)
+    lat, lng = (np.concatenate(parts) for parts in zip(home, work, elsewhere))
+
+    labels = cluster_points(lat, lng)
+    assert len(set(labels[:30])) == len(set(labels[30:40])) == 1
+    assert labels[0] != labels[30] and min(labels[:40]) >= 0
+    assert labels[40:].tolist() == [-1, -1]
+    assert len(cluster_points(np.empty(0), np.empty(0))) == 0
+
+def test_visits_chain_into_one_place_within_eps():
+    # A street of visits 60 m apart: each is within eps of the next
+    lng = -0.12 + np.arange(10) * 60 / (111_195 * np.cos(np.radians(51.5)))
+    assert set(cluster_points(np.full(10, 51.5), lng, eps_m=100, min_visits=2).tolist()) == {0}
+    assert set(cluster_points(np.full(10, 51.5), lng, eps_m=40, min_visits=2).tolist()) == {-1}
+
+def test_places_are_weighted_by_dwell_time():
+    result = compute_frequent_places(_visits(
+        visit_segment('2016-01-04T20:00:00+00:00', 600, 51.5, -0.12, 'a', 'INFERRED_HOME'),
+        visit_segment('2016-01-05T20:00:00+00:00', 600, 51.5, -0.12, 'a', 'INFERRED_HOME'),
+        visit_segment('2016-01-06T12:00:00+00:00', 60, 51.5003, -0.12, 'b', 'UNKNOWN'),
+        visit_segment('2016-01-07T09:00:00+00:00', 30, 51.52, -0.08, 'c', 'INFERRED_WORK'),
+        visit_segment(None, place_id='d', location='unknown')))
+    assert (result['located_visits'], result['clustered_visits']) == (4, 3)
+    [place] = result['places']
+    assert (place['visits'], place['place_ids'], place['semantic_type']) == (3, 2, 'INFERRED_HOME')
+    assert place['dwell_hours'] == 21.0
+    assert place['lat'] == pytest.approx(51.5 + 0.0003 / 21, abs=1e-6)
+    assert place['radius_m'] == pytest.approx(0.0003 * 20 / 21 * 111_195, abs=0.1)
+    assert place['first_visit'] == 1451937600000 and place['last_visit'] == 1452085200000
+
+def test_frequent_places_are_cached_per_store_version(store, monkeypatch):
+    first = frequent_places(store_dir=store)
+    assert first['places'] and first['version']
+    labels = visit_places(store_dir=store)
+    assert (labels >= 0).sum() == first['clustered_visits']
+    assert sorted(os.listdir(cache_dir(store))) == [f"{first['version']}.json", f"{first['version']}.labels.npy"]
+
+    # Read back from memory, then from disk, without clustering again
+    def fail(*args):
+        raise AssertionError('clustered again')
+    monkeypatch.setattr(place_clustering, '_cluster_visits', fail)
+    assert frequent_places(store_dir=store) is first
+    monkeypatch.setattr(place_clustering, '_loaded', type(place_clustering._loaded)())
+    assert frequent_places(store_dir=store) == first
+    np.testing.assert_array_equal(visit_places(store_dir=store), labels)
+    monkeypatch.undo()
+
+    other = frequent_places(eps_m=50, store_dir=store)
+    assert other['version'] != first['version'] and other['eps_m'] == 50
+
+def test_frequent_places_of_an_empty_store(tmp_path):
+    write_store([], [], str(tmp_path))
+    result = frequent_places(store_dir=str(tmp_path))
+    assert (result['located_visits'], result['places']) == (0, [])
+    assert len(visit_places(store_dir=str(tmp_path))) == 0
@@ -0,0 +1,56 @@
+import json
+import sqlite3
+import time
+from urllib.request import urlopen
+import pytest
+from fake_places_server import fake_details, serve_in_thread
+from place_enrichment import GoogleMapsBackend, enrich_places, visited_places
+
+@pytest.fixture
+def places_server():
+    server, base_url = serve_in_thread()
+    yield base_url
+    server.shutdown()
+    server.server_close()
+
+def _requests(base_url):
+    with urlopen(f'{base_url}/stats') as response:
+        return json.load(response)['requests']
+
+def _enrich(base_url, workspace, ttl_days=30):
+    return enrich_places(GoogleMapsBackend('AIza-fake', base_url), str(workspace / 'places.json'),
+                         str(workspace / 'cache.sqlite'), ttl_days=ttl_days, rate=0)
+
+def test_rerun_on_unchanged_history_makes_no_requests(store, workspace, places_server):
+    places = len(visited_places(store))
+    first = _enrich(places_server, workspace)
+    assert first['fetched'] == places > 0
+    assert _requests(places_server) == places
+
+    second = _enrich(places_server, workspace)
+    assert (second['cached'], second['fetched']) == (places, 0)
+    assert _requests(places_server) == places
+
+    with open(workspace / 'places.json') as f:
+        place = json.load(f)['places'][0]
+    assert place['google_details']['name'] == fake_details(place['original_data']['placeId'])['name']
+
+def test_expired_entries_are_fetched_again(store, workspace, places_server):
+    places = len(visited_places(store))
+    _enrich(places_server, workspace)
+
+    # Age two entries past the TTL
+    with sqlite3.connect(workspace / 'cache.sqlite') as connection:
+        connection.execute('UPDATE place_details SET fetched_at = ? WHERE place_id IN '
+                           '(SELECT place_id FROM place_details ORDER BY place_id LIMIT 2)',
+                           (time.time() - 31 * 86400,))
+    connection.close()
+
+    metadata = _enrich(places_server, workspace)
+    assert (metadata['evicted'], metadata['fetched'], metadata['cached']) == (2, 2, places - 2)
+    assert _requests(places_server) == places + 2
+
+    # A shorter TTL expires everything fetched before it
+    time.sleep(0.01)
+    metadata = _enrich(places_server, workspace, ttl_days=0)
+    assert metadata['fetched'] == places
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+import place_clustering
+from place_clustering import cluster_points, frequent_places, visit_places
+from rollups import RollupCube, build_rollups, day_number
+from timeline_store import load_segments
+
+def test_visit_places_match_a_fresh_clustering(store):
+    labels = visit_places(store_dir=store)
+    visits = load_segments('visits', ['lat', 'lng'], store)
+    located = ~np.isnan(visits.lat) & ~np.isnan(visits.lng)
+    assert len(labels) == len(visits)
+    np.testing.assert_array_equal(labels[located], cluster_points(visits.lat[located], visits.lng[located]))
+    assert (labels[~located] == -1).all()
+
+def test_rollups_reuse_the_cached_clustering(store, monkeypatch):
+    places = frequent_places(store_dir=store)
+
+    def cluster_again(*args, **kwargs):
+        raise AssertionError('visits clustered again')
+    monkeypatch.setattr(place_clustering, 'cluster_points', cluster_again)
+    build_rollups(store)
+
+    by_place = RollupCube('visits', store).query(by=['place'])
+    counts = dict(zip(by_place['labels']['place'], by_place['count']))
+    assert {place['id']: place['visits'] for place in places['places']} == \
+        {place: count for place, count in counts.items() if place is not None}
+
+def test_cube_queries_match_the_segments(store):
+    build_rollups(store)
+    cube = RollupCube('activities', store)
+    activities = load_segments('activities', ['start_time', 'type'], store)
+    assert cube.query()['count'] == len(activities)
+    by_type = cube.query(by=['type'])
+    assert sum(by_type['count']) == len(activities)
+    walking = cube.query(types=['WALKING'])['count']
+    assert walking == by_type['count'][by_type['labels']['type'].index('WALKING')]
+    assert cube.query(start=day_number('2100-01-01'))['count'] == 0
+    with pytest.raises(ValueError):
+        cube.query(by=['day', 'hour', 'type'])
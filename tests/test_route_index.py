@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from data_extraction import extract_timeline_data
+from place_clustering import grid_cells
+from route_index import GRID_METERS, RouteIndex, update_route_index
+from tests.factories import activity_segment, visit_segment, write_export
+
+def _unlocated_start(segment):
+    del segment['activity']['start']
+    return segment
+
+@pytest.fixture
+def routes_store(workspace):
+    segments = [
+        visit_segment('2016-01-04T08:00:00+00:00', 60, 51.5, -0.1, place_id='home'),
+        # Leaves home without start coordinates: snapped to home, but not located
+        _unlocated_start(activity_segment('2016-01-04T09:00:00+00:00', 20, end_point=(51.6, -0.2))),
+        visit_segment('2016-01-04T09:20:00+00:00', 60, 51.6, -0.2, place_id='work'),
+        activity_segment('2016-01-04T10:20:00+00:00', 20, start_point=(51.502, -0.1), end_point=(51.6, -0.2)),
+        visit_segment('2016-01-04T10:40:00+00:00', 60, 51.6, -0.2, place_id='home'),
+        # No visit brackets this one, so both ends fall back to grid cells
+        activity_segment('2016-02-01T12:00:00+00:00', 20, start_point=(40.0, 3.0), end_point=(40.1, 3.1))
+    ]
+    timeline = write_export(workspace / 'data' / 'Timeline.json', segments)
+    store_dir = str(workspace / 'store')
+    extract_timeline_data(timeline, str(workspace / 'extracted.json'), store_dir=store_dir)
+    return store_dir
+
+def test_node_centroids_average_located_endpoints_only(routes_store):
+    assert update_route_index(routes_store) == 2
+    index = RouteIndex(routes_store)
+    nodes = {str(node): i for i, node in enumerate(index.nodes)}
+    # Home's unlocated origin does not pull it halfway towards 0, 0
+    assert index.node_lat[nodes['place:home']] == pytest.approx(51.6)
+    assert index.node_lng[nodes['place:home']] == pytest.approx(-0.2)
+    assert index.node_lat[nodes['place:work']] == pytest.approx((51.6 + 51.502) / 2)
+    assert index.matrix().sum() == 3
+
+def test_unbracketed_endpoints_snap_to_grid_cells(routes_store):
+    update_route_index(routes_store)
+    routes = RouteIndex(routes_store).top_routes(k=10)
+    rows, cols = grid_cells(np.array([40.0]), np.array([3.0]), GRID_METERS)
+    assert f'cell:{rows[0]}:{cols[0]}' in [route['origin']['id'] for route in routes]
+
+def test_unchanged_months_are_not_recomputed(routes_store):
+    assert update_route_index(routes_store) == 2
+    assert update_route_index(routes_store) == 0
+    assert update_route_index(routes_store, force=True) == 2
@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+from data_extraction import parse_segment
+from segment_index import MS_PER_DAY, MS_PER_MINUTE, IntervalList, SegmentIndex, parse_daily_window
+from timeline_store import write_store
+from tests.factories import visit_segment
+
+def _scan(index, start=None, end=None, daily=None, weekdays=None, **keys):
+    """Rows matching a query, checked one segment at a time"""
+    timed = start is not None or end is not None
+    rows = []
+    for row in range(len(index)):
+        dated = row < index.dated
+        if (timed or daily is not None or weekdays is not None) and not dated:
+            continue
+        if start is not None and index.end[row] < start:
+            continue
+        if end is not None and index.start[row] > end:
+            continue
+        if any(wanted is not None and index.segments[np.array([row])].decode(column)[0] not in wanted
+               for column, wanted in keys.items()):
+            continue
+        if (daily is not None or weekdays is not None) and not _in_window(index, row, daily, weekdays):
+            continue
+        rows.append(row)
+    return rows
+
+def _in_window(index, row, daily, weekdays):
+    window_start, window_end = daily or (0, 1440)
+    if window_end <= window_start:
+        window_end += 1440
+    offset = int(index.offset[row]) * MS_PER_MINUTE
+    local_start, local_end = int(index.start[row]) + offset, int(index.end[row]) + offset
+    for day in range(local_start // MS_PER_DAY - 1, local_end // MS_PER_DAY + 1):
+        if weekdays is not None and (day + 3) % 7 not in weekdays:
+            continue
+        if (day * MS_PER_DAY + window_start * MS_PER_MINUTE <= local_end
+                and day * MS_PER_DAY + window_end * MS_PER_MINUTE >= local_start):
+            return True
+    return False
+
+@pytest.fixture(scope='module')
+def intervals():
+    rng = np.random.default_rng(5)
+    start = np.sort(rng.integers(0, 30 * MS_PER_DAY, 2000))
+    # Mostly short intervals with a few spanning days, and some instants
+    duration = rng.choice([0, 5, 45, 300, 4000], 2000) * MS_PER_MINUTE
+    return start, start + duration
+
+def test_interval_list_matches_a_scan(intervals):
+    start, end = intervals
+    index = IntervalList(np.arange(len(start)), start, end)
+    rng = np.random.default_rng(6)
+    for query_start in rng.integers(-MS_PER_DAY, 31 * MS_PER_DAY, 50):
+        query_end = query_start + int(rng.integers(0, 3 * MS_PER_DAY))
+        expected = np.flatnonzero((start <= query_end) & (end >= query_start))
+        np.testing.assert_array_equal(index.overlapping(query_start, query_end), expected)
+    np.testing.assert_array_equal(index.overlapping(), np.arange(len(start)))
+
+def test_empty_interval_list():
+    empty = np.empty(0, np.int64)
+    assert len(IntervalList(empty, empty, empty).overlapping(0, 1)) == 0
+
+@pytest.mark.parametrize('value, expected', [('09:00-17:30', (540, 1050)), ('22-6', (1320, 360)),
+                                             ('0:00-24:00', (0, 1440))])
+def test_parse_daily_window(value, expected):
+    assert parse_daily_window(value) == expected
+
+@pytest.mark.parametrize('value', ['25:00-26:00', '09:60-10:00', '24:01-01:00', '9-x', '09:00'])
+def test_parse_daily_window_rejects_malformed_values(value):
+    with pytest.raises(ValueError):
+        parse_daily_window(value)
+
+def test_queries_match_a_scan_of_the_store(store):
+    visits = SegmentIndex('visits', store)
+    activities = SegmentIndex('activities', store)
+    assert len(visits) and len(activities)
+    assert (np.diff(visits.start) >= 0).all()
+
+    first, last = int(visits.start[0]), int(visits.start[visits.dated - 1])
+    middle = (first + last) // 2
+    place_id = next(iter(visits.values('place_id')))
+    semantic_types = list(visits.values('semantic_type'))[:2]
+    activity_type = next(iter(activities.values('type')))
+    queries = [
+        (visits, {}),
+        (visits, {'start': middle}),
+        (visits, {'end': middle}),
+        (visits, {'start': middle, 'end': middle + 7 * MS_PER_DAY}),
+        (visits, {'place_id': place_id}),
+        (visits, {'place_id': [place_id, 'unknown'], 'start': middle}),
+        (visits, {'semantic_type': semantic_types, 'end': middle}),
+        (visits, {'daily': (9 * 60, 17 * 60)}),
+        (visits, {'daily': (22 * 60, 6 * 60), 'weekdays': [5, 6]}),
+        (visits, {'weekdays': [0], 'semantic_type': semantic_types, 'start': first, 'end': middle}),
+        (activities, {'type': activity_type}),
+        (activities, {'type': ['unknown']}),
+        (activities, {'start': middle, 'end': middle + 30 * MS_PER_DAY, 'daily': (7 * 60, 9 * 60)}),
+    ]
+    for index, query in queries:
+        expected = _scan(index, **{column: [value] if isinstance(value, str) else value
+                                   for column, value in query.items()})
+        assert index.query(**query).tolist() == expected, query
+
+def test_values_count_rows_most_frequent_first(store):
+    visits = SegmentIndex('visits', store)
+    counts = visits.values('place_id')
+    assert sum(counts.values()) == len(visits)
+    assert list(counts.values()) == sorted(counts.values(), reverse=True)
+
+def test_undated_visits_only_match_untimed_queries(tmp_path):
+    store_dir = str(tmp_path / 'store')
+    segments = [visit_segment(None, place_id='a'),
+                visit_segment('2016-01-04T23:30:00+02:00', place_id='a'),
+                visit_segment('2016-01-05T12:00:00+00:00', place_id='b')]
+    write_store([parse_segment(segment)[1] for segment in segments], [], store_dir)
+    visits = SegmentIndex('visits', store_dir)
+
+    assert visits.dated == 2
+    assert visits.segments.decode('place_id').tolist() == ['a', 'b', 'a']
+    assert visits.query(place_id='a').tolist() == [0, 2]
+    assert visits.query(place_id='a', start=0).tolist() == [0]
+    # 23:30 local on a Monday, though already Monday 21:30 in UTC
+    assert visits.query(daily=(23 * 60, 24 * 60)).tolist() == [0]
+    assert visits.query(weekdays=[0], place_id='a').tolist() == [0]
+    with pytest.raises(ValueError):
+        visits.query(type='WALKING')
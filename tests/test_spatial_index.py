@@ -0,0 +1,52 @@
+import json
+import numpy as np
+from data_extraction import extract_timeline_data
+from spatial_index import SpatialIndex, build_spatial_index, mercator_cells, tile_bounds
+from timeline_store import load_segments
+from tests.factories import visit_segment, write_export
+
+def test_world_tile_holds_every_located_visit(store):
+    build_spatial_index(store)
+    index = SpatialIndex(store)
+    visits = load_segments('visits', ['lat', 'lng', 'start_time', 'end_time'], store)
+    located = int((~np.isnan(visits.lat) & ~np.isnan(visits.lng)).sum())
+
+    tile = index.query_tile(0, 0, 0)
+    assert tile['clustered']
+    assert sum(tile['visits']['count']) == located
+    assert len(tile['activities']['id']) > 0
+
+def test_high_zoom_tiles_are_raw(store):
+    build_spatial_index(store)
+    tile = SpatialIndex(store).query_tile(22, 0, 0)
+    assert not tile['clustered']
+    assert tile['visits']['lat'] == []
+
+def test_raw_tiles_match_a_full_scan(store):
+    build_spatial_index(store)
+    index = SpatialIndex(store)
+    visits, activities = index.visits, index.activities
+    for zoom in (13, 16):
+        x, y = (int(cell[0]) for cell in mercator_cells(visits.lat[:1], visits.lng[:1], zoom))
+        west, south, east, north = tile_bounds(zoom, x, y)
+
+        def inside(lat, lng):
+            return (lat >= south) & (lat < north) & (lng >= west) & (lng < east)
+        tile = index.query_tile(zoom, x, y)
+        assert tile['visits']['lat'] == visits.lat[inside(visits.lat, visits.lng)].tolist()
+        assert len(tile['visits']['lat']) > 0
+        touching = inside(activities.start_lat, activities.start_lng) | inside(activities.end_lat, activities.end_lng)
+        assert tile['activities']['id'] == np.flatnonzero(touching).tolist()
+
+def test_raw_tile_of_a_visit_without_an_end_time_is_valid_json(workspace):
+    open_visit = visit_segment('2016-01-01T08:00:00+00:00')
+    del open_visit['endTime']
+    timeline = write_export(workspace / 'Timeline.json', [open_visit])
+    store_dir = str(workspace / 'store')
+    extract_timeline_data(timeline, str(workspace / 'extracted.json'), store_dir=store_dir)
+    build_spatial_index(store_dir)
+
+    x, y = (int(cell[0]) for cell in mercator_cells(np.array([51.5]), np.array([-0.12]), 16))
+    tile = SpatialIndex(store_dir).query_tile(16, x, y)
+    assert tile['visits']['dwell_hours'] == [0.0]
+    json.loads(json.dumps(tile, allow_nan=False))
@@ -0,0 +1,98 @@
+import os
+import pyarrow as pa
+from data_extraction import parse_segment
+from timeline_store import (UNDATED, StoreWriter, load_manifest, partition_path, read_table, replace_days,
+                            save_manifest, table_paths, write_arrow, write_store)
+from tests.factories import visit_segment
+
+def _visits(*segments):
+    return [parse_segment(segment)[1] for segment in segments]
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def _place_ids(store_dir):
+    return read_table('visits', ['place_id'], store_dir).column('place_id').to_pylist()
+
+def test_replace_days_rewrites_only_the_touched_month(tmp_path):
+    store_dir = str(tmp_path / 'store')
+    write_store(_visits(visit_segment('2016-01-01T09:00:00+00:00', place_id='a'),
+                        visit_segment('2016-01-02T09:00:00+00:00', place_id='b'),
+                        visit_segment('2016-03-05T09:00:00+00:00', place_id='c')), [], store_dir)
+    march = partition_path('visits', '2016-03', store_dir)
+    before = _read(march)
+    march_mtime = os.stat(march).st_mtime_ns
+
+    replace_days('visits', _visits(visit_segment('2016-01-02T10:00:00+00:00', place_id='b2')), ['2016-01-02'],
+                 store_dir)
+
+    assert _place_ids(store_dir) == ['a', 'b2', 'c']
+    assert _read(march) == before
+    assert os.stat(march).st_mtime_ns == march_mtime
+
+def test_replace_days_keeps_rows_in_start_time_order(tmp_path):
+    store_dir = str(tmp_path / 'store')
+    write_store(_visits(visit_segment('2016-01-01T09:00:00+00:00', place_id='a'),
+                        visit_segment('2016-01-03T09:00:00+00:00', place_id='c')), [], store_dir)
+    replace_days('visits', _visits(visit_segment('2016-01-02T09:00:00+00:00', place_id='b')), ['2016-01-02'],
+                 store_dir)
+    assert _place_ids(store_dir) == ['a', 'b', 'c']
+
+def test_replace_days_removes_emptied_partitions(tmp_path):
+    store_dir = str(tmp_path / 'store')
+    write_store(_visits(visit_segment('2016-01-01T09:00:00+00:00', place_id='a'),
+                        visit_segment('2016-02-01T09:00:00+00:00', place_id='b')), [], store_dir)
+    replace_days('visits', [], ['2016-02-01'], store_dir)
+    assert [os.path.basename(path) for path in table_paths('visits', store_dir)] == ['2016-01.arrow']
+
+def test_replace_days_handles_undated_rows(tmp_path):
+    store_dir = str(tmp_path / 'store')
+    write_store(_visits(visit_segment('2016-01-01T09:00:00+00:00', place_id='a'),
+                        visit_segment(None, place_id='lost')), [], store_dir)
+    assert os.path.exists(partition_path('visits', UNDATED, store_dir))
+    january = _read(partition_path('visits', '2016-01', store_dir))
+
+    replace_days('visits', _visits(visit_segment(None, place_id='found')), [UNDATED], store_dir)
+    assert sorted(_place_ids(store_dir)) == ['a', 'found']
+    assert _read(partition_path('visits', '2016-01', store_dir)) == january
+
+    replace_days('visits', [], [UNDATED], store_dir)
+    assert _place_ids(store_dir) == ['a']
+    assert not os.path.exists(partition_path('visits', UNDATED, store_dir))
+
+def test_store_writer_saves_or_drops_the_manifest(tmp_path):
+    store_dir = str(tmp_path / 'store')
+    manifest = {'watermark': '2016-01-01T10:00:00+00:00', 'partitions': {'2016-01-01': {'hash': 'x'}}}
+    write_store(_visits(visit_segment('2016-01-01T09:00:00+00:00')), [], store_dir, manifest)
+    assert load_manifest(store_dir) == manifest
+
+    # A store written without one must not keep the old, unrelated manifest
+    write_store(_visits(visit_segment('2016-01-01T09:00:00+00:00')), [], store_dir)
+    assert load_manifest(store_dir) == {'watermark': None, 'partitions': {}}
+
+def test_aborted_writer_keeps_the_previous_store(tmp_path):
+    store_dir = str(tmp_path / 'store')
+    write_store(_visits(visit_segment('2016-01-01T09:00:00+00:00', place_id='a')), [], store_dir)
+    save_manifest({'watermark': None, 'partitions': {'kept': {}}}, store_dir)
+    try:
+        with StoreWriter(store_dir) as writer:
+            writer.add('visits', _visits(visit_segment('2016-02-01T09:00:00+00:00', place_id='b'))[0])
+            raise RuntimeError('interrupted')
+    except RuntimeError:
+        pass
+    assert _place_ids(store_dir) == ['a']
+    assert load_manifest(store_dir)['partitions'] == {'kept': {}}
+    assert not os.path.exists(store_dir + '.tmp')
+
+def test_write_arrow_replaces_files_atomically(tmp_path):
+    path = str(tmp_path / 'table.arrow')
+    write_arrow(path, pa.concat_tables([pa.table({'x': [1, 2]}), pa.table({'x': [3]})]))
+    mapped = pa.ipc.open_file(pa.memory_map(path))
+    assert mapped.num_record_batches == 1
+
+    write_arrow(path, pa.table({'x': [4]}))
+    # The open reader keeps the previous file's contents
+    assert mapped.read_all().column('x').to_pylist() == [1, 2, 3]
+    assert pa.ipc.open_file(pa.memory_map(path)).read_all().column('x').to_pylist() == [4]
+    assert os.listdir(tmp_path) == ['table.arrow']
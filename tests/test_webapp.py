@@ -0,0 +1,105 @@
+import gzip
+import importlib
+import json
+import pytest
+from artifacts import precompress
+
+@pytest.mark.parametrize('bbox, found', [('-1,51,1,52', True), ('179,-10,-179,10', False)])
+def test_markers_in_bbox(store, client, bbox, found):
+    response = client.get(f'/api/markers?bbox={bbox}')
+    assert response.status_code == 200
+    assert (response.get_json()['count'] > 0) == found
+
+@pytest.mark.parametrize('bbox', ['1,2,3', '1,2,3,4,5', 'nan,50,1,52', '-1,50,inf,52', 'a,b,c,d', ','])
+def test_markers_reject_malformed_bbox(store, client, bbox):
+    response = client.get(f'/api/markers?bbox={bbox}')
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+def test_places_limit(store, client):
+    places = client.get('/api/places?min_visits=2').get_json()['places']
+    assert len(places) > 2
+    assert client.get('/api/places?min_visits=2&limit=2').get_json()['places'] == places[:2]
+    assert client.get('/api/places?min_visits=2&limit=0').get_json()['places'] == []
+
+@pytest.mark.parametrize('query', ['limit=-2', 'limit=x', 'eps=5', 'min_visits=0'])
+def test_places_reject_out_of_range_parameters(store, client, query):
+    assert client.get(f'/api/places?{query}').status_code == 400
+
+def _reextract(workspace, seed):
+    from data_extraction import extract_timeline_data
+    from synthetic_timeline import write_timeline
+    timeline = write_timeline(str(workspace / 'data' / 'other.json'), 400, seed=seed)
+    extract_timeline_data(timeline, str(workspace / 'data' / 'extracted_timeline.json'),
+                          store_dir=str(workspace / 'data' / 'timeline_store'))
+
+# High-zoom tiles are cut from the store itself, so they follow it as well
+@pytest.mark.parametrize('url, build, reads_store', [
+    ('/api/tiles/13/4093/2724.json', 'spatial_index.build_spatial_index', True),
+    ('/api/routes/top?k=5', 'route_index.update_route_index', False),
+    ('/api/rollups/visits?by=weekday', 'rollups.build_rollups', False)
+])
+def test_index_routes_follow_their_artifact(store, client, workspace, url, build, reads_store):
+    module, name = build.split('.')
+    build = getattr(importlib.import_module(module), name)
+    assert client.get(url).status_code == 503
+
+    build()
+    first = client.get(url)
+    assert first.status_code == 200
+
+    # The store changes before the stage rebuilds: the old artifact is still served
+    _reextract(workspace, seed=4)
+    stale = client.get(url)
+    assert stale.status_code == 200
+    assert (stale.get_etag() != first.get_etag()) == reads_store
+
+    # Once rebuilt, the cached response is dropped
+    build()
+    rebuilt = client.get(url, headers={'If-None-Match': first.headers['ETag']})
+    assert rebuilt.status_code == 200
+    assert rebuilt.get_etag() != first.get_etag()
+
+def test_analysis_files_are_served_from_their_compressed_copy(client, workspace):
+    path = workspace / 'output' / 'location_analysis.html'
+    path.write_text('<div class="marker"></div>\n' * 200)
+    precompress(str(path))
+
+    plain = client.get('/static/analysis/location_analysis.html')
+    assert plain.status_code == 200 and 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.vary
+
+    compressed = client.get('/static/analysis/location_analysis.html', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(compressed.data) == plain.data
+    assert compressed.get_etag() != plain.get_etag()
+
+    for response, encoding in ((plain, 'identity'), (compressed, 'gzip')):
+        revalidated = client.get('/static/analysis/location_analysis.html',
+                                 headers={'Accept-Encoding': encoding, 'If-None-Match': response.headers['ETag']})
+        assert revalidated.status_code == 304
+
+    assert client.get('/static/analysis/missing.html').status_code == 404
+    assert client.get('/static/analysis/../data/Timeline.json').status_code == 404
+
+def test_api_responses_are_gzipped_with_weak_etags(store, client):
+    plain = client.get('/api/markers?bbox=-180,-90,180,90')
+    assert 'Content-Encoding' not in plain.headers and len(plain.data) > 1024
+    compressed = client.get('/api/markers?bbox=-180,-90,180,90', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(compressed.data) == plain.data
+    assert compressed.get_etag() == plain.get_etag()
+    assert compressed.get_etag()[1] and 'Accept-Encoding' in compressed.vary
+
+    revalidated = client.get('/api/markers?bbox=-180,-90,180,90', headers={'If-None-Match': plain.headers['ETag']})
+    assert revalidated.status_code == 304
+
+def test_uncached_responses_are_gzipped_after_the_fact(store, client):
+    client.get('/api/markers?bbox=-1,51,1,52')
+    client.get('/api/places')
+    plain = client.get('/metrics')
+    assert 'Content-Encoding' not in plain.headers and len(plain.data) > 1024
+    compressed = client.get('/metrics', headers={'Accept-Encoding': 'gzip;q=1.0'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert compressed.get_etag() == (None, None)
+    assert json.loads(gzip.decompress(compressed.data))['stages'].keys() >= {'http.api_markers', 'http.metrics'}